@@ -3,6 +3,7 @@ from django.core import mail
 from rest_framework import viewsets, serializers, decorators
 from rest_framework.response import Response
 from rest_framework.routers import DefaultRouter
+from karmen.cache import two_tier_cache
 
 
 class DebuggingViewSet(viewsets.ViewSet):
@@ -25,3 +26,8 @@ class DebuggingViewSet(viewsets.ViewSet):
             ])
 
         return Response(response)
+
+    @decorators.action(detail=False, methods=['get'])
+    def cache(self, request):
+        '''Hit / miss counters of two-tier cache in this process.'''
+        return Response(two_tier_cache.stats())
@@ -0,0 +1,74 @@
+'''
+Background analysis of uploaded files
+
+Metadata extracted by `files.gcode.analyze` are stored per `Blob`, i.e. once
+per content no matter how many `File`s share it. A new blob is analyzed once
+the upload is committed (see `files.signals`) in a process-wide thread pool,
+so uploads do not wait for it. `Blob.metadata` is `None` until the analysis is
+finished, blobs which could not be analyzed get `{'error': ...}`.
+
+`manage.py analyze_files` analyzes blobs which were missed (e.g. when the
+process was restarted before the analysis finished).
+'''
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from threading import Lock
+from django.conf import settings
+from django.db import transaction, close_old_connections
+from karmen.versions import touch
+from files.gcode import analyze
+from files.models import Blob
+from files.storage import open_blob
+
+
+logger = getLogger()
+
+_executor = None
+_executor_lock = Lock()
+
+
+def get_executor():
+    '''thread pool running the analyses of the process'''
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.FILE_ANALYSIS_MAX_CONCURRENCY,
+                    thread_name_prefix='file-analysis',
+                )
+    return _executor
+
+
+def schedule_analysis(digest):
+    '''analyzes blob `digest` in background once the current transaction is committed'''
+    transaction.on_commit(lambda: get_executor().submit(run_analysis, digest))
+
+
+def analyze_blob(blob):
+    '''analyzes `blob` and stores its metadata, returns them'''
+    try:
+        with open_blob(blob) as content:
+            metadata = analyze(content)
+    except FileNotFoundError:
+        return None  # deleted meanwhile
+    except Exception as e:  # pylint: disable=broad-except
+        logger.exception('Analysis of blob %s failed.', blob.digest)
+        metadata = {'error': str(e)[:255]}
+    blob.metadata = metadata
+    Blob.objects.filter(digest=blob.digest).update(metadata=metadata)
+    touch('files.blob')  # (metadata of files changed)
+    return metadata
+
+
+def run_analysis(digest):
+    '''analyzes blob `digest` unless it is analyzed already (runs in the thread pool)'''
+    close_old_connections()
+    try:
+        blob = Blob.objects.filter(digest=digest, metadata__isnull=True).first()
+        if blob is not None:
+            analyze_blob(blob)
+    except Exception:  # pylint: disable=broad-except
+        logger.exception('Analysis of blob %s failed.', digest)
+    finally:
+        close_old_connections()
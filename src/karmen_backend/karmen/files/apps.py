@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class FilesConfig(AppConfig):
     name = 'files'
+
+    def ready(self):
+        # pylint: disable=import-outside-toplevel,unused-import
+        from files import signals
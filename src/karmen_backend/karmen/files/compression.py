@@ -0,0 +1,161 @@
+'''
+Seekable gzip compression of stored blobs
+
+A blob is compressed as a single standard gzip member (so it can be served
+as is with `Content-Encoding: gzip`), the deflate stream is fully flushed after
+every `frameSize` bytes of content. Decompression can start at any such flush
+point, the compressed offsets of the frames are kept in the blob's index:
+
+    {'frameSize': 1048576, 'offsets': [10, 181233, 362871, ...]}
+
+`GzipBlobReader` uses the index to read the content from any position without
+decompressing what precedes its frame (e.g. for range requests).
+'''
+import io
+import struct
+import zlib
+from tempfile import TemporaryFile
+from django.conf import settings
+
+
+GZIP = 'gzip'
+
+GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+'''gzip member header - deflate, no flags, no mtime, unknown OS'''
+
+READ_BLOCK_SIZE = 64 * 1024
+'''bytes read (and decompressed) at once'''
+
+MIN_SAVING = 0.1
+'''content is stored compressed only if it saves at least this fraction of its size'''
+
+
+def compress(content):
+    '''
+    Compresses django `File` `content` to a temporary file.
+
+    Returns (temporary file, index) or `None` when the content does not
+    compress well. Memory use does not depend on the size of the content.
+    '''
+    frame_size = settings.BLOB_COMPRESSION_FRAME_SIZE
+    compressor = zlib.compressobj(settings.BLOB_COMPRESSION_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+    output = TemporaryFile(dir=settings.FILE_UPLOAD_TEMP_DIR)
+    output.write(GZIP_HEADER)
+    offsets = [output.tell()]
+    crc = size = in_frame = 0
+    content.seek(0)
+    for chunk in content.chunks(READ_BLOCK_SIZE):
+        chunk = memoryview(chunk)
+        while chunk:
+            part, chunk = chunk[:frame_size - in_frame], chunk[frame_size - in_frame:]
+            crc = zlib.crc32(part, crc)
+            size += len(part)
+            in_frame += len(part)
+            output.write(compressor.compress(part))
+            if in_frame == frame_size:
+                output.write(compressor.flush(zlib.Z_FULL_FLUSH))
+                offsets.append(output.tell())
+                in_frame = 0
+    output.write(compressor.flush())
+    output.write(struct.pack('<II', crc, size & 0xffffffff))
+    content.seek(0)
+    if output.tell() > size * (1 - MIN_SAVING):
+        output.close()
+        return None
+    output.seek(0)
+    return output, {'frameSize': frame_size, 'offsets': offsets}
+
+
+class GzipBlobReader(io.RawIOBase):
+    '''
+    Reads (uncompressed) content of a compressed blob from binary `file`.
+
+    Seeking is cheap - reading continues from the nearest preceding flush
+    point of the index. `len` is the size of the content (used by
+    requests_toolbelt to compute the size of multipart uploads).
+    '''
+
+    def __init__(self, file, size, index):
+        super().__init__()
+        self.file = file
+        self.size = size
+        self.frame_size = index['frameSize']
+        self.offsets = index['offsets']
+        self.position = 0
+        self.buffer = b''
+        '''decompressed content starting at `position`'''
+        self.decompressor = None
+
+    @property
+    def len(self):
+        return self.size
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        offset = max(0, offset)
+        if offset != self.position:
+            self.position = offset
+            self.buffer = b''
+            self.decompressor = None
+        return self.position
+
+    def _decompress(self):
+        '''next block of content from the decompressor (empty at the end)'''
+        while not self.decompressor.eof:
+            data = self.decompressor.unconsumed_tail or self.file.read(READ_BLOCK_SIZE)
+            if not data:
+                break
+            block = self.decompressor.decompress(data, READ_BLOCK_SIZE)
+            if block:
+                return block
+        return b''
+
+    def _fill(self):
+        if self.position >= self.size:
+            return
+        skip = 0
+        if self.decompressor is None:
+            frame = self.position // self.frame_size
+            self.file.seek(self.offsets[frame])
+            self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            skip = self.position - frame * self.frame_size
+        while True:
+            block = self._decompress()
+            if not block:
+                raise EOFError('Compressed blob is truncated.')
+            if skip < len(block):
+                self.buffer = block[skip:]
+                return
+            skip -= len(block)
+
+    def peek(self, size=0):  # pylint: disable=unused-argument
+        '''buffered content (lets `readline` read more than a byte at once)'''
+        if not self.buffer:
+            self._fill()
+        return self.buffer
+
+    def readinto(self, buffer):
+        if not self.buffer:
+            self._fill()
+        count = min(len(buffer), len(self.buffer))
+        buffer[:count] = self.buffer[:count]
+        self.buffer = self.buffer[count:]
+        self.position += count
+        return count
+
+    def close(self):
+        if not self.closed:
+            self.file.close()
+        super().close()
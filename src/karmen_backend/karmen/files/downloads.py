@@ -0,0 +1,138 @@
+'''
+Downloads of stored files
+
+Behind nginx (`MEDIA_ACCEL_REDIRECT_URL` is set) the API only checks access to
+the file and hands the stored blob over to nginx with `X-Accel-Redirect`. nginx
+then sends it (using `sendfile`, with range requests) and the worker is free
+right away. See the internal location in `scripts/nginx.conf.template`.
+
+Otherwise (development server, or compressed blob for a client which does not
+accept its encoding) the content is streamed by django. Single byte ranges
+(`Range`, `If-Range`) are supported so that downloads can be resumed.
+'''
+import re
+from urllib.parse import quote
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from files.storage import open_blob
+
+
+BLOCK_SIZE = 64 * 1024
+'''bytes read and sent at once when streamed by django'''
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def accepts_encoding(request, encoding):
+    '''whether `Accept-Encoding` of `request` allows `encoding`'''
+    for item in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        name, _, params = item.partition(';')
+        if name.strip() == encoding:
+            params = params.replace(' ', '')
+            if not params.startswith('q='):
+                return True
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False  # (invalid quality value is taken as q=0)
+    return False
+
+
+def parse_range(header, size):
+    '''
+    Returns (first byte, last byte) of a single byte range `header` of content
+    of `size` bytes, `None` if the header should be ignored (multiple or
+    invalid ranges). Raises `ValueError` if the range is not satisfiable.
+    '''
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        # suffix range - the last bytes
+        if int(last) == 0:
+            raise ValueError('Empty suffix range.')
+        return max(0, size - int(last)), size - 1
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first >= size:
+        raise ValueError('Range starts after the end of the content.')
+    if last < first:
+        return None
+    return first, last
+
+
+def content_disposition(filename):
+    try:
+        filename.encode('ascii')
+        return 'attachment; filename="%s"' % filename.replace('\\', '\\\\').replace('"', '\\"')
+    except UnicodeEncodeError:
+        return "attachment; filename*=utf-8''%s" % quote(filename)
+
+
+def iter_content(file, start, length):
+    '''yields `length` bytes of `file` from `start` in blocks, closes the file'''
+    try:
+        file.seek(start)
+        while length > 0:
+            block = file.read(min(BLOCK_SIZE, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+    finally:
+        file.close()
+
+
+def stream_response(file, size, request, etag):
+    '''streams open binary `file` of `size` bytes (or its range requested by `request`)'''
+    byte_range = None
+    if 'HTTP_RANGE' in request.META and request.META.get('HTTP_IF_RANGE', etag) == etag:
+        try:
+            byte_range = parse_range(request.META['HTTP_RANGE'], size)
+        except ValueError:
+            file.close()
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%s' % size
+            return response
+    if byte_range is None:
+        start, length, status = 0, size, 200
+    else:
+        start, length, status = byte_range[0], byte_range[1] - byte_range[0] + 1, 206
+    response = StreamingHttpResponse(
+        iter_content(file, start, length), status=status, content_type='application/octet-stream')
+    if byte_range is not None:
+        response['Content-Range'] = 'bytes %s-%s/%s' % (byte_range[0], byte_range[1], size)
+    response['Content-Length'] = length
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    return response
+
+
+def blob_response(blob, request, filename=''):
+    '''
+    Response with content of `blob` (as attachment `filename` if given).
+
+    Compressed blobs are sent as they are stored (with `Content-Encoding`)
+    when the client accepts their encoding, decompressed otherwise.
+    '''
+    encoded = bool(blob.encoding) and accepts_encoding(request, blob.encoding)
+    if encoded or not blob.encoding:
+        if settings.MEDIA_ACCEL_REDIRECT_URL:
+            response = HttpResponse(content_type='application/octet-stream')
+            response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT_URL + quote(blob.name)
+        else:
+            stored = default_storage.open(blob.name, 'rb')
+            etag = '"%s%s"' % (blob.digest, '-' + blob.encoding if encoded else '')
+            response = stream_response(stored, stored.size, request, etag)
+    else:
+        response = stream_response(open_blob(blob), blob.size, request, '"%s"' % blob.digest)
+    if encoded:
+        response['Content-Encoding'] = blob.encoding
+    if blob.encoding:
+        patch_vary_headers(response, ('Accept-Encoding',))
+    if filename:
+        response['Content-Disposition'] = content_disposition(filename)
+    return response
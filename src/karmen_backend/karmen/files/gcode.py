@@ -0,0 +1,220 @@
+'''
+Streaming G-code analyzer
+
+`analyze(stream)` reads G-code line by line (memory use does not depend on the
+size of the file) and returns its metadata:
+
+- `slicer` - name and version of the slicer which generated the file,
+- `layers` - number of layers,
+- `estimatedTime` - estimated print time in seconds,
+- `filamentLength` - length of extruded filament in mm,
+- `boundingBox` - extents of extruding moves in mm (`minX`, `maxX`, ...),
+- `settings` - slicer settings found in comments (`; key = value`).
+
+Values announced by the slicer in comments (PrusaSlicer / Slic3r and Cura
+formats) are preferred, the rest is computed from the moves. The computed print
+time ignores accelerations so it is a lower estimate.
+'''
+import re
+from math import sqrt
+
+
+MAX_LINE_LENGTH = 4096
+'''longer lines are truncated (the rest of the line is skipped)'''
+
+MAX_SETTINGS = 1000
+'''the most settings kept from comments'''
+
+MAX_SETTING_LENGTH = 255
+'''longer setting values are truncated'''
+
+WORD_RE = re.compile(r'([A-Z])\s*([-+]?(?:\d+\.?\d*|\.\d+))')
+SLICER_RE = re.compile(r'^generated (?:by|with) (.+?)(?: on \d.*)?$', re.IGNORECASE)
+DURATION_RE = re.compile(r'(\d+)\s*([dhms])')
+SETTING_RE = re.compile(r'^([^=:]*[A-Za-z][^=:]*?)\s*(=|:)\s*(.*)$')
+
+DURATION_UNITS = {'d': 86400, 'h': 3600, 'm': 60, 's': 1}
+AXES = ('X', 'Y', 'Z')
+MARKERS = {'LAYER', 'LAYER_COUNT', 'TIME', 'TIME_ELAPSED', 'Filament used', 'TYPE', 'MESH'}
+'''Cura comments in `key:value` format which are not settings'''
+
+
+def parse_duration(value):
+    '''seconds of `1d 2h 3m 4s` duration'''
+    return sum(int(count) * DURATION_UNITS[unit] for count, unit in DURATION_RE.findall(value))
+
+
+class GcodeAnalyzer(object):
+    '''
+    Keeps the state of the machine while G-code lines are fed to it.
+
+    Only the current position and running totals are kept, so the memory use is
+    constant (but for at most `MAX_SETTINGS` settings).
+    '''
+
+    def __init__(self):
+        self.position = {'X': 0.0, 'Y': 0.0, 'Z': 0.0, 'E': 0.0}
+        self.absolute = True
+        self.absolute_extrusion = True
+        self.scale = 1.0
+        self.feedrate = None
+        '''mm / min'''
+        self.header = True
+        '''until the first command, Cura writes some settings as `;key:value`'''
+
+        self.time = 0.0
+        self.filament = 0.0
+        self.layers = 0
+        self.layer_z = None
+        self.layer_markers = 0
+        self.bounds = None
+        '''[min x, min y, min z, max x, max y, max z] of extruding moves'''
+        self.settings = {}
+        self.slicer = None
+        self.slicer_time = None
+        self.slicer_filament = None
+        self.slicer_layers = None
+
+    def feed(self, line):
+        '''processes single line (str)'''
+        command, _, comment = line.partition(';')
+        comment = comment.strip()
+        if comment:
+            self.comment(comment)
+        command = command.strip().upper()
+        if command:
+            self.header = False
+            words = WORD_RE.findall(command)
+            if words and words[0][0] == 'N':  # line number
+                words = words[1:]
+            if words:
+                self.command(words[0][0] + str(int(float(words[0][1]))), {
+                    letter: float(value) for letter, value in words[1:]
+                })
+
+    def comment(self, comment):
+        if comment in ('LAYER_CHANGE', 'AFTER_LAYER_CHANGE') or comment.startswith('LAYER:'):
+            if comment != 'AFTER_LAYER_CHANGE':
+                self.layer_markers += 1
+            return
+        match = SLICER_RE.match(comment)
+        if match:
+            if self.slicer is None:
+                self.slicer = match.group(1).strip()
+            return
+        match = SETTING_RE.match(comment)
+        if not match:
+            return
+        key, separator, value = match.group(1).strip(), match.group(2), match.group(3).strip()
+        try:
+            if key == 'TIME':
+                self.slicer_time = int(float(value))
+            elif key.startswith('estimated printing time') and '(normal mode)' in key:
+                self.slicer_time = parse_duration(value)
+            elif key == 'LAYER_COUNT':
+                self.slicer_layers = int(value)
+            elif key == 'filament used [mm]':
+                self.slicer_filament = sum(float(length) for length in value.split(','))
+            elif key == 'Filament used':
+                self.slicer_filament = sum(float(length.strip().rstrip('m')) for length in value.split(',')) * 1000
+        except ValueError:
+            pass
+        if separator == ':' and (not self.header or key in MARKERS):
+            return
+        if key in self.settings or len(self.settings) < MAX_SETTINGS:
+            self.settings[key] = value[:MAX_SETTING_LENGTH]
+
+    def command(self, code, args):
+        if code in ('G0', 'G1', 'G2', 'G3'):
+            self.move(args)
+        elif code == 'G4':
+            self.time += args.get('P', 0) / 1000 + args.get('S', 0)
+        elif code == 'G20':
+            self.scale = 25.4
+        elif code == 'G21':
+            self.scale = 1.0
+        elif code == 'G28':
+            for axis in [axis for axis in AXES if axis in args] or AXES:
+                self.position[axis] = 0.0
+        elif code == 'G90':
+            self.absolute = self.absolute_extrusion = True
+        elif code == 'G91':
+            self.absolute = self.absolute_extrusion = False
+        elif code == 'G92':
+            for axis, value in args.items():
+                if axis in self.position:
+                    self.position[axis] = value * self.scale
+        elif code == 'M82':
+            self.absolute_extrusion = True
+        elif code == 'M83':
+            self.absolute_extrusion = False
+
+    def move(self, args):
+        '''linear move (arcs are approximated by their chord)'''
+        if 'F' in args and args['F'] > 0:
+            self.feedrate = args['F'] * self.scale
+        position = self.position
+        start = (position['X'], position['Y'], position['Z'])
+        for axis in AXES:
+            if axis in args:
+                value = args[axis] * self.scale
+                position[axis] = value if self.absolute else position[axis] + value
+        end = (position['X'], position['Y'], position['Z'])
+        extruded = 0.0
+        if 'E' in args:
+            value = args['E'] * self.scale
+            extruded = value - position['E'] if self.absolute_extrusion else value
+            position['E'] += extruded
+        self.filament += extruded  # retractions are subtracted again
+
+        distance = sqrt((end[0] - start[0]) ** 2 + (end[1] - start[1]) ** 2 + (end[2] - start[2]) ** 2)
+        if self.feedrate:
+            self.time += max(distance, abs(extruded)) / self.feedrate * 60
+        if extruded > 0 and distance > 0:
+            self.extend_bounds(start, end)
+            if self.layer_z is None or end[2] > self.layer_z + 1e-6:
+                self.layers += 1
+                self.layer_z = end[2]
+
+    def extend_bounds(self, start, end):
+        bounds = self.bounds
+        if bounds is None:
+            bounds = self.bounds = list(start + start)
+        for index in range(3):
+            low, high = (start[index], end[index]) if start[index] < end[index] else (end[index], start[index])
+            if low < bounds[index]:
+                bounds[index] = low
+            if high > bounds[index + 3]:
+                bounds[index + 3] = high
+
+    def result(self):
+        return {
+            'slicer': self.slicer,
+            'layers': self.slicer_layers or self.layer_markers or self.layers,
+            'estimatedTime': round(self.slicer_time if self.slicer_time is not None else self.time),
+            'filamentLength': round(self.slicer_filament if self.slicer_filament is not None else self.filament, 2),
+            'boundingBox': {
+                key: round(value, 3) for key, value
+                in zip(('minX', 'minY', 'minZ', 'maxX', 'maxY', 'maxZ'), self.bounds)
+            } if self.bounds else None,
+            'settings': self.settings,
+        }
+
+
+def read_lines(stream):
+    '''lines of binary `stream` truncated to `MAX_LINE_LENGTH` bytes'''
+    for line in iter(lambda: stream.readline(MAX_LINE_LENGTH), b''):
+        yield line
+        while not line.endswith(b'\n'):
+            # (the rest of a long line is not parsed as another line)
+            line = stream.readline(MAX_LINE_LENGTH)
+            if not line:
+                return
+
+
+def analyze(stream):
+    '''returns metadata of G-code read from binary `stream`'''
+    analyzer = GcodeAnalyzer()
+    for line in read_lines(stream):
+        analyzer.feed(line.decode('utf-8', 'replace'))
+    return analyzer.result()
@@ -0,0 +1,47 @@
+# Generated by Django 3.1 on 2020-08-11 10:24
+
+from hashlib import sha256
+from django.core.files.storage import default_storage
+from django.db import migrations
+
+
+def blob_name(digest):
+    # copy of `files.storage.blob_name` (migrations should not depend on app code)
+    return 'blobs/%s/%s' % (digest[:2], digest)
+
+
+def move_files_to_blobs(apps, schema_editor):
+    '''stores content of existing files as blobs and removes the original files'''
+    File = apps.get_model('files', 'File')
+    Blob = apps.get_model('files', 'Blob')
+    for file in File.objects.filter(blob__isnull=True).exclude(file=''):
+        original = file.file.name
+        if not default_storage.exists(original):
+            continue
+        hash = sha256()
+        with default_storage.open(original, 'rb') as content:
+            for chunk in content.chunks():
+                hash.update(chunk)
+            digest = hash.hexdigest()
+            blob = Blob.objects.filter(digest=digest).first()
+            if blob is None:
+                if not default_storage.exists(blob_name(digest)):
+                    content.seek(0)
+                    default_storage.save(blob_name(digest), content)
+                blob = Blob.objects.create(digest=digest, size=default_storage.size(original))
+        file.blob = blob
+        file.file.name = blob_name(digest)
+        file.save(update_fields=('blob', 'file'))
+        if not File.objects.filter(file=original).exists():
+            default_storage.delete(original)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0005_blob'),
+    ]
+
+    operations = [
+        migrations.RunPython(move_files_to_blobs, migrations.RunPython.noop),
+    ]
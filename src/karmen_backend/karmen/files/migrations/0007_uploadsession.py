@@ -0,0 +1,43 @@
+# Generated by Django 3.1 on 2020-08-12 09:03
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import karmen.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('groups', '0002_auto_20200731_1156'),
+        ('files', '0006_move_files_to_blobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', karmen.models.IdField(serialize=False)),
+                ('name', models.CharField(help_text='Name of the file to create.', max_length=255, verbose_name='Name')),
+                ('size', models.BigIntegerField(help_text='Size of the whole file in bytes.', verbose_name='Size')),
+                ('chunk_size', models.IntegerField(help_text='Size of all chunks but the last one in bytes.', verbose_name='Chunk size')),
+                ('created_on', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to='groups.group')),
+                ('uploaded_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UploadChunk',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.IntegerField(verbose_name='Index')),
+                ('checksum', models.CharField(max_length=64, verbose_name='SHA-256')),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='files.uploadsession')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='uploadchunk',
+            constraint=models.UniqueConstraint(fields=('session', 'index'), name='Uniq_upload_chunk'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1 on 2020-08-13 10:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0007_uploadsession'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='metadata',
+            field=models.JSONField(blank=True, help_text='Extracted from the content in background (see files.analysis), null until then.', null=True, verbose_name='Metadata'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.1 on 2020-08-14 08:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0008_blob_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='encoding',
+            field=models.CharField(blank=True, default='', help_text='Compression of the stored content (see files.compression).', max_length=16, verbose_name='Encoding'),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='index',
+            field=models.JSONField(blank=True, help_text='Flush points of compressed content.', null=True, verbose_name='Index'),
+        ),
+    ]
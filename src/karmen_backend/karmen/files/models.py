@@ -1,37 +1,123 @@
-from django.db import models
+from django.db import models, transaction
 
 # pylint: max_line_length=120
 from itertools import chain
 from django.db import models
 from users.models import User
 from karmen.utils import gen_short_uid
-from karmen.models import IdField
+from karmen import ROLE_ADMIN
+from karmen.models import IdField, join_id
+from files.storage import blob_name, store_blob
+
+
+class Blob(models.Model):
+    '''
+    Content of uploaded files stored once per SHA-256 digest (see `files.storage`)
+    '''
+
+    digest = models.CharField('SHA-256', max_length=64, primary_key=True)
+    size = models.BigIntegerField('Size')
+    created_on = models.DateTimeField(auto_now_add=True)
+    encoding = models.CharField(
+        'Encoding', max_length=16, blank=True, default='', help_text='Compression of the stored content (see files.compression).')
+    index = models.JSONField('Index', null=True, blank=True, help_text='Flush points of compressed content.')
+    metadata = models.JSONField(
+        'Metadata', null=True, blank=True,
+        help_text='Extracted from the content in background (see files.analysis), null until then.')
+
+    @property
+    def name(self):
+        '''name of the blob in the storage'''
+        return blob_name(self.digest, self.encoding)
 
 
 class File(models.Model):
     '''
     File uploaded to Karmen
+
+    The content is stored in a (shared) `Blob`, `file` points to it.
     '''
 
     id = IdField()
     name = models.CharField('Name', blank=False, max_length=255, help_text="Printer will be presented by this name.")
     file = models.FileField()
+    blob = models.ForeignKey(Blob, related_name='files', null=True, on_delete=models.PROTECT)
     group = models.ForeignKey('groups.Group', related_name='files', blank=False, on_delete=models.CASCADE)
     uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE)
-    uploaded_on = models.DateTimeField(auto_now_add=True)
+    uploaded_on = models.DateTimeField(auto_now_add=True, db_index=True)
+    last_updated_on = models.DateTimeField(auto_now=True)
+
+    def save(self, *args, **kwargs):
+        if self.file and not self.file._committed:  # pylint: disable=protected-access
+            # new content - store it as a blob (or reuse blob with the same content)
+            with transaction.atomic():
+                self.blob = store_blob(self.file.file)  # uploaded file (not its FieldFile wrapper)
+                self.file = self.blob.name
+                return super().save(*args, **kwargs)
+        return super().save(*args, **kwargs)
 
-    def delete(self, *args, **kwargs):
-        storage, path = self.file.storage, self.file.path
-        super().delete(*args, **kwargs)
-        storage.delete(path)
+    @property
+    def metadata(self):
+        '''metadata of the content (see `files.gcode`), `None` until it is analyzed'''
+        return self.blob.metadata if self.blob_id else None
 
-    def can_view(self, user):
+    def can_view(self, user, access=None):
+        if access is not None:
+            return access.group_role(self.group_id) is not None
         return self.group.can_view(user)
 
-    def can_modify(self, user):
+    def can_modify(self, user, access=None):
+        if access is not None:
+            return access.group_role(self.group_id) == ROLE_ADMIN
         return self.group.can_modify(user)
 
 
     @classmethod
     def for_user(cls, user):
         return cls.objects.filter(group__users=user)
+
+
+class UploadSession(models.Model):
+    '''
+    Resumable upload of a file in chunks (see `files.uploads`)
+
+    Chunks are written to a preallocated file (`path`) at their offsets in any
+    order, the `File` is created once all of them are received.
+    '''
+
+    id = IdField()
+    name = models.CharField('Name', blank=False, max_length=255, help_text='Name of the file to create.')
+    group = models.ForeignKey('groups.Group', related_name='upload_sessions', on_delete=models.CASCADE)
+    uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE)
+    size = models.BigIntegerField('Size', help_text='Size of the whole file in bytes.')
+    chunk_size = models.IntegerField('Chunk size', help_text='Size of all chunks but the last one in bytes.')
+    created_on = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    @property
+    def chunks_count(self):
+        return max(1, -(-self.size // self.chunk_size))
+
+    def chunk_range(self, index):
+        '''(offset, size) of chunk `index`'''
+        offset = index * self.chunk_size
+        return offset, min(self.chunk_size, self.size - offset)
+
+    def can_view(self, user, access=None):
+        '''upload session is private to its uploader'''
+        return user.is_authenticated and join_id(self.uploaded_by_id) == join_id(user.pk)
+
+    def can_modify(self, user, access=None):
+        return self.can_view(user, access)
+
+
+class UploadChunk(models.Model):
+    '''chunk of `UploadSession` which was received (and verified)'''
+
+    session = models.ForeignKey(UploadSession, related_name='chunks', on_delete=models.CASCADE)
+    index = models.IntegerField('Index')
+    checksum = models.CharField('SHA-256', max_length=64)
+
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(fields=('session', 'index'), name='Uniq_upload_chunk'),
+        )
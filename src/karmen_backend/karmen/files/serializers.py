@@ -1,8 +1,14 @@
+from django.conf import settings
 from rest_framework import serializers, exceptions
+from rest_framework.reverse import reverse
 from django.shortcuts import get_object_or_404
+from karmen.access import get_access
 from karmen.serializers import IdField, RelatedModelField, KarmenHyperlinkedModelSerializer, KarmenModelSerializer
 from users.models import User
+from printers.models import Printer
 from files import models
+from files.uploads import create_data_file, missing_chunks
+from groups.models import Group
 from groups.serializers import GroupField
 
 
@@ -15,14 +21,30 @@ class UserField(serializers.RelatedField):
         }
 
 
+class StoredFileField(serializers.FileField):
+    '''
+    Uploaded file, represented by URL of its `download` endpoint (stored
+    content might be compressed, see `files.storage`).
+    '''
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        return reverse('file-download', kwargs={'pk': value.instance.pk}, request=self.context.get('request'))
+
+
 class FileSerializer(KarmenHyperlinkedModelSerializer):
     id = IdField()
+    file = StoredFileField()
     uploadedBy = UserField(source='uploaded_by', read_only=True)
     group = GroupField()
+    digest = serializers.CharField(source='blob_id', read_only=True)
+    metadata = serializers.JSONField(read_only=True)
 
     class Meta:
-        fields = ['id', 'name', 'url', 'file', 'uploadedBy', 'group' ]# 'groupId', 'groupName']
+        fields = ['id', 'name', 'url', 'file', 'digest', 'metadata', 'uploadedBy', 'group' ]# 'groupId', 'groupName']
         model = models.File
+        optional_fields = ['metadata', ]
 
     def validate(self, attrs):
         attrs['uploaded_by'] = self.context['request'].user
@@ -38,3 +60,72 @@ class FilesInGroupSerializer(FileSerializer):
     def validate(self, attrs):
         attrs['group'] = self.context['parent_instance']
         return super().validate(attrs)
+
+
+class SendFileSerializer(serializers.Serializer):
+    '''Request to send a file to printers (see `printers.transfers`)'''
+
+    printerIds = serializers.ListField(child=serializers.CharField(), allow_empty=False)
+    startPrint = serializers.BooleanField(default=False)
+
+    def validate_printerIds(self, value):
+        access = get_access(self.context['request'])
+        printers = []
+        for printer_id in value:
+            try:
+                printer = Printer.objects.get(pk=printer_id)
+            except Printer.DoesNotExist:
+                raise exceptions.ValidationError(f"Printer '{printer_id}' does not exist.")
+            if not access.can_view(printer):
+                raise exceptions.ValidationError(f"Printer '{printer_id}' is not accessible.")
+            printers.append(printer)
+        return printers
+
+
+class UploadSessionSerializer(KarmenModelSerializer):
+    '''Resumable upload (see `files.uploads`)'''
+
+    url = serializers.HyperlinkedIdentityField(view_name='upload-detail')
+    group = serializers.CharField(source='group_id')
+    chunkSize = serializers.IntegerField(source='chunk_size', required=False, min_value=1)
+    chunks = serializers.IntegerField(source='chunks_count', read_only=True)
+    missingChunks = serializers.SerializerMethodField()
+    createdOn = serializers.DateTimeField(source='created_on', read_only=True)
+
+    class Meta:
+        model = models.UploadSession
+        fields = ['id', 'url', 'name', 'group', 'size', 'chunkSize', 'chunks', 'missingChunks', 'createdOn']
+        read_only_fields = ['id']
+
+    def get_missingChunks(self, session):
+        return missing_chunks(session)
+
+    def validate_group(self, value):
+        try:
+            group = Group.objects.get(pk=value)
+        except Group.DoesNotExist:
+            raise exceptions.ValidationError(f"Group '{value}' does not exist.")
+        if not get_access(self.context['request']).can_modify(group):
+            raise exceptions.ValidationError(f"Group '{value}' is not accessible.")
+        return group
+
+    def validate_size(self, value):
+        if not 0 < value <= settings.UPLOAD_MAX_SIZE:
+            raise exceptions.ValidationError(f'Size has to be between 1 and {settings.UPLOAD_MAX_SIZE} bytes.')
+        return value
+
+    def validate_chunkSize(self, value):
+        if value > settings.UPLOAD_MAX_CHUNK_SIZE:
+            raise exceptions.ValidationError(f'Chunk size can not exceed {settings.UPLOAD_MAX_CHUNK_SIZE} bytes.')
+        return value
+
+    def create(self, validated_data):
+        session = models.UploadSession.objects.create(
+            name=validated_data['name'],
+            group=validated_data['group_id'],
+            size=validated_data['size'],
+            chunk_size=validated_data.get('chunk_size', settings.UPLOAD_CHUNK_SIZE),
+            uploaded_by=self.context['request'].user,
+        )
+        create_data_file(session)
+        return session
@@ -0,0 +1,31 @@
+'''
+Schedules analysis of uploaded content (see `files.analysis`) and cleans up
+stored data of deleted files (see `files.storage`) and upload sessions (see
+`files.uploads`)
+
+`post_delete` is sent for cascade deletes too (e.g. when a group is deleted).
+'''
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from files.models import File, UploadSession
+from files.analysis import schedule_analysis
+from files.storage import release_blob
+from files.uploads import delete_data_file
+
+
+@receiver(post_save, sender=File)
+def file_saved(sender, instance, created, **kwargs):
+    if created and instance.blob_id and instance.blob.metadata is None:
+        schedule_analysis(instance.blob_id)
+
+
+@receiver(post_delete, sender=File)
+def file_deleted(sender, instance, **kwargs):
+    if instance.blob_id:
+        transaction.on_commit(lambda digest=instance.blob_id: release_blob(digest))
+
+
+@receiver(post_delete, sender=UploadSession)
+def upload_session_deleted(sender, instance, **kwargs):
+    delete_data_file(instance)
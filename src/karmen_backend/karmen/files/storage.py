@@ -0,0 +1,140 @@
+'''
+Content addressed storage of uploaded files
+
+Content of uploaded files is stored once per SHA-256 digest as a blob
+`blobs/<first two characters of digest>/<digest>` in the default storage, no
+matter how many `File`s (e.g. in different groups) have the same content. Each
+stored blob has its `Blob` row which is referenced by the `File`s.
+
+The `Blob` row is locked (`select_for_update`) while the blob is stored or
+released so an upload can not reuse a blob which is just being deleted. A blob
+is deleted when its last `File` is deleted (see `files.signals`). Blobs left
+behind (e.g. when a transaction is rolled back after the blob was written) are
+removed by `manage.py collect_blobs`.
+
+With `BLOB_COMPRESSION = 'gzip'` blobs are stored compressed (see
+`files.compression`) as `<digest>.gz`, `open_blob` reads their content
+transparently. Blobs stored before are compressed by `manage.py compress_blobs`.
+'''
+from hashlib import sha256
+from django.conf import settings
+from django.core.files import File as DjangoFile
+from django.core.files.storage import default_storage
+from django.db import transaction, IntegrityError
+from django.utils import timezone
+from files.compression import GZIP, GzipBlobReader, compress
+
+
+BLOBS_DIR = 'blobs'
+
+EXTENSIONS = {GZIP: '.gz'}
+'''suffixes of stored blobs by their encoding'''
+
+
+def blob_name(digest, encoding=''):
+    '''storage name of blob with `digest` stored with `encoding`'''
+    return '%s/%s/%s%s' % (BLOBS_DIR, digest[:2], digest, EXTENSIONS.get(encoding, ''))
+
+
+def name_digest(name):
+    '''digest of blob stored as (base)`name`'''
+    return name.rsplit('/', 1)[-1].split('.', 1)[0]
+
+
+def file_digest(content):
+    '''SHA-256 hex digest of django `File` (computed by upload handlers when available)'''
+    digest = getattr(content, 'sha256', None)
+    if digest is None:
+        content.seek(0)
+        hash = sha256()
+        for chunk in content.chunks():
+            hash.update(chunk)
+        content.seek(0)
+        digest = hash.hexdigest()
+    return digest
+
+
+def store_blob(content):
+    '''
+    Returns `Blob` with `content` (django `File`), the content is written to
+    storage only if there is no such blob yet.
+
+    Has to be called in a transaction which also saves the referencing `File`
+    (the blob row stays locked until then).
+    '''
+    # pylint: disable=import-outside-toplevel
+    from files.models import Blob
+    digest = file_digest(content)
+    blob = Blob.objects.select_for_update().filter(digest=digest).first()
+    if blob is not None:
+        return blob
+    try:
+        # the row is created first, concurrent uploads of the same content wait for it
+        with transaction.atomic():
+            blob = Blob.objects.create(digest=digest, size=content.size)
+    except IntegrityError:
+        return Blob.objects.select_for_update().get(digest=digest)
+    compressed = compress(content) if settings.BLOB_COMPRESSION == GZIP else None
+    if compressed is not None:
+        content, blob.index = DjangoFile(compressed[0]), compressed[1]
+        blob.encoding = GZIP
+        blob.save(update_fields=['encoding', 'index'])
+    try:
+        if default_storage.exists(blob.name):
+            # left behind by a failed upload, might be incomplete
+            default_storage.delete(blob.name)
+        default_storage.save(blob.name, content)
+    finally:
+        if compressed is not None:
+            content.close()
+    return blob
+
+
+def compress_blob(digest):
+    '''
+    Stores uncompressed blob `digest` compressed (files referencing it are
+    updated), returns whether it was compressed.
+    '''
+    # pylint: disable=import-outside-toplevel
+    from files.models import Blob
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(digest=digest, encoding='').first()
+        if blob is None:
+            return False
+        old_name = blob.name
+        with default_storage.open(old_name, 'rb') as content:
+            compressed = compress(content)
+        if compressed is None:
+            return False
+        blob.encoding, blob.index = GZIP, compressed[1]
+        with DjangoFile(compressed[0]) as content:
+            if default_storage.exists(blob.name):
+                default_storage.delete(blob.name)
+            default_storage.save(blob.name, content)
+        blob.save(update_fields=['encoding', 'index'])
+        blob.files.update(file=blob.name, last_updated_on=timezone.now())
+        transaction.on_commit(lambda: default_storage.delete(old_name))
+    return True
+
+
+def open_blob(blob):
+    '''opens (uncompressed) content of `blob` for binary reading'''
+    stored = default_storage.open(blob.name, 'rb')
+    if blob.encoding == GZIP:
+        return GzipBlobReader(stored, blob.size, blob.index)
+    return stored
+
+
+def release_blob(digest):
+    '''deletes blob with `digest` if no `File` references it anymore'''
+    # pylint: disable=import-outside-toplevel
+    from files.models import Blob
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(digest=digest).first()
+        if blob is None or blob.files.exists():
+            return False
+        name = blob.name
+        blob.delete()
+        default_storage.delete(name)
+    return True
+
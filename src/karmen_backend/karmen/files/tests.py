@@ -1,3 +1,334 @@
-from django.test import TestCase
+import gzip
+import os
+import random
+from hashlib import sha256
+from io import BytesIO
+from tempfile import TemporaryDirectory
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+from karmen import ROLE_ADMIN
+from users.models import User
+from groups.models import Group
+from files.models import File, Blob, UploadSession
+from files.uploads import session_path
+from files.storage import blob_name, open_blob
+from files.compression import GZIP, compress, GzipBlobReader
+from files.downloads import accepts_encoding
+from files.gcode import analyze, MAX_LINE_LENGTH
+from files.analysis import run_analysis
 
-# Create your tests here.
+MEDIA = TemporaryDirectory()
+
+
+@override_settings(MEDIA_ROOT=MEDIA.name)
+class BlobStorageTest(TransactionTestCase):
+    '''(blobs are released on commit)'''
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.groups = []
+        for name in ('a', 'b'):
+            group = Group.objects.create(name=name)
+            group.set_user(self.user, ROLE_ADMIN)
+            self.groups.append(group)
+
+    def upload(self, group, content):
+        response = self.client.post('/api/2/users/me/files/', {
+            'name': 'cube.gcode',
+            'group': group.pk,
+            'file': SimpleUploadedFile('cube.gcode', content),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 201, response.content)
+        return File.objects.get(pk=response.json()['id'])
+
+    def test_same_content_is_stored_once(self):
+        files = [self.upload(group, b'G28\n') for group in self.groups]
+        other = self.upload(self.groups[0], b'G1 X1\n')
+        self.assertEqual(files[0].blob_id, files[1].blob_id)
+        self.assertEqual(files[0].file.name, blob_name(files[0].blob_id))
+        self.assertNotEqual(other.blob_id, files[0].blob_id)
+        self.assertEqual(Blob.objects.count(), 2)
+        with files[1].file.open('rb') as content:
+            self.assertEqual(content.read(), b'G28\n')
+
+    def test_blob_is_deleted_with_last_file(self):
+        files = [self.upload(group, b'G28\n') for group in self.groups]
+        name = files[0].file.name
+        files[0].delete()
+        self.assertTrue(default_storage.exists(name))
+        self.groups[1].delete()  # cascade
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(Blob.objects.exists())
+
+    def test_collect_blobs(self):
+        default_storage.save(blob_name('ab' * 32), SimpleUploadedFile('orphan', b'orphan'))
+        kept = self.upload(self.groups[0], b'G28\n')
+        call_command('collect_blobs', min_age=0)
+        self.assertFalse(default_storage.exists(blob_name('ab' * 32)))
+        self.assertTrue(default_storage.exists(kept.file.name))
+
+
+@override_settings(MEDIA_ROOT=MEDIA.name, UPLOAD_SESSIONS_DIR=os.path.join(MEDIA.name, 'uploads'))
+class UploadSessionTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.group = Group.objects.create(name='group')
+        self.group.set_user(self.user, ROLE_ADMIN)
+        self.content = os.urandom(2500)
+        response = self.client.post('/api/2/files/uploads/', {
+            'name': 'big.gcode', 'group': self.group.pk, 'size': len(self.content), 'chunkSize': 1000,
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.session = response.json()
+        self.assertEqual(self.session['missingChunks'], [0, 1, 2])
+
+    def put_chunk(self, index, data=None, checksum=None):
+        data = self.content[index * 1000:(index + 1) * 1000] if data is None else data
+        return self.client.put(
+            '/api/2/files/uploads/%s/chunks/%s/' % (self.session['id'], index), data,
+            content_type='application/octet-stream',
+            HTTP_X_CHECKSUM_SHA256=checksum or sha256(data).hexdigest(),
+        )
+
+    def finalize(self):
+        return self.client.post('/api/2/files/uploads/%s/finalize/' % self.session['id'])
+
+    def test_upload(self):
+        for index in (2, 0, 1, 0):  # any order, chunks can be sent again
+            self.assertEqual(self.put_chunk(index).status_code, 204)
+        response = self.finalize()
+        self.assertEqual(response.status_code, 201, response.content)
+        file = File.objects.get(pk=response.json()['id'])
+        self.assertEqual(file.blob_id, sha256(self.content).hexdigest())
+        with file.file.open('rb') as content:
+            self.assertEqual(content.read(), self.content)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.listdir(os.path.join(MEDIA.name, 'uploads')))
+
+    def test_resume(self):
+        self.put_chunk(0)
+        self.assertEqual(self.put_chunk(1, checksum='0' * 64).status_code, 400)
+        self.assertEqual(self.put_chunk(2, data=b'short').status_code, 400)
+        response = self.finalize()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['missingChunks'], [1, 2])
+        session = self.client.get('/api/2/files/uploads/%s/' % self.session['id']).json()
+        self.assertEqual(session['missingChunks'], [1, 2])
+        self.put_chunk(1)
+        self.put_chunk(2)
+        self.assertEqual(self.finalize().status_code, 201)
+
+    def test_bad_resend(self):
+        for index in range(3):
+            self.put_chunk(index)
+        # a corrupted re-send of a received chunk does not spoil it
+        self.assertEqual(self.put_chunk(1, data=os.urandom(1000), checksum='0' * 64).status_code, 400)
+        response = self.finalize()
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(File.objects.get(pk=response.json()['id']).blob_id, sha256(self.content).hexdigest())
+
+    def test_abort(self):
+        path = session_path(UploadSession.objects.get())
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(self.client.delete('/api/2/files/uploads/%s/' % self.session['id']).status_code, 204)
+        self.assertFalse(os.path.exists(path))
+
+
+GCODE = b"""; generated by PrusaSlicer 2.2.0+linux on 2020-08-01 at 10:00:00 UTC
+M83 ; relative extrusion
+G28
+G1 Z0.2 F600
+;LAYER_CHANGE
+G1 X10 Y10 F6000
+G1 X20 Y10 E1.5 F1200
+G1 E-0.8 ; retract
+G1 E0.8
+G1 X20 Y30 E2.5
+;LAYER_CHANGE
+N10 G1 Z0.4*45
+G1 X10 Y30 E1.0
+; filament used [mm] = 5.0
+; estimated printing time (normal mode) = 1h 2m 3s
+; layer_height = 0.2
+; nozzle_diameter = 0.4
+"""
+
+
+class GcodeAnalysisTest(TestCase):
+
+    def test_analyze(self):
+        metadata = analyze(BytesIO(GCODE))
+        self.assertEqual(metadata['slicer'], 'PrusaSlicer 2.2.0+linux')
+        self.assertEqual(metadata['layers'], 2)
+        self.assertEqual(metadata['estimatedTime'], 3723)
+        self.assertEqual(metadata['filamentLength'], 5.0)
+        self.assertEqual(metadata['boundingBox'], {
+            'minX': 10, 'maxX': 20, 'minY': 10, 'maxY': 30, 'minZ': 0.2, 'maxZ': 0.4,
+        })
+        self.assertEqual(metadata['settings']['layer_height'], '0.2')
+        self.assertEqual(metadata['settings']['nozzle_diameter'], '0.4')
+
+    def test_computed_values(self):
+        metadata = analyze(BytesIO(b'G21\nG90\nM82\nG1 Z0.3 F60\nG1 X60 E2 F600\nG92 E0\nG1 X0 E3\nG1 Z0.6\nG1 X60 E4\n'))
+        self.assertIsNone(metadata['slicer'])
+        self.assertEqual(metadata['layers'], 2)
+        self.assertEqual(metadata['filamentLength'], 6)
+        self.assertEqual(metadata['estimatedTime'], round(0.3 + 6 + 6 + 0.03 + 6))
+        self.assertEqual(metadata['settings'], {})
+
+    def test_long_lines(self):
+        # (the line is split by the analyzer right before the move)
+        comment = b'; start_gcode = M117 '
+        comment += b'x' * (MAX_LINE_LENGTH - len(comment))
+        gcode = comment + b'G1 X500 Y500 E50\n' + GCODE
+        metadata = analyze(BytesIO(gcode))
+        self.assertEqual(metadata['boundingBox'], analyze(BytesIO(GCODE))['boundingBox'])
+        self.assertEqual(len(metadata['settings']['start_gcode']), 255)
+
+    @override_settings(MEDIA_ROOT=MEDIA.name)
+    def test_file_metadata(self):
+        user = User.objects.create_user(username='user@example.com')
+        group = Group.objects.create(name='group')
+        group.set_user(user, ROLE_ADMIN)
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.post('/api/2/users/me/files/', {
+            'name': 'cube.gcode', 'group': group.pk, 'file': SimpleUploadedFile('cube.gcode', GCODE),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertIsNone(response.json()['metadata'])
+        run_analysis(response.json()['digest'])  # (on commit in background)
+        listing = client.get('/api/2/users/me/files/').json()['results']
+        self.assertNotIn('metadata', listing[0])
+        listing = client.get('/api/2/users/me/files/?fields=metadata').json()['results']
+        self.assertEqual(listing[0]['metadata']['layers'], 2)
+
+
+@override_settings(MEDIA_ROOT=MEDIA.name, BLOB_COMPRESSION_FRAME_SIZE=1000)
+class CompressionTest(TestCase):
+
+    def setUp(self):
+        rows = ['G1 X%s Y%s E%s\n' % (random.randint(0, 200), random.randint(0, 200), random.random()) for _ in range(500)]
+        self.content = ''.join(rows).encode()
+
+    def test_seek(self):
+        stored, index = compress(ContentFile(self.content))
+        with stored:
+            data = stored.read()
+            self.assertEqual(gzip.decompress(data), self.content)  # standard gzip
+            self.assertLess(len(data), len(self.content) / 2)
+            self.assertEqual(len(index['offsets']), -(-len(self.content) // 1000))
+            reader = GzipBlobReader(BytesIO(data), len(self.content), index)
+            for offset in (0, 999, 1000, 4321, len(self.content) - 10, len(self.content)):
+                reader.seek(offset)
+                self.assertEqual(reader.read(1500), self.content[offset:offset + 1500])
+            reader.seek(0)
+            self.assertEqual(reader.readline(), self.content.split(b'\n')[0] + b'\n')
+
+    def test_incompressible(self):
+        self.assertIsNone(compress(ContentFile(os.urandom(5000))))
+
+    def test_download(self):
+        user = User.objects.create_user(username='user@example.com')
+        group = Group.objects.create(name='group')
+        group.set_user(user, ROLE_ADMIN)
+        file = File.objects.create(
+            name='cube.gcode', file=ContentFile(self.content, name='cube.gcode'), group=group, uploaded_by=user)
+        self.assertEqual(file.blob.encoding, GZIP)
+        self.assertTrue(file.file.name.endswith('.gz'))
+        with open_blob(file.blob) as content:
+            self.assertEqual(content.read(), self.content)
+        client = APIClient()
+        client.force_authenticate(user)
+        url = client.get('/api/2/files/%s/' % file.pk).json()['file']
+        self.assertTrue(url.endswith('/download/'), url)
+
+        response = client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), self.content)
+        self.assertEqual(int(response['Content-Length']), file.file.size)
+        response = client.get(url)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertIn('filename="cube.gcode"', response['Content-Disposition'])
+
+    def test_compress_blobs(self):
+        user = User.objects.create_user(username='user@example.com')
+        group = Group.objects.create(name='group')
+        with self.settings(BLOB_COMPRESSION=''):
+            file = File.objects.create(
+                name='cube.gcode', file=ContentFile(self.content, name='cube.gcode'), group=group, uploaded_by=user)
+        raw_name = file.file.name
+        self.assertEqual(file.blob.encoding, '')
+        call_command('compress_blobs')
+        file.refresh_from_db()
+        self.assertEqual(file.blob.encoding, GZIP)
+        self.assertEqual(file.file.name, file.blob.name)
+        with open_blob(file.blob) as content:
+            self.assertEqual(content.read(), self.content)
+        default_storage.delete(raw_name)  # (deleted on commit)
+
+
+@override_settings(MEDIA_ROOT=MEDIA.name)
+class DownloadTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user@example.com')
+        group = Group.objects.create(name='group')
+        group.set_user(self.user, ROLE_ADMIN)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.content = b'G1 X10 Y10\n' * 1000
+        self.file = File.objects.create(
+            name='cube.gcode', file=ContentFile(self.content, name='cube.gcode'), group=group, uploaded_by=self.user)
+        self.url = '/api/2/files/%s/download/' % self.file.pk
+
+    def test_access(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username='other@example.com'))
+        self.assertEqual(client.get(self.url).status_code, 403)
+
+    def test_range(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 100-199/%s' % len(self.content))
+        self.assertEqual(b''.join(response.streaming_content), self.content[100:200])
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-5', HTTP_IF_RANGE=response['ETag'])
+        self.assertEqual(b''.join(response.streaming_content), self.content[-5:])
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-', HTTP_IF_RANGE='"changed"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=%s-' % len(self.content))
+        self.assertEqual(response.status_code, 416)
+
+    def test_accepts_encoding(self):
+        def accepts(header):
+            return accepts_encoding(RequestFactory().get('/', HTTP_ACCEPT_ENCODING=header), 'gzip')
+        self.assertTrue(accepts('deflate, gzip'))
+        self.assertTrue(accepts('gzip; q=0.5'))
+        self.assertFalse(accepts('gzip;q=0'))
+        self.assertFalse(accepts('gzip;q=high'))
+        self.assertFalse(accepts('deflate'))
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip;q=high')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    @override_settings(MEDIA_ACCEL_REDIRECT_URL='/protected-media/')
+    def test_accel_redirect(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + self.file.blob.name)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response.content, b'')
+        # decompressed by django
+        response = self.client.get(self.url)
+        self.assertFalse(response.has_header('X-Accel-Redirect'))
+        self.assertEqual(b''.join(response.streaming_content), self.content)
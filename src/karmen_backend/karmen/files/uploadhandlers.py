@@ -0,0 +1,42 @@
+'''
+Upload handlers computing SHA-256 digest of uploaded files on the fly
+
+Drop-in replacements of django's default upload handlers (see
+`FILE_UPLOAD_HANDLERS` setting). The digest is stored as `sha256` attribute of
+the uploaded file so storing it (see `files.storage.store_blob`) does not have
+to read the file once again.
+'''
+from hashlib import sha256
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+
+class HashingUploadHandlerMixin(object):
+
+    def new_file(self, *args, **kwargs):
+        self.hash = sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.is_receiving():
+            self.hash.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.sha256 = self.hash.hexdigest()
+        return file
+
+    def is_receiving(self):
+        '''False when the handler passes the data to the next handler'''
+        return True
+
+
+class HashingMemoryFileUploadHandler(HashingUploadHandlerMixin, MemoryFileUploadHandler):
+
+    def is_receiving(self):
+        return self.activated
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadHandlerMixin, TemporaryFileUploadHandler):
+    pass
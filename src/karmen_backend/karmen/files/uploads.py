@@ -0,0 +1,113 @@
+'''
+Resumable uploads
+
+Large files can be uploaded in chunks so that a dropped connection costs one
+chunk only:
+
+1. `POST files/uploads/` with `name`, `group` and `size` (and optionally
+   `chunkSize`) creates an `UploadSession`. Its data file is preallocated to
+   `size` bytes in `UPLOAD_SESSIONS_DIR`.
+2. `PUT files/uploads/<id>/chunks/<index>/` with the raw chunk as the body and
+   its SHA-256 hex digest in `X-Checksum-SHA256` header. Chunks can be sent in
+   any order (and in parallel). A chunk is verified before it is written to
+   its offset in the data file - a chunk with a wrong checksum is rejected
+   (and does not touch data received before) and has to be sent again, a
+   chunk can be re-sent any time.
+3. `GET files/uploads/<id>/` lists received chunks (to resume an upload).
+4. `POST files/uploads/<id>/finalize/` creates the `File` once all chunks are
+   received. The data file is moved to the storage (see `files.storage`).
+'''
+import os
+from hashlib import sha256
+from shutil import copyfileobj
+from tempfile import SpooledTemporaryFile
+from django.conf import settings
+from django.core.files import File as DjangoFile
+from karmen.models import join_id
+from files.models import UploadChunk
+
+
+READ_BLOCK_SIZE = 64 * 1024
+'''bytes read from the request (and the data file) at once'''
+
+
+class ChecksumMismatch(ValueError):
+    '''received chunk does not match its checksum'''
+
+
+class AssembledFile(DjangoFile):
+    '''
+    Data file of a finished upload session
+
+    `temporary_file_path` lets `FileSystemStorage` move the file instead of
+    copying it (the same way as django's own temporary uploaded files).
+    '''
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def session_path(session):
+    return os.path.join(settings.UPLOAD_SESSIONS_DIR, join_id(session.pk))
+
+
+def create_data_file(session):
+    '''preallocates the data file of (new) `session`'''
+    os.makedirs(settings.UPLOAD_SESSIONS_DIR, exist_ok=True)
+    with open(session_path(session), 'wb') as data:
+        data.truncate(session.size)
+
+
+def delete_data_file(session):
+    try:
+        os.remove(session_path(session))
+    except FileNotFoundError:
+        pass
+
+
+def write_chunk(session, index, stream, checksum):
+    '''
+    Writes chunk `index` read from `stream` to the data file of `session`.
+
+    The chunk is read in blocks of `READ_BLOCK_SIZE` bytes to a spooled
+    temporary file and written to the data file only once it is verified.
+    Raises `ChecksumMismatch` if the chunk does not match SHA-256 `checksum`
+    (or has wrong size), the data file is left untouched then (a chunk
+    received before stays valid).
+    '''
+    offset, size = session.chunk_range(index)
+    hash = sha256()
+    received = 0
+    with SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE) as chunk:
+        while received < size:
+            block = stream.read(min(READ_BLOCK_SIZE, size - received))
+            if not block:
+                break
+            hash.update(block)
+            chunk.write(block)
+            received += len(block)
+        if received < size or stream.read(1):
+            raise ChecksumMismatch(f'Chunk {index} has to be {size} bytes long.')
+        if hash.hexdigest() != checksum.lower():
+            raise ChecksumMismatch(f'Chunk {index} does not match its checksum.')
+        chunk.seek(0)
+        with open(session_path(session), 'r+b') as data:
+            data.seek(offset)
+            copyfileobj(chunk, data, READ_BLOCK_SIZE)
+    UploadChunk.objects.update_or_create(session=session, index=index, defaults={'checksum': hash.hexdigest()})
+
+
+def missing_chunks(session):
+    received = set(session.chunks.values_list('index', flat=True))
+    return [index for index in range(session.chunks_count) if index not in received]
+
+
+def open_data_file(session):
+    '''returns data file of finished `session` as django `File` with `sha256` computed'''
+    hash = sha256()
+    with open(session_path(session), 'rb') as data:
+        for block in iter(lambda: data.read(READ_BLOCK_SIZE), b''):
+            hash.update(block)
+    file = AssembledFile(open(session_path(session), 'rb'), name=session.name)
+    file.sha256 = hash.hexdigest()
+    return file
@@ -1,29 +1,82 @@
+from io import BytesIO
+from django.db import transaction
 from django.shortcuts import render
-from rest_framework import viewsets, permissions
-from karmen.viewsets import ObjectLevelAccessRestrictionViewSetMixin, NestedViewMixin
+from rest_framework import viewsets, permissions, decorators, status, mixins, exceptions
+from rest_framework.response import Response
+from karmen.viewsets import (
+    ObjectLevelAccessRestrictionViewSetMixin, NestedViewMixin, RelatedFieldsViewSetMixin, ConditionalGetViewSetMixin,
+    CachedListViewSetMixin,
+)
 from karmen.permissions import IsUserOfObject, IsManagerOfObject, IsUserOfParentObject, IsManagerOfParentObject
 from files import models, serializers
+from files.uploads import write_chunk, missing_chunks, open_data_file, ChecksumMismatch
+from files.downloads import blob_response
+from printers.serializers import FileTransferSerializer
+from printers.transfers import start_transfers
 
-class FilesViewSet(ObjectLevelAccessRestrictionViewSetMixin, viewsets.ModelViewSet):
+class FilesViewSet(
+        ConditionalGetViewSetMixin, RelatedFieldsViewSetMixin, ObjectLevelAccessRestrictionViewSetMixin,
+        viewsets.ModelViewSet):
     '''
     Main file group endpoint
 
     Only admin can list, access to individual objects depends on `group.can_*` model methods.
+    `metadata` of the content (see `files.analysis`) are listed with `?fields=metadata`.
     '''
 
     serializer_class = serializers.FileSerializer
     queryset = models.File.objects.all()
+    ordering = ('-uploaded_on', 'id')
+    select_related_fields = {'metadata': ['blob']}
+    version_tables = ('groups.useringroup', 'groups.group', 'users.user', 'files.blob')
+    action_permissions = {'send': [IsUserOfObject], 'download': [IsUserOfObject]}
 
+    @decorators.action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        '''
+        Content of the file.
 
-class MyFilesViewSet(FilesViewSet):
+        Compressed files are sent as they are stored with `Content-Encoding`
+        to clients accepting it, decompressed otherwise. The transfer itself
+        is handed over to nginx when possible (see `files.downloads`).
+        '''
+        file = self.get_object()
+        return blob_response(file.blob, request, filename=file.name)
+
+    @decorators.action(detail=True, methods=['post'], serializer_class=serializers.SendFileSerializer)
+    def send(self, request, pk=None):
+        '''
+        Sends the file to printers (`printerIds`) in background.
+
+        Returns the started transfers, their progress can be followed under
+        the `transfers` endpoint.
+        '''
+        file = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            transfers = start_transfers(
+                file, serializer.validated_data['printerIds'], request.user,
+                start_print=serializer.validated_data['startPrint'],
+            )
+        return Response(
+            FileTransferSerializer(transfers, many=True, context=self.get_serializer_context()).data,
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+
+class MyFilesViewSet(CachedListViewSetMixin, FilesViewSet):
+    '''files of groups of the current user (the rendered list is cached, see `CachedListViewSetMixin`)'''
 
     listing_permissions = create_permissions = [permissions.IsAuthenticated]
+    cached_tables = ('files.file', 'groups.group', 'users.user')
+    cached_field_tables = {'metadata': ('files.blob', )}
 
     def get_queryset(self):
         return models.File.for_user(self.request.user)
 
 
-class FilesInGroupViewSet(NestedViewMixin, ObjectLevelAccessRestrictionViewSetMixin, viewsets.ModelViewSet):
+class FilesInGroupViewSet(NestedViewMixin, RelatedFieldsViewSetMixin, ObjectLevelAccessRestrictionViewSetMixin, viewsets.ModelViewSet):
     '''
     List / delete / update printers under a group endpoint.
     '''
@@ -31,6 +84,66 @@ class FilesInGroupViewSet(NestedViewMixin, ObjectLevelAccessRestrictionViewSetMi
     parent_model = 'models.Group'
     listing_permissions = [IsUserOfParentObject]
     create_permissions = [IsManagerOfParentObject]
+    ordering = ('-uploaded_on', 'id')
+    select_related_fields = {'metadata': ['blob']}
 
     def get_queryset(self):
         return models.File.objects.filter(group=self.request.parent_instance)
+
+
+class UploadSessionsViewSet(
+        ObjectLevelAccessRestrictionViewSetMixin,
+        mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.DestroyModelMixin, mixins.ListModelMixin,
+        viewsets.GenericViewSet):
+    '''
+    Resumable uploads of large files in chunks (see `files.uploads` for the protocol).
+
+    Upload sessions are private to the user who started them, deleting a
+    session aborts the upload.
+    '''
+
+    serializer_class = serializers.UploadSessionSerializer
+    listing_permissions = create_permissions = [permissions.IsAuthenticated]
+    action_permissions = {'chunk': [IsManagerOfObject], 'finalize': [IsManagerOfObject]}
+    ordering = ('-created_on', 'id')
+
+    def get_queryset(self):
+        return models.UploadSession.objects.filter(uploaded_by=self.request.user)
+
+    @decorators.action(detail=True, methods=['put'], url_path=r'chunks/(?P<index>\d+)')
+    def chunk(self, request, pk=None, index=None):
+        '''receives chunk `index` (raw request body), its SHA-256 is expected in `X-Checksum-SHA256` header'''
+        session = self.get_object()
+        index = int(index)
+        if index >= session.chunks_count:
+            raise exceptions.NotFound({'code': 'invalid-chunk', 'detail': f'The upload has {session.chunks_count} chunks.'})
+        checksum = request.META.get('HTTP_X_CHECKSUM_SHA256')
+        if not checksum:
+            raise exceptions.ValidationError({'code': 'missing-checksum', 'detail': 'Missing X-Checksum-SHA256 header.'})
+        try:
+            write_chunk(session, index, request.stream or BytesIO(), checksum)
+        except ChecksumMismatch as e:
+            raise exceptions.ValidationError({'code': 'invalid-chunk', 'detail': str(e)})
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @decorators.action(detail=True, methods=['post'])
+    def finalize(self, request, pk=None):
+        '''creates the file once all chunks are received'''
+        session = self.get_object()
+        missing = missing_chunks(session)
+        if missing:
+            return Response({
+                'code': 'missing-chunks',
+                'detail': 'Some chunks were not received yet.',
+                'missingChunks': missing,
+            }, status=status.HTTP_400_BAD_REQUEST)
+        with transaction.atomic():
+            with open_data_file(session) as content:
+                file = models.File(name=session.name, group=session.group, uploaded_by=session.uploaded_by)
+                file.file = content
+                file.save()
+            session.delete()
+        return Response(
+            serializers.FileSerializer(file, context=self.get_serializer_context()).data,
+            status=status.HTTP_201_CREATED,
+        )
@@ -0,0 +1,20 @@
+# Generated by Django 3.1 on 2020-08-25 09:20
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('groups', '0002_auto_20200731_1156'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='group',
+            name='last_updated_on',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
@@ -14,11 +14,16 @@ class Group(models.Model):
     id = IdField()
     name = models.CharField('Name', max_length=255, help_text='User friendly name of the group.')
     users = models.ManyToManyField(User, related_name='printer_groups', through='UserInGroup')
+    last_updated_on = models.DateTimeField(auto_now=True)
 
-    def can_view(self, user):
+    def can_view(self, user, access=None):
+        if access is not None:
+            return access.group_role(self.pk) is not None
         return UserInGroup.objects.filter(group=self, user=user).exists()
 
-    def can_modify(self, user):
+    def can_modify(self, user, access=None):
+        if access is not None:
+            return access.group_role(self.pk) == ROLE_ADMIN
         return UserInGroup.objects.filter(group=self, user=user, role=ROLE_ADMIN).exists()
 
     def set_user(self, user, role=None):
@@ -43,14 +48,18 @@ class UserInGroup(models.Model):
             models.UniqueConstraint(fields=('user', 'group'), name='Uniq_user_in_group'),
         )
 
-    def can_view(self, user):
+    def can_view(self, user, access=None):
+        if access is not None:
+            return user == self.user or access.group_role(self.group_id) is not None
         return user == self.user or self.group.can_view(user)
 
-    def can_modify(self, user):
+    def can_modify(self, user, access=None):
+        if access is not None:
+            return access.group_role(self.group_id) == ROLE_ADMIN
         return self.group.can_modify(user)
 
-    def can_delete(self, user):
+    def can_delete(self, user, access=None):
         # user can leave group
-        return user == self.user or self.can_modify(user)
+        return user == self.user or self.can_modify(user, access)
 
 
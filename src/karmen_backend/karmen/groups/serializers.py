@@ -36,7 +36,7 @@ class UserInGroupSerializer(KarmenModelSerializer):
     def get_url(self, value):
         url = reverse('group-user-detail', kwargs={
             'username': value.user.username,
-            'group_id': value.group.id,
+            'group_id': value.group_id,
         })
         return self.context['request'].build_absolute_uri(url)
 
@@ -1,3 +1,42 @@
 from django.test import TestCase
+from rest_framework.test import APIClient
+from karmen import ROLE_ADMIN, ROLE_USER
+from karmen.tests import ConstantQueriesMixin
+from users.models import User
+from groups.models import Group
+from printers.models import Printer
 
-# Create your tests here.
+
+class GroupQueriesTest(ConstantQueriesMixin, TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user@example.com')
+        self.group = Group.objects.create(name='group')
+        self.group.set_user(self.user, ROLE_ADMIN)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.count = 0
+
+    def add_rows(self, count):
+        for _ in range(count):
+            self.count += 1
+            user = User.objects.create_user(username='user-%s@example.com' % self.count)
+            printer = Printer.objects.create(name='printer %s' % self.count)
+            group = Group.objects.create(name='group %s' % self.count)
+            group.set_user(self.user, ROLE_USER)
+            group.set_user(user, ROLE_USER)
+            group.printers.add(printer)
+            self.group.set_user(user, ROLE_USER)
+            self.group.printers.add(printer)
+
+    def test_my_groups(self):
+        self.assertConstantQueries('/api/2/users/me/groups/?fields=all')
+
+    def test_group(self):
+        self.assertConstantQueries('/api/2/groups/%s/?fields=all' % self.group.pk)
+
+    def test_group_users(self):
+        self.assertConstantQueries('/api/2/groups/%s/users/' % self.group.pk)
+
+    def test_group_printers(self):
+        self.assertConstantQueries('/api/2/groups/%s/printers/' % self.group.pk)
@@ -3,12 +3,17 @@ from django.shortcuts import get_object_or_404
 from django.utils.functional import cached_property
 from rest_framework import viewsets, exceptions, status, permissions, decorators
 from karmen.permissions import IsManagerOfObject, IsUserOfObject, IsUserOfParentObject, IsManagerOfParentObject
-from karmen.viewsets import ObjectLevelAccessRestrictionViewSetMixin, NestedViewMixin
+from karmen.viewsets import (
+    ObjectLevelAccessRestrictionViewSetMixin, NestedViewMixin, RelatedFieldsViewSetMixin, ConditionalGetViewSetMixin,
+    CachedListViewSetMixin,
+)
 from users.models import User
 from groups import models, serializers
 
 
-class GroupsViewSet(ObjectLevelAccessRestrictionViewSetMixin, viewsets.ModelViewSet):
+class GroupsViewSet(
+        ConditionalGetViewSetMixin, RelatedFieldsViewSetMixin, ObjectLevelAccessRestrictionViewSetMixin,
+        viewsets.ModelViewSet):
     '''
     Main printer group endpoint
 
@@ -19,20 +24,32 @@ class GroupsViewSet(ObjectLevelAccessRestrictionViewSetMixin, viewsets.ModelView
     queryset = models.Group.objects.all()
 
     create_permissions = [permissions.IsAuthenticated]
+    ordering = ('id', )  # groups have no timestamp
+    prefetch_related_fields = {
+        'users': ['useringroup_set__user'],
+        'printers': ['printeringroup_set__printer'],
+    }
+    version_tables = ('groups.useringroup', 'printers.printeringroup', 'printers.printer', 'users.user')
 
 
-class MyGroupsViewSet(GroupsViewSet):
+class MyGroupsViewSet(CachedListViewSetMixin, GroupsViewSet):
     '''
-    Same as GroupsViewSet but limited to gropus of current user.
+    Same as GroupsViewSet but limited to gropus of current user (the rendered
+    list is cached, see `CachedListViewSetMixin`).
     '''
 
     listing_permissions = [permissions.IsAuthenticated]
+    cached_tables = ('groups.group', )
+    cached_field_tables = {
+        'users': ('groups.useringroup', 'users.user'),
+        'printers': ('printers.printeringroup', 'printers.printer'),
+    }
 
     def get_queryset(self):
         return self.request.user.printer_groups.all()
 
 
-class UsersInGroupViewSet(NestedViewMixin, ObjectLevelAccessRestrictionViewSetMixin, viewsets.ModelViewSet):
+class UsersInGroupViewSet(NestedViewMixin, RelatedFieldsViewSetMixin, ObjectLevelAccessRestrictionViewSetMixin, viewsets.ModelViewSet):
     '''
     List / delete / update groups this printer belongs to.
 
@@ -48,6 +65,7 @@ class UsersInGroupViewSet(NestedViewMixin, ObjectLevelAccessRestrictionViewSetMi
     parent_model = models.Group
     listing_permissions = [IsUserOfParentObject]
     create_permissions = [IsUserOfParentObject]
+    select_related_fields = {'userId': ['user'], 'username': ['user'], 'url': ['user']}
 
     def get_queryset(self):
         return models.UserInGroup.objects.filter(group=self.request.parent_instance)
@@ -0,0 +1,8 @@
+from django.contrib import admin
+from jobs.models import PrintJob
+
+class PrintJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'file', 'group', 'printer', 'state', 'priority', 'created_on')
+    list_filter = ('state', )
+
+admin.site.register(PrintJob, PrintJobAdmin)
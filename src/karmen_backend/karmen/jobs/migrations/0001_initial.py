@@ -0,0 +1,46 @@
+# Generated by Django 3.1 on 2020-08-24 10:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import karmen.models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('files', '0009_blob_compression'),
+        ('printers', '0006_filetransfer'),
+        ('groups', '0002_auto_20200731_1156'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrintJob',
+            fields=[
+                ('id', karmen.models.IdField(serialize=False)),
+                ('priority', models.IntegerField(default=0, help_text='Jobs with higher priority are printed first.', verbose_name='Priority')),
+                ('state', models.CharField(choices=[('queued', 'queued'), ('dispatched', 'dispatched'), ('printing', 'printing'), ('done', 'done'), ('failed', 'failed'), ('cancelled', 'cancelled')], default='queued', max_length=20, verbose_name='State')),
+                ('error', models.CharField(blank=True, max_length=255, verbose_name='Error')),
+                ('created_on', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('dispatched_on', models.DateTimeField(blank=True, null=True)),
+                ('finished_on', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='print_jobs', to='files.file')),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='print_jobs', to='groups.group')),
+                ('printer', models.ForeignKey(blank=True, help_text='Printer the job was assigned to.', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='print_jobs', to='printers.printer')),
+                ('transfer', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='print_job', to='printers.filetransfer')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='printjob',
+            index=models.Index(fields=['state', '-priority', 'created_on'], name='print_job_queue'),
+        ),
+        migrations.AddConstraint(
+            model_name='printjob',
+            constraint=models.UniqueConstraint(condition=models.Q(state__in=('dispatched', 'printing')), fields=('printer',), name='Uniq_active_job_on_printer'),
+        ),
+    ]
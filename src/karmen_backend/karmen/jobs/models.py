@@ -0,0 +1,77 @@
+from django.db import models
+from karmen import ROLE_ADMIN
+from karmen.models import IdField, join_id
+
+
+JOB_QUEUED = 'queued'
+JOB_DISPATCHED = 'dispatched'
+JOB_PRINTING = 'printing'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+JOB_STATES = (
+    (JOB_QUEUED, JOB_QUEUED),
+    (JOB_DISPATCHED, JOB_DISPATCHED),
+    (JOB_PRINTING, JOB_PRINTING),
+    (JOB_DONE, JOB_DONE),
+    (JOB_FAILED, JOB_FAILED),
+    (JOB_CANCELLED, JOB_CANCELLED),
+)
+'''states of `PrintJob`'''
+JOB_ACTIVE_STATES = (JOB_DISPATCHED, JOB_PRINTING)
+'''states in which the job occupies its printer'''
+JOB_FINISHED_STATES = (JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+
+
+class PrintJob(models.Model):
+    '''
+    Request to print a `files.File` on any idle printer of a `groups.Group`
+
+    Queued jobs are assigned to printers by the scheduler (see `jobs.scheduler`)
+    which sends the file to the printer (`transfer`) and starts the print. A
+    printer runs at most one active job (enforced by a conditional unique
+    constraint).
+    '''
+
+    id = IdField()
+    file = models.ForeignKey('files.File', on_delete=models.CASCADE, related_name='print_jobs')
+    group = models.ForeignKey('groups.Group', on_delete=models.CASCADE, related_name='print_jobs')
+    created_by = models.ForeignKey('users.User', on_delete=models.CASCADE)
+    priority = models.IntegerField('Priority', default=0, help_text='Jobs with higher priority are printed first.')
+    state = models.CharField('State', max_length=20, choices=JOB_STATES, default=JOB_QUEUED)
+    printer = models.ForeignKey(
+        'printers.Printer', on_delete=models.SET_NULL, null=True, blank=True, related_name='print_jobs',
+        help_text='Printer the job was assigned to.')
+    transfer = models.OneToOneField(
+        'printers.FileTransfer', on_delete=models.SET_NULL, null=True, blank=True, related_name='print_job')
+    error = models.CharField('Error', max_length=255, blank=True)
+    created_on = models.DateTimeField(auto_now_add=True, db_index=True)
+    dispatched_on = models.DateTimeField(null=True, blank=True)
+    finished_on = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                fields=('printer', ), condition=models.Q(state__in=JOB_ACTIVE_STATES), name='Uniq_active_job_on_printer'),
+        )
+        indexes = (
+            models.Index(fields=('state', '-priority', 'created_on'), name='print_job_queue'),
+        )
+
+    @property
+    def is_finished(self):
+        return self.state in JOB_FINISHED_STATES
+
+    def can_view(self, user, access=None):
+        '''members of the group can see its jobs'''
+        if access is not None:
+            return access.group_role(self.group_id) is not None
+        return self.group.can_view(user)
+
+    def can_modify(self, user, access=None):
+        '''job can be cancelled by the user who created it or by group admin'''
+        if user.is_authenticated and join_id(self.created_by_id) == join_id(user.pk):
+            return True
+        if access is not None:
+            return access.group_role(self.group_id) == ROLE_ADMIN
+        return self.group.can_modify(user)
@@ -0,0 +1,189 @@
+'''
+Print job scheduler
+
+`schedule` runs periodically (`manage.py schedule_jobs`) and
+
+- moves active jobs forward - a dispatched job is printing once its file is
+  uploaded (the upload starts the print), a printing job is done once the
+  printer is seen idle again,
+- assigns queued jobs (by priority, oldest first) to idle printers of their
+  groups and starts the uploads (see `printers.transfers`, the uploads of
+  all dispatched jobs run concurrently in the transfer thread pool).
+
+Printers are judged by their polled snapshots (see `printers.status`, the
+`poll_printers` command has to run), devices are not queried by the scheduler.
+
+Queued jobs are locked by `SELECT ... FOR UPDATE SKIP LOCKED` so several
+schedulers can run at once without taking the same job. A printer can not be
+double-booked - the unique constraint on active jobs of a printer rejects the
+second assignment.
+'''
+from datetime import timedelta
+from logging import getLogger
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from karmen.models import join_id
+from printers.models import Printer, PrinterInGroup, TRANSFER_DONE, TRANSFER_FAILED, TRANSFER_CANCELLED
+from printers.status import get_snapshots
+from printers.transfers import start_transfers, cancel_transfer
+from jobs.models import (
+    PrintJob, JOB_QUEUED, JOB_DISPATCHED, JOB_PRINTING, JOB_DONE, JOB_FAILED, JOB_CANCELLED, JOB_ACTIVE_STATES,
+)
+
+
+logger = getLogger()
+
+BUSY_FLAGS = ('printing', 'paused', 'pausing', 'cancelling', 'error', 'closedOrError')
+'''state flags of a printer (see Octoprint's `/api/printer`) which keep it from getting a new job'''
+
+PRINTER_DELETED_ERROR = 'The printer was deleted.'
+NOT_FINISHED_ERROR = 'The print did not finish.'
+
+
+def _flags(snapshot):
+    try:
+        return snapshot['printer']['state']['flags'] or {}
+    except (KeyError, TypeError):
+        return {}
+
+
+def _polled_on(snapshot):
+    return parse_datetime(snapshot.get('polledOn') or '') if snapshot else None
+
+
+def is_idle(snapshot, now):
+    '''whether printer of `snapshot` can start a print (judged by a recent snapshot only)'''
+    polled_on = _polled_on(snapshot)
+    if polled_on is None or now - polled_on > timedelta(seconds=settings.JOB_SNAPSHOT_MAX_AGE):
+        return False
+    if 'error' in snapshot:
+        return False
+    flags = _flags(snapshot)
+    return bool(flags.get('operational') and flags.get('ready')) and not any(flags.get(flag) for flag in BUSY_FLAGS)
+
+
+def is_busy(snapshot):
+    flags = _flags(snapshot)
+    return any(flags.get(flag) for flag in BUSY_FLAGS if flag not in ('error', 'closedOrError'))
+
+
+def _finish(job, state, error='', previous_state=None):
+    '''moves `job` to finished `state` unless its state was changed meanwhile (e.g. it was cancelled)'''
+    job.state = state
+    job.error = error[:255]
+    job.finished_on = timezone.now()
+    return PrintJob.objects \
+        .filter(pk=job.pk, state=previous_state or JOB_DISPATCHED) \
+        .update(state=job.state, error=job.error, finished_on=job.finished_on)
+
+
+def update_active_jobs(now):
+    '''moves dispatched and printing jobs forward, returns number of changed jobs'''
+    jobs = list(PrintJob.objects.filter(state__in=JOB_ACTIVE_STATES).select_related('transfer'))
+    snapshots = get_snapshots(set(job.printer_id for job in jobs if job.printer_id))
+    changed = 0
+    for job in jobs:
+        transfer = job.transfer
+        if job.printer_id is None:
+            changed += _finish(job, JOB_FAILED, PRINTER_DELETED_ERROR, job.state)
+        elif job.state == JOB_DISPATCHED:
+            if transfer is None or transfer.state in (TRANSFER_FAILED, TRANSFER_CANCELLED):
+                error = transfer.error if transfer is not None else 'The transfer was deleted.'
+                state = JOB_CANCELLED if transfer is not None and transfer.state == TRANSFER_CANCELLED else JOB_FAILED
+                changed += _finish(job, state, error or 'The upload failed.')
+            elif transfer.state == TRANSFER_DONE:
+                changed += PrintJob.objects.filter(pk=job.pk, state=JOB_DISPATCHED).update(state=JOB_PRINTING)
+        else:
+            # the print starts with some delay after the upload, only later snapshots tell it is over
+            snapshot = snapshots.get(job.printer_id)
+            polled_on = _polled_on(snapshot)
+            uploaded_on = transfer.finished_on if transfer is not None and transfer.finished_on else job.dispatched_on
+            started = uploaded_on + timedelta(seconds=settings.JOB_PRINT_START_DELAY)
+            if polled_on is None or polled_on < started or 'error' in snapshot or is_busy(snapshot):
+                continue
+            try:
+                completion = snapshot['job']['progress']['completion']
+            except (KeyError, TypeError):
+                completion = None
+            if completion is not None and completion < 100:
+                changed += _finish(job, JOB_FAILED, NOT_FINISHED_ERROR, JOB_PRINTING)
+            else:
+                changed += _finish(job, JOB_DONE, previous_state=JOB_PRINTING)
+    return changed
+
+
+def dispatch_jobs(now):
+    '''assigns queued jobs to idle printers and starts their uploads, returns the dispatched jobs'''
+    dispatched = []
+    with transaction.atomic():
+        jobs = list(
+            PrintJob.objects
+            .select_for_update(skip_locked=True, of=('self', ))
+            .select_related('file', 'created_by')
+            .filter(state=JOB_QUEUED)
+            .order_by('-priority', 'created_on')[:settings.JOB_DISPATCH_BATCH]
+        )
+        if not jobs:
+            return dispatched
+        group_printers = {}
+        for group_id, printer_id in PrinterInGroup.objects \
+                .filter(group_id__in=set(job.group_id for job in jobs)) \
+                .exclude(printer__api_key='') \
+                .order_by('printer_id') \
+                .values_list('group_id', 'printer_id'):
+            group_printers.setdefault(join_id(group_id), []).append(join_id(printer_id))
+        candidates = set(printer_id for printers in group_printers.values() for printer_id in printers)
+        booked = set(
+            join_id(printer_id) for printer_id in PrintJob.objects
+            .filter(state__in=JOB_ACTIVE_STATES, printer_id__in=candidates)
+            .values_list('printer_id', flat=True)
+        )
+        idle = set(
+            join_id(printer_id) for printer_id, snapshot in get_snapshots(candidates - booked).items()
+            if is_idle(snapshot, now)
+        )
+        printers = {join_id(printer.pk): printer for printer in Printer.objects.filter(pk__in=idle)}
+        for job in jobs:
+            printer_id = next((
+                printer_id for printer_id in group_printers.get(join_id(job.group_id), ()) if printer_id in idle
+            ), None)
+            if printer_id is None:
+                continue
+            idle.discard(printer_id)
+            try:
+                with transaction.atomic():
+                    # (fails if another scheduler booked the printer meanwhile)
+                    job.printer = printers[printer_id]
+                    job.state = JOB_DISPATCHED
+                    job.dispatched_on = now
+                    job.save(update_fields=['printer', 'state', 'dispatched_on'])
+                    job.transfer = start_transfers(job.file, [job.printer], job.created_by, start_print=True)[0]
+                    job.save(update_fields=['transfer'])
+            except IntegrityError:
+                logger.info('Printer %s was booked by another scheduler.', printer_id)
+                continue
+            dispatched.append(job)
+    return dispatched
+
+
+def schedule():
+    '''single round of the scheduler, returns number of dispatched jobs'''
+    now = timezone.now()
+    update_active_jobs(now)
+    dispatched = dispatch_jobs(now)
+    if dispatched:
+        logger.info('Dispatched %s print jobs.', len(dispatched))
+    return len(dispatched)
+
+
+def cancel_job(job):
+    '''cancels queued or dispatched `job` (and its upload), returns False if it is too late'''
+    if job.state == JOB_DISPATCHED and job.transfer_id is not None:
+        cancel_transfer(job.transfer)
+    cancelled = PrintJob.objects \
+        .filter(pk=job.pk, state__in=(JOB_QUEUED, JOB_DISPATCHED)) \
+        .update(state=JOB_CANCELLED, finished_on=timezone.now())
+    job.refresh_from_db()
+    return bool(cancelled)
@@ -0,0 +1,46 @@
+from rest_framework import serializers, exceptions
+from karmen.access import get_access
+from files.models import File
+from groups.models import Group
+from jobs import models
+
+
+class PrintJobSerializer(serializers.ModelSerializer):
+    '''Print job (see `jobs.scheduler`), only `fileId`, `groupId` and `priority` are written'''
+
+    url = serializers.HyperlinkedIdentityField(view_name='job-detail')
+    fileId = serializers.CharField(source='file_id')
+    groupId = serializers.CharField(source='group_id')
+    printerId = serializers.CharField(source='printer_id', read_only=True)
+    transferId = serializers.CharField(source='transfer_id', read_only=True)
+    createdBy = serializers.CharField(source='created_by_id', read_only=True)
+    createdOn = serializers.DateTimeField(source='created_on', read_only=True)
+    dispatchedOn = serializers.DateTimeField(source='dispatched_on', read_only=True)
+    finishedOn = serializers.DateTimeField(source='finished_on', read_only=True)
+
+    class Meta:
+        model = models.PrintJob
+        fields = [
+            'id', 'url', 'fileId', 'groupId', 'priority', 'state', 'printerId', 'transferId', 'error',
+            'createdBy', 'createdOn', 'dispatchedOn', 'finishedOn',
+        ]
+        read_only_fields = ['id', 'state', 'error']
+
+    def _get_accessible(self, model, pk, field):
+        try:
+            obj = model.objects.get(pk=pk)
+        except model.DoesNotExist:
+            raise exceptions.ValidationError({field: f"{model.__name__} '{pk}' does not exist."})
+        if not get_access(self.context['request']).can_view(obj):
+            raise exceptions.ValidationError({field: f"{model.__name__} '{pk}' is not accessible."})
+        return obj
+
+    def validate(self, attrs):
+        if self.instance is not None:
+            if set(attrs) - {'priority'}:
+                raise exceptions.ValidationError({'code': 'read-only', 'detail': 'Only priority of a job can be changed.'})
+            return attrs
+        attrs['file'] = self._get_accessible(File, attrs.pop('file_id'), 'fileId')
+        attrs['group'] = self._get_accessible(Group, attrs.pop('group_id'), 'groupId')
+        attrs['created_by'] = self.context['request'].user
+        return attrs
@@ -0,0 +1,98 @@
+from datetime import timedelta
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from karmen import ROLE_ADMIN, ROLE_USER
+from karmen.models import join_id
+from users.models import User
+from groups.models import Group
+from files.models import File
+from printers.models import Printer, TRANSFER_DONE
+from printers.status import save_snapshot
+from jobs.models import PrintJob, JOB_QUEUED, JOB_DISPATCHED, JOB_PRINTING, JOB_DONE, JOB_CANCELLED
+from jobs.scheduler import schedule
+
+
+def printer_state(printing=False, completion=None):
+    return {
+        'printer': {'state': {'flags': {'operational': True, 'ready': not printing, 'printing': printing}}},
+        'job': {'progress': {'completion': completion}},
+    }
+
+
+@override_settings(PRINTER_STATUS_CACHE='default', JOB_PRINT_START_DELAY=0)
+class SchedulerTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user@example.com')
+        self.group = Group.objects.create(name='farm')
+        self.group.set_user(self.user, ROLE_USER)
+        self.file = File.objects.create(name='a.gcode', file='a.gcode', group=self.group, uploaded_by=self.user)
+        self.printers = [
+            Printer.objects.create(name='printer %s' % index, api_key='http://10.0.0.%s/api' % index)
+            for index in range(3)
+        ]
+        self.group.printers.add(*self.printers)
+        save_snapshot(self.printers[0].pk, printer_state())
+        save_snapshot(self.printers[1].pk, printer_state())
+        save_snapshot(self.printers[2].pk, printer_state(printing=True))
+
+    def queue(self, count, priority=0):
+        return [
+            PrintJob.objects.create(file=self.file, group=self.group, created_by=self.user, priority=priority)
+            for _ in range(count)
+        ]
+
+    def test_dispatch(self):
+        jobs = self.queue(3) + self.queue(1, priority=1)
+        self.assertEqual(schedule(), 2)
+        states = {join_id(job.pk): (job.state, job.printer_id) for job in PrintJob.objects.all()}
+        # the urgent job first, busy printer gets nothing
+        self.assertEqual(states[join_id(jobs[3].pk)][0], JOB_DISPATCHED)
+        self.assertEqual(states[join_id(jobs[0].pk)][0], JOB_DISPATCHED)
+        self.assertEqual([states[join_id(job.pk)][0] for job in jobs[1:3]], [JOB_QUEUED, JOB_QUEUED])
+        printer_ids = set(join_id(states[join_id(job.pk)][1]) for job in (jobs[0], jobs[3]))
+        self.assertEqual(printer_ids, set(join_id(printer.pk) for printer in self.printers[:2]))
+        self.assertTrue(all(job.transfer.start_print for job in PrintJob.objects.filter(state=JOB_DISPATCHED)))
+        # printers are booked until their jobs are over
+        self.assertEqual(schedule(), 0)
+
+        job = PrintJob.objects.get(pk=jobs[0].pk)
+        job.transfer.state = TRANSFER_DONE
+        job.transfer.finished_on = timezone.now() - timedelta(seconds=1)
+        job.transfer.save()
+        save_snapshot(job.printer_id, printer_state(printing=True))
+        schedule()
+        self.assertEqual(PrintJob.objects.get(pk=job.pk).state, JOB_PRINTING)
+        save_snapshot(job.printer_id, printer_state(completion=100))
+        self.assertEqual(schedule(), 1)
+        self.assertEqual(PrintJob.objects.get(pk=job.pk).state, JOB_DONE)
+        self.assertEqual(PrintJob.objects.filter(state=JOB_QUEUED).count(), 1)
+
+    def test_api(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post('/api/2/jobs/', {'fileId': self.file.pk, 'groupId': self.group.pk}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data['state'], JOB_QUEUED)
+        other = Group.objects.create(name='other')
+        response = client.post('/api/2/jobs/', {'fileId': self.file.pk, 'groupId': other.pk}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(client.get('/api/2/jobs/').data['results']), 1)
+
+        job = PrintJob.objects.get()
+        schedule()
+        response = client.post('/api/2/jobs/%s/cancel/' % job.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['state'], JOB_CANCELLED)
+        job.refresh_from_db()
+        self.assertTrue(job.transfer.cancelled)
+        self.assertEqual(client.post('/api/2/jobs/%s/cancel/' % job.pk).status_code, 409)
+        # another member of the group can see the job but not cancel it
+        member = User.objects.create_user(username='member@example.com')
+        self.group.set_user(member, ROLE_USER)
+        client.force_authenticate(member)
+        self.assertEqual(client.get('/api/2/jobs/%s/' % job.pk).status_code, 200)
+        self.assertEqual(client.post('/api/2/jobs/%s/cancel/' % job.pk).status_code, 403)
+        self.group.set_user(member, ROLE_ADMIN)
+        self.assertEqual(client.post('/api/2/jobs/%s/cancel/' % job.pk).status_code, 409)
@@ -0,0 +1,44 @@
+from rest_framework import viewsets, permissions, decorators, status
+from rest_framework.response import Response
+from karmen.viewsets import ObjectLevelAccessRestrictionViewSetMixin
+from karmen.permissions import IsManagerOfObject
+from jobs import models, serializers
+from jobs.scheduler import cancel_job
+
+
+class PrintJobsViewSet(ObjectLevelAccessRestrictionViewSetMixin, viewsets.ModelViewSet):
+    '''
+    Queue of print jobs (see `jobs.scheduler`).
+
+    Members of a group can queue jobs printing an accessible file on any idle
+    printer of the group (`{"fileId": ..., "groupId": ..., "priority": 0}`)
+    and list jobs of their groups. Jobs are cancelled by `jobs/<id>/cancel`
+    (deleting a job which is not finished cancels it as well).
+    '''
+
+    serializer_class = serializers.PrintJobSerializer
+    listing_permissions = create_permissions = [permissions.IsAuthenticated]
+    action_permissions = {'cancel': [IsManagerOfObject]}
+    ordering = ('-created_on', 'id')
+    http_method_names = ['get', 'post', 'patch', 'delete', 'head', 'options']
+
+    def get_queryset(self):
+        queryset = models.PrintJob.objects.filter(group__users=self.request.user)
+        state = self.request.query_params.get('state')
+        if state:
+            queryset = queryset.filter(state__in=state.split(','))
+        return queryset
+
+    @decorators.action(detail=True, methods=['post'])
+    def cancel(self, request, pk=None):
+        job = self.get_object()
+        if not cancel_job(job):
+            return Response(
+                {'code': 'job-not-cancellable', 'detail': f'The job is {job.state} already.'},
+                status=status.HTTP_409_CONFLICT,
+            )
+        return Response(self.get_serializer(job).data)
+
+    def perform_destroy(self, instance):
+        cancel_job(instance)
+        instance.delete()
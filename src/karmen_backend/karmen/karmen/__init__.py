@@ -1,3 +1,5 @@
+default_app_config = 'karmen.apps.KarmenConfig'
+
 
 ROLE_ADMIN = 'admin'  # can do anything with the printer
 '''admin role - used in models to designate that one object can manage the other'''
@@ -0,0 +1,82 @@
+from django.db.models import Value, CharField
+from django.utils.functional import cached_property
+from karmen import ROLE_ADMIN
+from karmen.models import join_id
+
+
+ROLE_PRIORITY = {ROLE_ADMIN: 2}
+'''higher wins when user has several roles on the same object (e.g. direct and through a group)'''
+
+
+class AccessResolver(object):
+    '''
+    Effective roles of a user on printers and groups.
+
+    All roles are loaded by a single query the first time they are needed:
+
+    - printer roles - effective roles materialized in `printers.PrinterAccess`
+      (direct roles and roles inherited from groups),
+    - group roles (`UserInGroup`).
+
+    Object level checks (`can_view`, `can_modify`, `can_delete`) are then
+    dictionary lookups. Objects are expected to accept the resolver as
+    `access` keyword argument of their `can_*` methods.
+
+    Use `get_access(request)` to get resolver memoized on the request.
+    '''
+
+    def __init__(self, user):
+        self.user = user
+
+    @cached_property
+    def roles(self):
+        '''{'printer': {printer_id: role}, 'group': {group_id: role}}'''
+        roles = {'printer': {}, 'group': {}}
+        if not self.user.is_authenticated:
+            return roles
+        # pylint: disable=import-outside-toplevel
+        from printers.models import PrinterAccess
+        from groups.models import UserInGroup
+
+        def kind(name):
+            return Value(name, output_field=CharField())
+
+        printers = PrinterAccess.objects \
+            .filter(user=self.user) \
+            .annotate(kind=kind('printer')) \
+            .values_list('kind', 'printer_id', 'role')
+        groups = UserInGroup.objects \
+            .filter(user=self.user) \
+            .annotate(kind=kind('group')) \
+            .values_list('kind', 'group_id', 'role')
+        for name, object_id, role in printers.union(groups, all=True):
+            roles[name][join_id(object_id)] = role
+        return roles
+
+    def printer_role(self, printer_id):
+        '''effective role of the user on printer (None when the user has no access)'''
+        return self.roles['printer'].get(join_id(printer_id))
+
+    def group_role(self, group_id):
+        '''role of the user in group (None when the user is not a member)'''
+        return self.roles['group'].get(join_id(group_id))
+
+    def can_view(self, obj):
+        return obj.can_view(self.user, access=self)
+
+    def can_modify(self, obj):
+        return obj.can_modify(self.user, access=self)
+
+    def can_delete(self, obj):
+        if hasattr(obj, 'can_delete'):
+            return obj.can_delete(self.user, access=self)
+        return self.can_modify(obj)
+
+
+def get_access(request):
+    '''returns `AccessResolver` of the request user (memoized on the request)'''
+    request = getattr(request, '_request', request)  # share between django's and rest framework's request
+    access = getattr(request, '_karmen_access', None)
+    if access is None or access.user != request.user:
+        access = request._karmen_access = AccessResolver(request.user)
+    return access
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class KarmenConfig(AppConfig):
+    name = 'karmen'
+
+    def ready(self):
+        # pylint: disable=import-outside-toplevel
+        from karmen.versions import connect_signals
+        connect_signals()
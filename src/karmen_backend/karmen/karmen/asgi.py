@@ -8,9 +8,44 @@ https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
 """
 
 import os
+import re
 
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'karmen.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# pylint: disable=wrong-import-position
+from printers.events import printer_events
+from printers.octoprint_async import keep_session, close_session
+from printers.webcam_relay import webcam_stream
+
+WEBCAM_STREAM_PATH = re.compile(r'^/(?:api/2/)?(?:users/me/)?printers/(?P<printer_id>[^/]+)/webcam-stream/?$')
+'''streams are relayed by a plain ASGI app (django can not stream from async views)'''
+EVENTS_PATH = re.compile(r'^/(?:api/2/)?users/me/printers/events/?$')
+
+
+async def lifespan(receive, send):
+    '''keeps the session to devices open for the lifetime of the server (see `printers.octoprint_async`)'''
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            keep_session()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_session()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] == 'http':
+        match = WEBCAM_STREAM_PATH.match(scope['path'])
+        if match:
+            return await webcam_stream(scope, receive, send, match.group('printer_id'))
+        if EVENTS_PATH.match(scope['path']):
+            return await printer_events(scope, receive, send)
+    return await django_application(scope, receive, send)
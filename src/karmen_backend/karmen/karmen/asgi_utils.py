@@ -0,0 +1,59 @@
+'''
+Helpers of plain ASGI applications (see `karmen/asgi.py`)
+
+Django 3.1 can not stream responses from async views - endless responses
+(webcam streams, server-sent events) are served by plain ASGI applications
+which authenticate the user and respond by themselves.
+'''
+import json
+from urllib.parse import parse_qs
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, AuthenticationFailed
+
+
+FORBIDDEN = 'You do not have permission to perform this action.'
+NOT_AUTHENTICATED = 'Authentication credentials were not provided.'
+
+
+def query_params(scope):
+    '''{name: [values]} of the query string'''
+    return parse_qs(scope.get('query_string', b'').decode('latin-1'))
+
+
+def authenticate(scope):
+    '''
+    user authenticated by JWT access token (see `tokens`) in `Authorization`
+    header or in `token` query param (or None), browsers can not send headers
+    with `<img src=...>` nor with `EventSource`
+    '''
+    authentication = JWTAuthentication()
+    headers = dict(scope.get('headers', []))
+    raw_token = None
+    if b'authorization' in headers:
+        raw_token = authentication.get_raw_token(headers[b'authorization'])
+    if raw_token is None:
+        token = query_params(scope).get('token')
+        raw_token = token[0].encode() if token else None
+    if raw_token is None:
+        return None
+    try:
+        return authentication.get_user(authentication.get_validated_token(raw_token))
+    except (InvalidToken, AuthenticationFailed):
+        return None
+
+
+async def respond(send, status, detail):
+    '''sends JSON error response `{"detail": detail}`'''
+    body = json.dumps({'detail': detail}).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def wait_for_disconnect(receive):
+    '''returns once the client disconnects'''
+    while (await receive())['type'] != 'http.disconnect':
+        pass
@@ -0,0 +1,157 @@
+'''
+Two-tier cache
+
+Values are cached in a small in-process LRU for a short time in front of a
+cache shared by all processes (`CACHES['shared']`, e.g. file based or redis).
+Hot values are thus served without a round trip to the shared backend and
+without unpickling. Values from the local tier are shared by all threads of
+the process - treat them as read-only.
+
+Local tiers of all processes are invalidated by `TwoTierCache.invalidate`.
+Keys are spread over `GENERATION_BUCKETS` buckets, each with a generation
+counter in the shared cache. Invalidation bumps the counter of the key's bucket
+and every process drops local entries of that bucket when it notices the
+change (all counters are read by a single round trip at most once per
+`check_interval` seconds).
+'''
+from collections import OrderedDict
+from zlib import crc32
+from threading import Lock
+from time import monotonic
+from django.conf import settings
+from django.core.cache import caches
+
+
+class TwoTierCache(object):
+    '''
+    In-process LRU cache backed by a shared django cache.
+
+    Supports the subset of django's cache API used by `karmen.utils.lock_cached`
+    (`get`, `set`, `delete`) plus `get_shared`, `invalidate` and `stats`.
+    '''
+
+    GENERATION_KEY_PREFIX = 'two-tier-cache-generation-'
+    GENERATION_BUCKETS = 64
+    '''invalidation of a key drops about 1/64 of local tiers'''
+
+    def __init__(self, shared_alias, max_entries, local_ttl, check_interval):
+        self.shared_alias = shared_alias
+        self.max_entries = max_entries
+        self.local_ttl = local_ttl
+        self.check_interval = check_interval
+        self._local = OrderedDict()
+        '''{key: (expires_at, value)} in LRU order (the most recent last)'''
+        self._lock = Lock()
+        self._generations = None
+        '''generations of buckets seen by the last check'''
+        self._checked_on = 0
+        self.hits = {'local': 0, 'shared': 0}
+        self.misses = 0
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    def _bucket(self, key):
+        return crc32(key.encode('utf-8')) % self.GENERATION_BUCKETS
+
+    def _generation_key(self, bucket):
+        return '%s%s' % (self.GENERATION_KEY_PREFIX, bucket)
+
+    def _sync(self):
+        '''drops local entries of buckets in which another process invalidated a key'''
+        now = monotonic()
+        if now - self._checked_on < self.check_interval:
+            return
+        keys = [self._generation_key(bucket) for bucket in range(self.GENERATION_BUCKETS)]
+        stored = self.shared.get_many(keys)
+        generations = [stored.get(key, 0) for key in keys]
+        with self._lock:
+            if self._generations is not None and generations != self._generations:
+                changed = set(
+                    bucket for bucket, (seen, generation) in enumerate(zip(self._generations, generations))
+                    if seen != generation
+                )
+                for key in [key for key in self._local if self._bucket(key) in changed]:
+                    del self._local[key]
+            self._generations = generations
+            self._checked_on = now
+
+    def _set_local(self, key, value, timeout=None):
+        ttl = self.local_ttl if timeout is None else min(timeout, self.local_ttl)
+        with self._lock:
+            self._local[key] = (monotonic() + ttl, value)
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_entries:
+                self._local.popitem(last=False)
+
+    def get(self, key, default=None):
+        self._sync()
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is not None:
+                if entry[0] > monotonic():
+                    self._local.move_to_end(key)
+                    self.hits['local'] += 1
+                    return entry[1]
+                del self._local[key]
+        value = self.shared.get(key)
+        if value is None:
+            with self._lock:
+                self.misses += 1
+            return default
+        with self._lock:
+            self.hits['shared'] += 1
+        self._set_local(key, value)
+        return value
+
+    def get_shared(self, key, default=None):
+        '''reads the key from the shared tier (and updates the local tier)'''
+        value = self.shared.get(key)
+        if value is None:
+            return default
+        self._set_local(key, value)
+        return value
+
+    def set(self, key, value, timeout=None):
+        self.shared.set(key, value, timeout=timeout)
+        self._set_local(key, value, timeout)
+
+    def delete(self, key):
+        '''deletes the key from the shared tier and the local tier of this process'''
+        self.shared.delete(key)
+        with self._lock:
+            self._local.pop(key, None)
+
+    def invalidate(self, key):
+        '''deletes the key in all processes'''
+        self.delete(key)
+        generation_key = self._generation_key(self._bucket(key))
+        try:
+            self.shared.incr(generation_key)
+        except ValueError:
+            self.shared.add(generation_key, 1, timeout=None)
+
+    def clear(self):
+        '''clears both tiers (the shared one completely)'''
+        self.shared.clear()
+        with self._lock:
+            self._local.clear()
+            self._checked_on = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': dict(self.hits),
+                'misses': self.misses,
+                'localEntries': len(self._local),
+            }
+
+
+two_tier_cache = TwoTierCache(
+    shared_alias='shared',
+    max_entries=settings.TWO_TIER_CACHE_MAX_ENTRIES,
+    local_ttl=settings.TWO_TIER_CACHE_LOCAL_TTL,
+    check_interval=settings.TWO_TIER_CACHE_CHECK_INTERVAL,
+)
+'''cache used by `karmen.utils.lock_cached` (device responses)'''
@@ -0,0 +1,26 @@
+from logging import getLogger
+from django.core.management.base import BaseCommand
+from files.models import Blob
+from files.analysis import analyze_blob
+
+
+logger = getLogger()
+
+
+class Command(BaseCommand):
+    help = '''Extracts metadata of uploaded files which were not analyzed yet.
+
+Uploaded files are analyzed in background right after the upload, this command
+catches up with files missed by that (e.g. uploaded before a restart).'''
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Analyze all files again (e.g. after the analyzer was improved).')
+
+    def handle(self, *args, **options):
+        blobs = Blob.objects.all() if options['all'] else Blob.objects.filter(metadata__isnull=True)
+        analyzed = 0
+        for blob in blobs.iterator():
+            analyzed += analyze_blob(blob) is not None
+        logger.info('Analyzed %s files.', analyzed)
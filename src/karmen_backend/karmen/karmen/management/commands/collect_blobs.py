@@ -0,0 +1,44 @@
+from datetime import timedelta
+from logging import getLogger
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from files.models import Blob
+from files.storage import BLOBS_DIR, release_blob, name_digest
+
+
+logger = getLogger()
+
+
+class Command(BaseCommand):
+    help = '''Deletes stored blobs which are not referenced by any file.
+
+Blobs are released as soon as their last file is deleted. This command cleans up
+what was left behind by failed uploads or interrupted deletes.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-age', type=int, default=3600,
+            help='Keep unregistered blobs younger than this many seconds (uploads in progress).')
+
+    def handle(self, *args, **options):
+        released = 0
+        for digest in Blob.objects.filter(files__isnull=True).values_list('digest', flat=True):
+            released += release_blob(digest)
+        logger.info('Released %s unreferenced blobs.', released)
+
+        if not default_storage.exists(BLOBS_DIR):
+            return
+        min_created = timezone.now() - timedelta(seconds=options['min_age'])
+        deleted = 0
+        for directory in default_storage.listdir(BLOBS_DIR)[0]:
+            names = default_storage.listdir('%s/%s' % (BLOBS_DIR, directory))[1]
+            # (a blob stored before it was compressed is unregistered too)
+            blobs = Blob.objects.filter(digest__in=[name_digest(name) for name in names]).only('digest', 'encoding')
+            known = set(blob.name.rsplit('/', 1)[-1] for blob in blobs)
+            for base in set(names) - known:
+                name = '%s/%s/%s' % (BLOBS_DIR, directory, base)
+                if default_storage.get_modified_time(name) < min_created:
+                    default_storage.delete(name)
+                    deleted += 1
+        logger.info('Deleted %s unregistered blobs.', deleted)
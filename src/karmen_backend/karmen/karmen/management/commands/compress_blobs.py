@@ -0,0 +1,24 @@
+from logging import getLogger
+from django.core.management.base import BaseCommand
+from files.models import Blob
+from files.storage import compress_blob
+
+
+logger = getLogger()
+
+
+class Command(BaseCommand):
+    help = '''Compresses stored blobs which were stored uncompressed.
+
+New blobs are compressed when they are stored (unless BLOB_COMPRESSION is
+disabled), this command converts blobs stored before. Blobs which do not
+compress well are kept as they are.'''
+
+    def handle(self, *args, **options):
+        compressed = skipped = 0
+        for digest in Blob.objects.filter(encoding='').values_list('digest', flat=True).iterator():
+            if compress_blob(digest):
+                compressed += 1
+            else:
+                skipped += 1
+        logger.info('Compressed %s blobs, %s kept uncompressed.', compressed, skipped)
@@ -0,0 +1,22 @@
+from datetime import timedelta
+from logging import getLogger
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from files.models import UploadSession
+
+
+logger = getLogger()
+
+
+class Command(BaseCommand):
+    help = 'Deletes unfinished upload sessions older than UPLOAD_SESSION_TTL (and their data).'
+
+    def handle(self, *args, **options):
+        expired = UploadSession.objects.filter(
+            created_on__lt=timezone.now() - timedelta(seconds=settings.UPLOAD_SESSION_TTL))
+        count = 0
+        for session in expired:
+            session.delete()  # one by one to delete data files as well (see `files.signals`)
+            count += 1
+        logger.info('Deleted %s expired upload sessions.', count)
@@ -0,0 +1,16 @@
+from logging import getLogger
+from django.core.management.base import BaseCommand
+from printers.transfers import fail_interrupted_transfers
+
+
+logger = getLogger()
+
+
+class Command(BaseCommand):
+    help = '''Marks file transfers left queued or sending as failed.
+
+Transfers run in threads of the server processes and do not survive their
+restart. To be run at startup, before the server processes start.'''
+
+    def handle(self, *args, **options):
+        logger.info('Failed %s interrupted transfers.', fail_interrupted_transfers())
@@ -0,0 +1,132 @@
+import asyncio
+from logging import getLogger
+from time import monotonic
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from printers.models import Printer
+from printers.device_query import aquery_devices, ASYNC_QUERIES
+from printers.octoprint_async import close_session, keep_session
+from printers import status
+
+
+logger = getLogger()
+
+POLL_QUERIES = ASYNC_QUERIES + (
+    ('connection', lambda api: api.get_connection()),
+    ('job', lambda api: api.get_job()),
+)
+'''calls made to each device on every poll'''
+
+
+def is_printing(snapshot):
+    try:
+        return snapshot['printer']['state']['flags']['printing']
+    except (KeyError, TypeError):
+        return False
+
+
+def next_interval(snapshot, failures):
+    '''
+    Adaptive poll interval - printing printers are polled often, idle ones less
+    often and unreachable ones back off up to `PRINTER_POLL_INTERVAL_MAX`.
+    '''
+    if failures:
+        return min(
+            settings.PRINTER_POLL_INTERVAL_IDLE * 2 ** (failures - 1),
+            settings.PRINTER_POLL_INTERVAL_MAX,
+        )
+    if is_printing(snapshot):
+        return settings.PRINTER_POLL_INTERVAL_ACTIVE
+    return settings.PRINTER_POLL_INTERVAL_IDLE
+
+
+class Poller(object):
+    '''
+    Polls all printers with a device connection and stores their snapshots
+    (see `printers.status`).
+    '''
+
+    def __init__(self):
+        self.printers = {}
+        '''{printer_id: api_key}'''
+        self.due = {}
+        '''{printer_id: monotonic time of the next poll}'''
+        self.failures = {}
+        '''{printer_id: number of consecutive failed polls}'''
+        self.running = {}
+        '''{printer_id: poll task}'''
+
+    def _load_printers(self):
+        return dict(
+            Printer.objects
+            .filter(api_key__startswith='http')
+            .values_list('id', 'api_key')
+        )
+
+    async def refresh_printers(self):
+        self.printers = await sync_to_async(self._load_printers, thread_sensitive=True)()
+        now = monotonic()
+        for printer_id in self.printers:
+            self.due.setdefault(printer_id, now)
+        for printer_id in set(self.due) - set(self.printers):
+            self.due.pop(printer_id)
+            self.failures.pop(printer_id, None)
+        logger.debug('Polling %s printers.', len(self.printers))
+
+    async def poll(self, printer_id):
+        api_key = self.printers[printer_id]
+        snapshot = None
+        try:
+            previous = await sync_to_async(status.get_snapshot)(printer_id)
+            state = (await aquery_devices([api_key], queries=POLL_QUERIES))[api_key]
+            snapshot = await sync_to_async(status.save_snapshot)(printer_id, state, previous)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('Polling printer %s failed.', printer_id)
+        if snapshot is None or 'error' in snapshot:
+            self.failures[printer_id] = self.failures.get(printer_id, 0) + 1
+        else:
+            self.failures.pop(printer_id, None)
+        if printer_id in self.due:
+            self.due[printer_id] = monotonic() + next_interval(snapshot, self.failures.get(printer_id, 0))
+
+    async def run(self, once=False):
+        await self.refresh_printers()
+        refreshed_on = monotonic()
+        while True:
+            now = monotonic()
+            if now - refreshed_on > settings.PRINTER_POLL_REFRESH:
+                await self.refresh_printers()
+                refreshed_on = now
+            for printer_id, due in list(self.due.items()):
+                if due <= now and printer_id not in self.running:
+                    task = asyncio.ensure_future(self.poll(printer_id))
+                    task.add_done_callback(lambda _, printer_id=printer_id: self.running.pop(printer_id, None))
+                    self.running[printer_id] = task
+            if once:
+                if self.running:
+                    await asyncio.wait(list(self.running.values()))
+                return
+            upcoming = min(self.due.values(), default=now + 1)
+            await asyncio.sleep(min(max(upcoming - monotonic(), 0.1), 1))
+
+
+class Command(BaseCommand):
+    help = '''Polls printer devices in background and stores their state to cache.
+
+The cache (PRINTER_STATUS_CACHE) has to be shared with the processes serving the
+API, otherwise they will not see the snapshots.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Poll every printer once and exit.')
+
+    def handle(self, *args, **options):
+        logger.info('Starting printer poller.')
+        asyncio.run(self.poll(once=options['once']))
+
+    async def poll(self, once):
+        keep_session()
+        try:
+            await Poller().run(once=once)
+        finally:
+            await close_session()
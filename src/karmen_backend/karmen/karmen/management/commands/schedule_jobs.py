@@ -0,0 +1,33 @@
+from logging import getLogger
+from time import sleep, monotonic
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from jobs.scheduler import schedule
+
+
+logger = getLogger()
+
+
+class Command(BaseCommand):
+    help = '''Assigns queued print jobs to idle printers and follows their progress (see jobs/scheduler.py).
+
+Printers are judged by status snapshots of `poll_printers`, which has to run as well.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run a single round and exit.')
+
+    def handle(self, *args, **options):
+        logger.info('Starting print job scheduler.')
+        while True:
+            started = monotonic()
+            close_old_connections()
+            try:
+                schedule()
+            except Exception:  # pylint: disable=broad-except
+                if options['once']:
+                    raise
+                logger.exception('Scheduling print jobs failed.')
+            if options['once']:
+                return
+            sleep(max(settings.JOB_SCHEDULER_INTERVAL - (monotonic() - started), 0))
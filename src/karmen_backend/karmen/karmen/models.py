@@ -46,6 +46,8 @@ class IdField(models.CharField):
 
     def from_db_value(self, value, expression, connection):
         # value = super().from_db_value(value, expression, connection)
+        if value is None:
+            return value  # nullable foreign key
         return split_id(value)
 
     def to_python(self, value):
@@ -0,0 +1,31 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    '''
+    Cursor (keyset) pagination used by all list endpoints
+
+    Pages are fetched by `WHERE <ordering field> > <last value>` instead of
+    `OFFSET` so the cost of a page does not depend on its position and pages
+    are stable when objects are added or removed meanwhile. Clients follow
+    `next` / `previous` links in the response, page size can be changed by
+    `?limit=<n>` up to `API_MAX_PAGE_SIZE`.
+
+    Views set their ordering by `ordering` attribute (defaults to primary key).
+    The first field should be unchanging and (nearly) unique - creation
+    timestamp or id. Add id as the last field to make the ordering of objects
+    sharing the same timestamp stable (e.g. `ordering = ('-created_on', 'id')`).
+    '''
+
+    ordering = ('pk', )
+    page_size_query_param = 'limit'
+
+    def __init__(self):
+        self.max_page_size = settings.API_MAX_PAGE_SIZE
+
+    def get_ordering(self, request, queryset, view):
+        ordering = getattr(view, 'ordering', None)
+        if ordering:
+            return (ordering, ) if isinstance(ordering, str) else tuple(ordering)
+        return super().get_ordering(request, queryset, view)
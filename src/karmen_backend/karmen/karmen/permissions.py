@@ -1,4 +1,5 @@
 from rest_framework import permissions
+from karmen.access import get_access
 
 
 class IsManagerOfObject(permissions.BasePermission):
@@ -13,10 +14,10 @@ class IsManagerOfObject(permissions.BasePermission):
         return request.user.is_authenticated  # and request.user.has_perm('view_printers')
 
     def has_object_permission(self, request, view, obj):
-        if request.method == 'DELETE' and hasattr(obj, 'can_delete'):
-            return obj.can_delete(request.user)
+        if request.method == 'DELETE':
+            return get_access(request).can_delete(obj)
         else:
-            return obj.can_modify(request.user)
+            return get_access(request).can_modify(obj)
 
 
 class IsUserOfObject(permissions.BasePermission):
@@ -31,7 +32,7 @@ class IsUserOfObject(permissions.BasePermission):
         return request.user.is_authenticated  # and request.user.has_perm('view_printers')
 
     def has_object_permission(self, request, view, obj):
-        return obj.can_view(request.user)
+        return get_access(request).can_view(obj)
 
 
 class IsUserOfParentObject(permissions.BasePermission):
@@ -43,7 +44,7 @@ class IsUserOfParentObject(permissions.BasePermission):
     '''
 
     def has_permission(self, request, view=None):
-        return request.parent_instance.can_view(request.user)  # and request.user.has_perm('view_printers')
+        return get_access(request).can_view(request.parent_instance)  # and request.user.has_perm('view_printers')
 
 
 class IsManagerOfParentObject(permissions.BasePermission):
@@ -55,4 +56,4 @@ class IsManagerOfParentObject(permissions.BasePermission):
     '''
 
     def has_permission(self, request, view=None):
-        return request.parent_instance.can_modify(request.user)  # and request.user.has_perm('view_printers')
+        return get_access(request).can_modify(request.parent_instance)  # and request.user.has_perm('view_printers')
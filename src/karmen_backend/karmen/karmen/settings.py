@@ -43,6 +43,7 @@ INSTALLED_APPS = [
     'groups',
     'printers',
     'files',
+    'jobs',
     'rest_framework',
 ]
 if DEBUG:
@@ -113,6 +114,53 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+#
+# `shared` cache has to be shared by all processes (uwsgi workers, poller, ...)
+# and holds status snapshots, versions of tables, rendered responses, values of
+# `lock_cached` and its locks. It needs atomic `add` (locks) and must not cull
+# entries, so it is redis (django-redis) whenever `REDIS_HOST` is set. The file
+# based fallback is meant for development on a single host only - its `add` is
+# not atomic across processes and it culls entries when full (`MAX_ENTRIES` is
+# set high to avoid that).
+
+REDIS_HOST = os.environ.get('REDIS_HOST') or None
+'''host of redis backing the `shared` cache'''
+REDIS_PORT = int(os.environ.get('REDIS_PORT') or 6379)
+REDIS_CACHE_DB = int(os.environ.get('REDIS_CACHE_DB') or 1)
+'''redis database of the `shared` cache'''
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': 'redis://%s:%s/%s' % (REDIS_HOST, REDIS_PORT, REDIS_CACHE_DB),
+    } if REDIS_HOST else {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000000,
+        },
+    },
+}
+
+TWO_TIER_CACHE_MAX_ENTRIES = 4096
+'''maximum number of values kept in process memory by two-tier cache (see karmen/cache.py)'''
+TWO_TIER_CACHE_LOCAL_TTL = 2
+'''seconds a value is served from process memory before it is read from the shared cache again'''
+TWO_TIER_CACHE_CHECK_INTERVAL = 0.5
+'''seconds between checks for invalidations made by other processes'''
+VERSIONS_CACHE = 'shared'
+'''cache alias for versions of tables (see karmen/versions.py), must be shared by all processes'''
+RESPONSE_CACHE = 'shared'
+'''cache alias for rendered lists of `users/me/` endpoints (see `CachedListViewSetMixin` in karmen/viewsets.py)'''
+RESPONSE_CACHE_TTL = 10 * 60
+'''seconds a rendered list is kept (entries of changed lists are never read again and just expire)'''
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/3.0/topics/i18n/
 
@@ -143,8 +191,13 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.SessionAuthentication', # FIXME: verify this before production
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ],
+    'DEFAULT_PAGINATION_CLASS': 'karmen.pagination.KeysetPagination',
+    'PAGE_SIZE': 50,
 }
 
+API_MAX_PAGE_SIZE = 500
+'''the largest page size clients can ask for by `?limit=` (see karmen/pagination.py)'''
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(hours=1),
     'AUTH_TOKEN_CLASSES': ['tokens.token.KarmenAccessToken'],
@@ -159,6 +212,35 @@ AUTH_USER_MODEL = 'users.User'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
+MEDIA_ACCEL_REDIRECT_URL = os.environ.get('MEDIA_ACCEL_REDIRECT_URL') or None
+'''internal nginx location serving MEDIA_ROOT, file downloads are handed over to nginx when set (see files/downloads.py)'''
+
+FILE_UPLOAD_HANDLERS = [
+    'files.uploadhandlers.HashingMemoryFileUploadHandler',
+    'files.uploadhandlers.HashingTemporaryFileUploadHandler',
+]
+'''django's default upload handlers which also compute SHA-256 of uploaded files (see files/storage.py)'''
+BLOB_COMPRESSION = 'gzip'
+'''compression of newly stored files ('gzip' or '' to store them as they are, see files/compression.py)'''
+BLOB_COMPRESSION_LEVEL = 6
+'''zlib compression level (1 - fastest, 9 - smallest)'''
+BLOB_COMPRESSION_FRAME_SIZE = 1024 * 1024
+'''bytes of content between flush points of compressed files (smaller seeks faster, compresses worse)'''
+
+# Resumable uploads (see files/uploads.py)
+UPLOAD_SESSIONS_DIR = os.path.join(BASE_DIR, 'uploads')
+'''directory for files being uploaded in chunks (local, has to be shared by all processes)'''
+UPLOAD_MAX_SIZE = 1024 * 1024 * 1024
+'''the largest file which can be uploaded in chunks (nginx limits single-shot uploads)'''
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+'''default chunk size of upload sessions'''
+UPLOAD_MAX_CHUNK_SIZE = 64 * 1024 * 1024
+'''the largest chunk size clients can ask for'''
+UPLOAD_SESSION_TTL = 24 * 60 * 60
+'''seconds after which unfinished upload sessions are deleted by `manage.py expire_uploads`'''
+
+FILE_ANALYSIS_MAX_CONCURRENCY = 1
+'''maximum number of uploaded files analyzed at the same time (per process, see files/analysis.py)'''
 
 ID_FIELD_LENGTH = 8
 
@@ -175,3 +257,85 @@ LOGGING = {
         'level': 'INFO',
     },
 }
+
+# Communication with devices (see printers/device_query.py)
+OCTOPRINT_MAX_CONCURRENCY = 32
+'''maximum number of device calls running at the same time (per process)'''
+OCTOPRINT_QUERY_DEADLINE = 5
+'''seconds to wait for devices before their state is reported as an error'''
+OCTOPRINT_POOL_SIZE = 4
+'''keep-alive connections kept open to a single device'''
+OCTOPRINT_CLIENTS_LIMIT = 1024
+'''maximum number of device clients (and their connection pools) kept per process'''
+OCTOPRINT_CONNECT_TIMEOUT = 3.05
+'''seconds to wait for a connection to a device'''
+OCTOPRINT_READ_TIMEOUT = 10
+'''seconds to wait for the device response'''
+OCTOPRINT_RETRIES = 2
+'''retries of failed idempotent device calls'''
+OCTOPRINT_RETRY_BACKOFF = 0.2
+'''backoff factor between retries (0.2 => sleep 0, 0.4, 0.8, ... seconds)'''
+OCTOPRINT_UPLOAD_CHUNK_SIZE = 64 * 1024
+'''bytes read from storage and sent to the device at once when uploading files'''
+
+# Sending files to printers (see printers/transfers.py)
+TRANSFERS_MAX_CONCURRENCY = 4
+'''maximum number of files being sent to printers at the same time (per process)'''
+TRANSFER_PROGRESS_INTERVAL = 1
+'''seconds between updates of transfer progress (and checks for its cancellation)'''
+
+# Printer status events (see printers/events.py)
+PRINTER_EVENTS_INTERVAL = 1
+'''seconds between checks of snapshots of printers watched by clients'''
+PRINTER_EVENTS_REFRESH = 30
+'''seconds between checks of changed access of a connected client'''
+PRINTER_EVENTS_QUEUE_SIZE = 16
+'''patches waiting for a client, a client which does not keep up gets a new snapshot'''
+
+# Print jobs (see jobs/scheduler.py and `manage.py schedule_jobs`)
+JOB_SCHEDULER_INTERVAL = 5
+'''seconds between rounds of the scheduler'''
+JOB_DISPATCH_BATCH = 100
+'''maximum number of queued jobs assigned to printers in one round'''
+JOB_SNAPSHOT_MAX_AGE = 60
+'''printers whose status snapshot is older (seconds) do not get new jobs'''
+JOB_PRINT_START_DELAY = 30
+'''seconds after the upload before an idle printer means the print of its job is over'''
+
+# Bulk operations (see printers/bulk.py)
+BULK_MAX_ITEMS = 1000
+'''maximum number of items of a single bulk request'''
+
+# Webcam snapshots (see printers/webcam.py)
+WEBCAM_SNAPSHOT_INTERVAL = 1
+'''seconds between fetches of snapshots of a single webcam (viewers get the cached one meanwhile)'''
+WEBCAM_SNAPSHOT_CACHE_SIZE = 256
+'''maximum number of webcams whose latest snapshot is kept in memory (per process)'''
+WEBCAM_SNAPSHOT_MAX_SIZE = 4 * 1024 * 1024
+'''larger snapshots are refused'''
+WEBCAM_THUMBNAIL_SIZES = {'small': (160, 120), 'medium': (320, 240), 'large': (640, 480)}
+'''{name: (width, height)} - sizes of webcam snapshot thumbnails (the thumbnail fits in, keeping aspect ratio)'''
+WEBCAM_THUMBNAIL_QUALITY = 70
+'''JPEG / WebP quality of thumbnails (1-100)'''
+WEBCAM_THUMBNAIL_TTL = 10
+'''seconds a thumbnail (and the snapshot it is made of) is served before a new snapshot is fetched'''
+
+# Printer status snapshots (see printers/status.py and `manage.py poll_printers`)
+PRINTER_STATUS_CACHE = 'shared'
+'''cache alias for snapshots, must be shared by all processes when the poller is running'''
+PRINTER_STATUS_TTL = 5 * 60
+'''seconds after which a snapshot of a printer that is not polled anymore expires'''
+PRINTER_STATUS_LIVE_FALLBACK = True
+'''query devices directly when their snapshot is missing (disable when poller is running)'''
+PRINTER_STATUS_HISTORY_LENGTH = 10
+'''number of past versions of status document kept per printer and per user (bases of `?since=` patches)'''
+PRINTER_STATUS_HISTORY_TTL = 60 * 60
+'''seconds the history of status documents of a printer (or user) is kept after its last change'''
+PRINTER_POLL_INTERVAL_ACTIVE = 2
+'''seconds between polls of a printing printer'''
+PRINTER_POLL_INTERVAL_IDLE = 10
+'''seconds between polls of an idle printer'''
+PRINTER_POLL_INTERVAL_MAX = 60
+'''maximum seconds between polls of an unreachable printer (backs off from idle interval)'''
+PRINTER_POLL_REFRESH = 30
+'''seconds between reloads of the list of printers by the poller'''
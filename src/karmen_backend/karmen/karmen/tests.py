@@ -0,0 +1,397 @@
+from threading import Thread, Event
+from time import time
+from unittest import mock
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.http import http_date, parse_http_date
+from rest_framework.test import APIClient
+from django_lock import lock
+from karmen.cache import TwoTierCache, two_tier_cache as cache
+from karmen import ROLE_ADMIN, ROLE_USER
+from karmen.access import AccessResolver
+from karmen import versions
+from karmen.utils import lock_cached
+from users.models import User
+from printers.models import Printer
+from groups.models import Group
+
+
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'shared',
+    },
+}
+
+
+class Device(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = []
+
+    @property
+    def cache_id(self):
+        return self.name
+
+    @lock_cached(ttl=60)
+    def list_files(self, location='local'):
+        self.calls.append(location)
+        return ['%s:%s' % (self.name, location)]
+
+    @lock_cached(ttl=60)
+    def get_nothing(self):
+        self.calls.append(None)
+        return None
+
+
+class ConstantQueriesMixin(object):
+    '''
+    `assertConstantQueries` of test cases which add listed objects by
+    `add_rows(count)`, the number of queries must not grow with their number
+    '''
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assertConstantQueries(self, url):
+        self.add_rows(2)
+        expected = self.count_queries(url)
+        self.add_rows(4)
+        self.assertEqual(self.count_queries(url), expected, url)
+
+
+@override_settings(DEBUG=True, CACHES=TEST_CACHES)  # django_lock refuses locmem cache without DEBUG
+class LockCachedTest(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cached_per_instance(self):
+        a, b = Device('a'), Device('b')
+        self.assertEqual(a.list_files(), ['a:local'])
+        self.assertEqual(b.list_files(), ['b:local'])
+        self.assertEqual(a.list_files(), ['a:local'])
+        self.assertEqual(a.calls, ['local'])
+        self.assertEqual(b.calls, ['local'])
+
+    def test_arguments_are_normalized(self):
+        device = Device('a')
+        device.list_files()
+        device.list_files('local')
+        device.list_files(location='local')
+        device.list_files('sdcard')
+        self.assertEqual(device.calls, ['local', 'sdcard'])
+
+    def test_none_is_cached(self):
+        device = Device('a')
+        self.assertIsNone(device.get_nothing())
+        self.assertIsNone(device.get_nothing())
+        self.assertEqual(device.calls, [None])
+
+    def test_invalidate_cache(self):
+        a, b = Device('a'), Device('b')
+        a.list_files()
+        a.list_files('sdcard')
+        b.list_files()
+        a.list_files.invalidate_cache(location='local')
+        a.list_files()
+        a.list_files('sdcard')
+        b.list_files()
+        self.assertEqual(a.calls, ['local', 'sdcard', 'local'])
+        self.assertEqual(b.calls, ['local'])
+
+    def test_stale_value_is_served_during_revalidation(self):
+        device = Device('a')
+        device.list_files()
+        key = Device.list_files.cache_key(device, (), {})
+        fresh_until, value = cache.get(key)
+        cache.set(key, (0, value))  # make the value stale
+        with lock(key, client=caches['shared'], timeout=5):  # somebody else revalidates
+            self.assertEqual(device.list_files(), ['a:local'])
+        self.assertEqual(device.calls, ['local'])
+        device.list_files()  # nobody revalidates, we do
+        self.assertEqual(device.calls, ['local', 'local'])
+
+    def test_single_flight_on_miss(self):
+        started, proceed = Event(), Event()
+
+        class SlowDevice(Device):
+            @lock_cached(ttl=60)
+            def list_files(self, location='local'):
+                started.set()
+                proceed.wait(5)
+                self.calls.append(location)
+                return [location]
+
+        device = SlowDevice('slow')
+        results = []
+        first = Thread(target=lambda: results.append(device.list_files()))
+        first.start()
+        started.wait(5)
+        second = Thread(target=lambda: results.append(device.list_files()))
+        second.start()
+        proceed.set()
+        first.join()
+        second.join()
+        self.assertEqual(results, [['local'], ['local']])
+        self.assertEqual(device.calls, ['local'])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TwoTierCacheTest(SimpleTestCase):
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.cache = TwoTierCache('shared', max_entries=2, local_ttl=60, check_interval=0)
+        self.other_process = TwoTierCache('shared', max_entries=2, local_ttl=60, check_interval=0)
+
+    def test_local_hit(self):
+        self.cache.set('a', 1)
+        caches['shared'].set('a', 2)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertEqual(self.cache.stats()['hits'], {'local': 1, 'shared': 0})
+
+    def test_shared_hit_and_miss(self):
+        self.other_process.set('a', 1)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.stats()['hits'], {'local': 0, 'shared': 1})
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_lru_eviction(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+        self.cache.set('c', 3)
+        self.assertEqual(list(self.cache._local.keys()), ['a', 'c'])
+
+    def test_invalidate_other_processes(self):
+        self.cache.set('a', 1)
+        self.other_process.get('a')
+        self.cache.invalidate('a')
+        self.assertIsNone(self.other_process.get('a'))
+
+    def test_invalidate_bucket_only(self):
+        self.assertNotEqual(self.cache._bucket('a'), self.cache._bucket('b'))
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.other_process.get('a')
+        self.other_process.get('b')
+        caches['shared'].set('b', 3)
+        self.cache.invalidate('a')
+        self.assertIsNone(self.other_process.get('a'))
+        # entries of other buckets are kept in the local tier
+        self.assertEqual(self.other_process.get('b'), 2)
+
+
+@override_settings(CACHES=TEST_CACHES, VERSIONS_CACHE='default')
+class VersionsTest(TransactionTestCase):
+
+    def setUp(self):
+        patcher = mock.patch('karmen.versions._store', wraps=versions._store)
+        self.store = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_stored_again_on_commit(self):
+        with transaction.atomic():
+            versions.touch('a')
+            versions.touch('a', 'b')
+            self.assertEqual(self.store.call_count, 2)
+        self.assertEqual(self.store.call_count, 3)
+        self.assertEqual(set(self.store.call_args[0][0]), {'a', 'b'})
+
+    def test_rolled_back_transaction(self):
+        try:
+            with transaction.atomic():
+                versions.touch('a')
+                raise ValueError()
+        except ValueError:
+            pass
+        with transaction.atomic():
+            versions.touch('b')
+        self.assertIn('b', self.store.call_args[0][0])
+        versions.touch('c')
+        self.assertEqual(self.store.call_count, 4)
+
+
+class AccessResolverTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user@example.com')
+        self.own = Printer.objects.create(name='own')
+        self.own.set_user(self.user, ROLE_USER)
+        self.shared = Printer.objects.create(name='shared')
+        self.foreign = Printer.objects.create(name='foreign')
+        self.group = Group.objects.create(name='group')
+        self.group.set_user(self.user, ROLE_ADMIN)
+        self.group.printers.add(self.own, self.shared)
+        self.foreign_group = Group.objects.create(name='foreign group')
+        self.foreign_group.printers.add(self.foreign)
+
+    def test_roles_are_loaded_by_single_query(self):
+        access = AccessResolver(self.user)
+        with self.assertNumQueries(1):
+            for obj in (self.own, self.shared, self.foreign, self.group, self.foreign_group):
+                access.can_view(obj)
+                access.can_modify(obj)
+
+    def test_highest_role_wins(self):
+        access = AccessResolver(self.user)
+        # direct user role, admin through group
+        self.assertTrue(access.can_modify(self.own))
+        self.assertTrue(access.can_modify(self.shared))
+        self.assertFalse(access.can_view(self.foreign))
+        self.assertTrue(access.can_modify(self.group))
+        self.assertFalse(access.can_view(self.foreign_group))
+
+    def test_same_results_as_model_methods(self):
+        access = AccessResolver(self.user)
+        for obj in (self.own, self.shared, self.foreign, self.group, self.foreign_group):
+            self.assertEqual(access.can_view(obj), obj.can_view(self.user))
+            self.assertEqual(access.can_modify(obj), obj.can_modify(self.user))
+
+
+class KeysetPaginationTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for i in range(7):
+            Printer.objects.create(name='printer %s' % i).set_user(self.user, ROLE_USER)
+        # objects with the same timestamp are still ordered
+        Printer.objects.filter(name__in=('printer 2', 'printer 3', 'printer 4')) \
+            .update(created_on=Printer.objects.get(name='printer 2').created_on)
+
+    def fetch_all(self, url):
+        names = []
+        while url:
+            page = self.client.get(url).json()
+            names.extend(printer['name'] for printer in page['results'])
+            url = page['next']
+        return names
+
+    def test_pages_cover_all_objects_once(self):
+        names = self.fetch_all('/api/2/users/me/printers/?limit=2')
+        self.assertEqual(sorted(names), ['printer %s' % i for i in range(7)])
+        self.assertEqual(names, self.fetch_all('/api/2/users/me/printers/?limit=100'))
+
+    def test_previous_page(self):
+        first = self.client.get('/api/2/users/me/printers/?limit=3').json()
+        second = self.client.get(first['next']).json()
+        self.assertEqual(self.client.get(second['previous']).json()['results'], first['results'])
+
+    @override_settings(API_MAX_PAGE_SIZE=2)
+    def test_page_size_cap(self):
+        page = self.client.get('/api/2/users/me/printers/?limit=100').json()
+        self.assertEqual(len(page['results']), 2)
+
+
+@override_settings(VERSIONS_CACHE='default')
+class ConditionalGetTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user@example.com')
+        self.printer = Printer.objects.create(name='printer')
+        self.printer.set_user(self.user, ROLE_ADMIN)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assertNotModified(self, url, response, modified=False):
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200 if modified else 304)
+        return response
+
+    def test_retrieve(self):
+        url = '/api/2/printers/%s/?fields=users,groups' % self.printer.pk
+        response = self.client.get(url)
+        self.assertEqual(self.assertNotModified(url, response).content, b'')
+        # relationships do not bump `last_updated_on` of the printer
+        self.printer.groups.add(Group.objects.create(name='group'))
+        response = self.assertNotModified(url, response, modified=True)
+        self.client.patch(url, {'name': 'renamed'})
+        self.assertEqual(self.assertNotModified(url, response, modified=True).data['name'], 'renamed')
+        # device states are not versioned
+        self.assertNotIn('ETag', self.client.get(url + ',octoprint'))
+
+    def test_last_modified(self):
+        url = '/api/2/printers/%s/' % self.printer.pk
+        # the printer was changed within the current second
+        self.assertNotIn('Last-Modified', self.client.get(url))
+        with mock.patch('karmen.viewsets.time', return_value=time() + 1):
+            response = self.client.get(url)
+        last_modified = parse_http_date(response['Last-Modified'])
+        self.assertGreaterEqual(last_modified, self.printer.last_updated_on.timestamp())
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=http_date(last_modified - 1)).status_code, 200)
+
+    def test_list(self):
+        url = '/api/2/users/me/printers/'
+        response = self.client.get(url)
+        self.assertNotModified(url, response)
+        self.assertEqual(self.client.get(url + '?limit=1', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+        Printer.objects.create(name='other').set_user(self.user, ROLE_USER)
+        response = self.assertNotModified(url, response, modified=True)
+        Printer.objects.filter(name='other').delete()
+        self.assertEqual(len(self.assertNotModified(url, response, modified=True).data['results']), 1)
+
+
+@override_settings(VERSIONS_CACHE='default', RESPONSE_CACHE='default')
+class ResponseCacheTest(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.user = User.objects.create_user(username='user@example.com')
+        self.other = User.objects.create_user(username='other@example.com')
+        self.printer = Printer.objects.create(name='printer')
+        self.printer.set_user(self.user, ROLE_ADMIN)
+        self.group = Group.objects.create(name='group')
+        self.group.printers.add(Printer.objects.create(name='in group'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def names(self, url='/api/2/users/me/printers/', queries=None):
+        if queries is None:
+            response = self.client.get(url)
+        else:
+            with self.assertNumQueries(queries):
+                response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return sorted(item['name'] for item in response.json()['results'])
+
+    def test_cached_list(self):
+        self.assertEqual(self.names(), ['printer'])
+        self.assertEqual(self.names(queries=0), ['printer'])
+        # access of other users does not matter
+        self.group.set_user(self.other, ROLE_USER)
+        self.assertEqual(self.names(queries=0), ['printer'])
+        self.group.set_user(self.user, ROLE_USER)
+        self.assertEqual(self.names(), ['in group', 'printer'])
+        self.printer.name = 'renamed'
+        self.printer.save()
+        self.assertEqual(self.names(), ['in group', 'renamed'])
+        self.assertEqual(self.names('/api/2/users/me/groups/'), ['group'])
+        self.group.name = 'farm'
+        self.group.save()
+        self.assertEqual(self.names('/api/2/users/me/groups/'), ['farm'])
+
+    def test_fields(self):
+        url = '/api/2/users/me/printers/?fields=users'
+        self.names(url)
+        self.names(url, queries=0)
+        self.printer.set_user(self.other, ROLE_USER)
+        response = self.client.get(url)
+        users = response.json()['results'][0]['users']
+        self.assertEqual(len(users), 2)
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
@@ -15,14 +15,13 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import include, path
-from django.conf import settings
-from django.conf.urls.static import static
 from rest_framework import routers
 from rest_framework.response import Response
 from users.views import InvitationsViewSet, UsersViewSet
-from printers import views as printer_views
+from printers import views as printer_views, async_views as printer_async_views
 from groups import views as group_views
 from files import views as file_views
+from jobs import views as job_views
 from debugging_tools.views import DebuggingViewSet
 from tokens.views import TokensViewSet
 
@@ -38,18 +37,29 @@ router.register(r'tokens', TokensViewSet, basename='token')
 router.register(r'printers', printer_views.PrintersViewSet, basename='printer')
 router.register(r'printers/(?P<printer_id>[^/]{8,12})/users', printer_views.UsersOnPrinterViewSet, basename='printer-user')
 router.register(r'printers/(?P<printer_id>[^/]{8,12})/groups', printer_views.PrinterGroupsViewSet, basename='printer-group')
+router.register(r'transfers', printer_views.TransfersViewSet, basename='transfer')
 router.register(r'groups', group_views.GroupsViewSet, basename='group')
 router.register(r'groups/(?P<group_id>[^/]{8,12})/users', group_views.UsersInGroupViewSet, basename='group-user')
 router.register(r'groups/(?P<group_id>[^/]{8,12})/printers', printer_views.PrintersInGroupViewSet, basename='group-printer')
 router.register(r'groups/(?P<group_id>[^/]{8,12})/files', file_views.FilesInGroupViewSet, basename='group-files')
+router.register(r'files/uploads', file_views.UploadSessionsViewSet, basename='upload')
 router.register(r'files', file_views.FilesViewSet, basename='file')
+router.register(r'jobs', job_views.PrintJobsViewSet, basename='job')
 router.register(r'debug', DebuggingViewSet, basename='debug')
 
+# async views (do not block workers while waiting for devices when served by ASGI)
+async_urls = [
+    path('printers/<str:printer_id>/octoprint/', printer_async_views.printer_octoprint, name='printer-octoprint'),
+    path('users/me/printers/octoprint/', printer_async_views.my_printers_octoprint, name='me-printer-octoprint'),
+]
+
 # Wire up our API using automatic URL routing.
 # Additionally, we include login URLs for the browsable API.
 urlpatterns = [
+    path('api/2/', include(async_urls)),
     path('api/2/', include(router.urls)),
+    path('', include(async_urls)),
     path('', include(router.urls)),
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
     path('admin/', admin.site.urls),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+]
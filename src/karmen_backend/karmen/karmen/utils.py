@@ -1,10 +1,13 @@
-import pickle
+from functools import partial, update_wrapper
 from hashlib import md5
+from inspect import signature
 from random import randint
-from django.core.cache import cache
+from time import time
+from django.core.cache import caches
 from django.conf import settings
 from django_lock import lock
 from base36 import dumps as b36encode
+from karmen.cache import two_tier_cache as cache
 
 
 MAX_RAND = 36**settings.ID_FIELD_LENGTH
@@ -19,16 +22,98 @@ def gen_short_uid():
     return b36encode(randint(0, MAX_RAND))[:settings.ID_FIELD_LENGTH]
 
 
-def build_cache_key(prefix, method, args, kwargs):
-    kwargs_key = ','.join(sorted(kwargs.items()))
-    args_key = ','.join(args)
-    key = '%s_%s: %s(%s, %s)' % (prefix, method.__module__, method.__qualname__, args_key, kwargs_key)
+def build_cache_key(prefix, method, instance_id, arguments):
+    '''
+    Returns cache key for call of `method` on instance identified by
+    `instance_id` with (normalized) `arguments` dict.
+    '''
+    arguments_key = ','.join('%s=%r' % item for item in sorted(arguments.items()))
+    key = '%s_%s: %s[%s](%s)' % (prefix, method.__module__, method.__qualname__, instance_id, arguments_key)
     return md5(key.encode('utf-8')).hexdigest()
 
 
-def lock_cached(method=None, ttl=1, lock_timeout=None, key_prefix='restricted_cache-decorator'):
+class LockCachedMethod(object):
+    '''
+    Method cached in two-tier cache, see `lock_cached`.
     '''
-    Cache method with a global lock using django's cache framework
+
+    def __init__(self, method, ttl, stale_ttl, lock_timeout, key_prefix):
+        update_wrapper(self, method)
+        self.method = method
+        self.signature = signature(method)
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.lock_timeout = lock_timeout
+        self.key_prefix = key_prefix
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        bound = partial(self.call, instance)
+        bound.invalidate_cache = partial(self.invalidate, instance)
+        return bound
+
+    def cache_key(self, instance, args, kwargs):
+        '''
+        Cache key of the call. Arguments are bound to the method signature (with
+        defaults applied) so `list_files()` and `list_files(location='local')`
+        share the key. Instance is identified by its `cache_id` attribute or by
+        `str(instance)`.
+        '''
+        arguments = self.signature.bind(instance, *args, **kwargs)
+        arguments.apply_defaults()
+        arguments = dict(arguments.arguments)
+        arguments.pop(next(iter(self.signature.parameters)))  # self
+        instance_id = getattr(instance, 'cache_id', None) or str(instance)
+        return build_cache_key(self.key_prefix, self.method, instance_id, arguments)
+
+    def _store(self, key, instance, args, kwargs):
+        value = self.method(instance, *args, **kwargs)
+        cache.set(key, (time() + self.ttl, value), timeout=self.ttl + self.stale_ttl)
+        return value
+
+    def call(self, instance, *args, **kwargs):
+        key = self.cache_key(instance, args, kwargs)
+        entry = cache.get(key)
+        if entry is not None:
+            fresh_until, value = entry
+            if fresh_until > time():
+                # fast path - no lock
+                return value
+            # stale - only one caller revalidates, the others get the stale value
+            revalidation = lock(key, client=caches['shared'], timeout=self.lock_timeout, blocking=False)
+            if not revalidation.acquire():
+                return value
+            try:
+                # other process may have revalidated it already
+                entry = cache.get_shared(key)
+                if entry is not None and entry[0] > time():
+                    return entry[1]
+                return self._store(key, instance, args, kwargs)
+            finally:
+                revalidation.release()
+
+        # miss - single flight, the others wait for the value
+        computation = lock(key, client=caches['shared'], timeout=self.lock_timeout, blocking=self.lock_timeout)
+        if not computation.acquire():
+            # the computing caller takes too long, do not wait anymore
+            return self.method(instance, *args, **kwargs)
+        try:
+            entry = cache.get_shared(key)
+            if entry is not None and entry[0] > time():
+                return entry[1]
+            return self._store(key, instance, args, kwargs)
+        finally:
+            computation.release()
+
+    def invalidate(self, instance, *args, **kwargs):
+        '''deletes cached value of the call with given arguments (in all processes)'''
+        cache.invalidate(self.cache_key(instance, args, kwargs))
+
+
+def lock_cached(method=None, ttl=1, stale_ttl=None, lock_timeout=None, key_prefix='restricted_cache-decorator'):
+    '''
+    Cache method using two-tier cache (see `karmen.cache`)
 
     Usage:
 
@@ -43,28 +128,24 @@ def lock_cached(method=None, ttl=1, lock_timeout=None, key_prefix='restricted_ca
             ...
             self.list_files.invalidate_cache(disk)
 
+    - cached values are read without any lock,
+    - on cache miss, the method is computed by a single caller holding a
+      global lock (see `django_lock`), other callers wait for the result at
+      most `lock_timeout` seconds (defaults to `ttl`),
+    - after `ttl` seconds the value becomes stale; stale value is served for
+      another `stale_ttl` seconds (defaults to `ttl`) while a single caller
+      revalidates it,
+    - values are cached per instance (see `LockCachedMethod.cache_key`),
+    - `invalidate_cache` deletes the value cached for given arguments in all
+      processes.
 
     Note: Highly inspired by django's @cached_property.
     '''
     lock_timeout = ttl if lock_timeout is None else lock_timeout
-
-    def invalidate(*args, **kwargs):
-        key = build_cache_key(key_prefix, method, args, kwargs)
-        cache.delete(*args, **kwargs)
+    stale_ttl = ttl if stale_ttl is None else stale_ttl
 
     def decorator(method):
-        def wrap(self, *args, **kwargs):
-            key = build_cache_key(key_prefix, method, args, kwargs)
-            with lock(key, timeout=lock_timeout):
-                value = cache.get(key)
-                if value is not None:
-                    value = pickle.loads(value)
-                else:
-                    value = method(self, *args, **kwargs)
-                    cache.set(key, pickle.dumps(value), timeout=ttl)
-                return value
-        wrap.invalidate_cache = invalidate
-        return wrap
+        return LockCachedMethod(method, ttl, stale_ttl, lock_timeout, key_prefix)
 
     if method:
         # This was an actual decorator call, ex: @cached_property
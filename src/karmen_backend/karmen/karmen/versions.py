@@ -0,0 +1,119 @@
+'''
+Versions of tables
+
+The representation of an object often depends on rows of other tables (e.g.
+users and groups of a printer) whose changes do not bump `last_updated_on` of
+the object. Every change of a tracked model (`TRACKED_MODELS`) therefore
+stores a new version of the model's table - the time of the change - to
+`VERSIONS_CACHE`, the cache shared by all processes. `get_versions` reads the
+versions of several tables by a single cache round trip (see
+`karmen.viewsets.ConditionalGetViewSetMixin`).
+
+Tables are referred to by model labels (`printers.printer`). Saves, deletes
+and bulk `add` of many-to-many managers of tracked models are recorded by
+signals, writes which send no signals (`QuerySet.update`, `bulk_create`,
+`bulk_update`) have to `touch` the tables themselves.
+
+Access of a user (the printers, groups and files the user sees) is versioned
+the same way under label `access_label(user id)`, `touch_access` is called
+whenever `PrinterAccess` of the user is refreshed (see `printers.signals`).
+
+A version is stored right away and once more when the transaction commits -
+the first keeps clients of this process from seeing the old version, the
+second invalidates whatever other processes read before the commit.
+'''
+from threading import local
+from time import time
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from karmen.models import join_id
+
+
+VERSION_KEY_PREFIX = 'table-version-'
+
+TRACKED_MODELS = (
+    'users.User',
+    'groups.Group',
+    'groups.UserInGroup',
+    'printers.Printer',
+    'printers.UserOnPrinter',
+    'printers.PrinterInGroup',
+    'files.File',
+    'files.Blob',
+)
+'''models whose changes are recorded (connected by `connect_signals`)'''
+
+_local = local()
+'''`pending` - labels touched by the transaction of the thread, stored again on commit'''
+
+
+def get_cache():
+    return caches[settings.VERSIONS_CACHE]
+
+
+def version_key(label):
+    return '%s%s' % (VERSION_KEY_PREFIX, label)
+
+
+def access_label(user_id):
+    return 'access-%s' % join_id(str(user_id))
+
+
+def _store(labels):
+    now = time()
+    get_cache().set_many({version_key(label): now for label in labels}, timeout=None)
+
+
+def _store_pending():
+    pending = getattr(_local, 'pending', None)
+    if pending:
+        _local.pending = set()
+        _store(pending)
+
+
+def touch(*labels):
+    '''stores new versions of tables `labels` (model labels, e.g. `printers.printer`)'''
+    _store(labels)
+    if not transaction.get_connection().in_atomic_block:
+        return
+    # (many rows of the same table are written by a transaction, its version is stored on commit just once -
+    # by the first of the callbacks, labels left behind by a rolled back transaction are just stored once more)
+    if not hasattr(_local, 'pending'):
+        _local.pending = set()
+    _local.pending.update(labels)
+    transaction.on_commit(_store_pending)
+
+
+def touch_access(user_ids):
+    '''stores new versions of access of `user_ids`'''
+    touch(*(access_label(user_id) for user_id in user_ids))
+
+
+def get_versions(labels):
+    '''returns {label: version} of tables `labels` (unix time of their last change)'''
+    cache = get_cache()
+    keys = {version_key(label): label for label in labels}
+    versions = {keys[key]: version for key, version in cache.get_many(keys).items()}
+    for label in set(labels) - versions.keys():
+        # not changed since the cache was cleared
+        cache.add(version_key(label), time(), timeout=None)
+        versions[label] = cache.get(version_key(label))
+    return versions
+
+
+def table_changed(sender, **kwargs):
+    touch(sender._meta.label_lower)  # pylint: disable=protected-access
+
+
+def relationships_changed(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        touch(sender._meta.label_lower)  # pylint: disable=protected-access
+
+
+def connect_signals():
+    for model in TRACKED_MODELS:
+        post_save.connect(table_changed, sender=model, dispatch_uid='versions-save-%s' % model)
+        post_delete.connect(table_changed, sender=model, dispatch_uid='versions-delete-%s' % model)
+        m2m_changed.connect(relationships_changed, sender=model, dispatch_uid='versions-m2m-%s' % model)
@@ -1,8 +1,22 @@
+import hashlib
+import math
+from time import time
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseNotModified
 from django.shortcuts import get_object_or_404
 from django.apps import apps
-from rest_framework import permissions
+from django.db.models import Count, Max
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from rest_framework import permissions, status
+from rest_framework.response import Response
 from karmen.utils import classproperty
 from karmen.permissions import IsUserOfObject, IsManagerOfObject, IsUserOfParentObject
+from karmen.access import get_access
+from karmen.versions import access_label, get_versions
+
+
+RESPONSE_KEY_PREFIX = 'response-'
 
 
 class ObjectLevelAccessRestrictionViewSetMixin(object):
@@ -14,13 +28,17 @@ class ObjectLevelAccessRestrictionViewSetMixin(object):
 
     listing_permissions = [permissions.IsAdminUser]
     create_permissions = [permissions.IsAdminUser]
+    action_permissions = {}
+    '''{extra action name: permission classes}, extra actions are restricted to admins by default'''
 
     def get_permissions(self):
         """
         Instantiates and returns the list of permissions that this view requires.
         """
         # list create retrieve update partial_update destroy
-        if self.action == 'list':
+        if self.action in self.action_permissions:
+            permission_classes = self.action_permissions[self.action]
+        elif self.action == 'list':
             permission_classes = self.listing_permissions
         elif self.action == 'create':
             permission_classes = self.create_permissions
@@ -96,10 +114,196 @@ class NestedViewMixin(object):
         return get_object_or_404(self.get_parent_model(), pk=self.kwargs['%s_id' % self.get_parent_model_name()])
 
     def get_permissions(self):
-        if self.request.parent_instance.can_view(self.request.user):
+        if get_access(self.request).can_view(self.request.parent_instance):
             return super().get_permissions()
         else:
             return [permissions.IsAdminUser()]
 
 
+class RelatedFieldsViewSetMixin(object):
+    '''
+    Loads related objects used by serializer fields in bulk (prevents N+1 queries).
+
+    Declare relations needed by each serializer field:
+
+        class PrintersViewSet(RelatedFieldsViewSetMixin, viewsets.ModelViewSet):
+            select_related_fields = {'owner': ['owner']}
+            prefetch_related_fields = {'users': ['useronprinter_set__user']}
+
+    Only relations of fields which are actually serialized are loaded (fields
+    left out by `?fields=` query param - see `OptionalFieldsSerializerMixin` -
+    do not cost anything).
+    '''
+
+    select_related_fields = {}
+    '''{serializer field name: relations passed to `QuerySet.select_related`}'''
+
+    prefetch_related_fields = {}
+    '''{serializer field name: lookups passed to `QuerySet.prefetch_related`}'''
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        fields = self.get_serializer().fields
+        select_related = [
+            relation
+            for field, relations in self.select_related_fields.items() if field in fields
+            for relation in relations
+        ]
+        prefetch_related = [
+            lookup
+            for field, lookups in self.prefetch_related_fields.items() if field in fields
+            for lookup in lookups
+        ]
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        return queryset
+
+
+def is_not_modified(request, etag, last_modified):
+    '''
+    whether the client has the representation of `etag` (weak comparison)
+    modified at `last_modified` (`None` if unknown)
+    '''
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        tags = [tag.replace('W/', '', 1) for tag in parse_etags(if_none_match)]
+        return etag.replace('W/', '', 1) in tags or '*' in tags
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return None not in (if_modified_since, last_modified) and last_modified <= if_modified_since
+
+
+class ConditionalGetViewSetMixin(object):
+    '''
+    Answers `list` and `retrieve` of unchanged objects by `304 Not Modified`
+    (`If-None-Match` or `If-Modified-Since`) before anything is serialized.
+
+    Validators of an object derive from its `last_updated_on` and versions of
+    the tables its representation depends on (`version_tables`, see
+    `karmen.versions`), of a list from `max(last_updated_on)` and the count
+    of listed objects (a single query) and versions of the tables including
+    the table of the model (deleted objects). The ETag also covers the query
+    string, the user and the format of the response.
+
+    Representations with fields which change outside of the database
+    (`volatile_fields`, e.g. `octoprint` of printers) are not conditional.
+    '''
+
+    version_tables = ()
+    '''labels of models (`printers.useronprinter`) whose rows are serialized along the objects'''
+
+    volatile_fields = ()
+    '''serializer fields not derived from the database'''
+
+    def is_conditional(self):
+        fields = self.get_serializer().fields
+        return not any(field in fields for field in self.volatile_fields)
+
+    def get_validators(self, updated_on, tables, *extra):
+        '''returns (etag, last modified timestamp) of representation of rows updated at most `updated_on`'''
+        versions = get_versions(tables)
+        last_modified = max([updated_on.timestamp() if updated_on else 0] + list(versions.values()))
+        digest = hashlib.sha1(repr((
+            self.request.get_full_path(), self.request.accepted_renderer.format, self.request.user.pk,
+            updated_on, sorted(versions.items()), extra,
+        )).encode()).hexdigest()
+        # (rounded up - a version within the second must not be older than the header)
+        return 'W/%s' % quote_etag(digest[:20]), math.ceil(last_modified)
+
+    def conditional_response(self, validators, render):
+        '''304 response if the client has the current representation, `render()` otherwise'''
+        etag, last_modified = validators
+        if is_not_modified(self.request, etag, last_modified):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = render()
+        response['ETag'] = etag
+        if last_modified <= time():
+            # (not sent before the second is over, another change might come within it)
+            response['Last-Modified'] = http_date(last_modified)
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        if not self.is_conditional():
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        stats = queryset.order_by().aggregate(updated_on=Max('last_updated_on'), count=Count('pk'))
+        validators = self.get_validators(
+            stats['updated_on'], (queryset.model._meta.label_lower, ) + tuple(self.version_tables), stats['count'])
+        return self.conditional_response(validators, lambda: super(ConditionalGetViewSetMixin, self).list(
+            request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        if not self.is_conditional():
+            return Response(self.get_serializer(instance).data)
+        validators = self.get_validators(instance.last_updated_on, self.version_tables, instance.pk)
+        return self.conditional_response(validators, lambda: Response(self.get_serializer(instance).data))
+
+
+class CachedListViewSetMixin(ConditionalGetViewSetMixin):
+    '''
+    Caches rendered `list` responses in `RESPONSE_CACHE` so that repeated
+    reads of an unchanged list skip the database and serializers entirely.
+
+    The key covers the URL (with `fields` and paging), the format of the
+    response, the user, the version of the user's access and versions of
+    the tables serialized in the list (see `karmen.versions`) - `cached_tables`
+    and tables of optional fields which are requested (`cached_field_tables`),
+    a single cache round trip. Every write of those tables or of relationships
+    of the user changes the key, stale entries just expire.
+
+    Cached responses keep their validators (see `ConditionalGetViewSetMixin`),
+    a client having the current list gets 304.
+    '''
+
+    cached_tables = ()
+    '''labels of models whose rows are serialized in the list'''
+
+    cached_field_tables = {}
+    '''{serializer field: labels of models serialized by the field}'''
+
+    def get_response_key(self, fields):
+        tables = list(self.cached_tables) + [
+            label for field, labels in self.cached_field_tables.items() if field in fields for label in labels
+        ]
+        tables.append(access_label(self.request.user.pk))
+        versions = get_versions(tables)
+        digest = hashlib.sha1(repr((
+            self.request.build_absolute_uri(), self.request.accepted_renderer.format, self.request.user.pk,
+            sorted(versions.items()),
+        )).encode()).hexdigest()
+        return '%s%s' % (RESPONSE_KEY_PREFIX, digest)
+
+    def list(self, request, *args, **kwargs):
+        fields = self.get_serializer().fields
+        if any(field in fields for field in self.volatile_fields):
+            return super().list(request, *args, **kwargs)
+        cache = caches[settings.RESPONSE_CACHE]
+        key = self.get_response_key(fields)
+        cached = cache.get(key)
+        if cached is not None:
+            content, headers = cached
+            etag, last_modified = headers.get('ETag'), parse_http_date_safe(headers.get('Last-Modified', ''))
+            if etag and is_not_modified(request, etag, last_modified):
+                response = HttpResponseNotModified()
+            else:
+                response = HttpResponse(content)
+            for header, value in headers.items():
+                response[header] = value
+            return response
+
+        def store(response):
+            if response.status_code == status.HTTP_200_OK:
+                headers = {
+                    header: response[header] for header in ('Content-Type', 'ETag', 'Last-Modified', 'Cache-Control')
+                    if response.has_header(header)
+                }
+                cache.set(key, (response.content, headers), timeout=settings.RESPONSE_CACHE_TTL)
 
+        response = super().list(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            response.add_post_render_callback(store)
+        return response
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class PrintersConfig(AppConfig):
     name = 'printers'
+
+    def ready(self):
+        # pylint: disable=import-outside-toplevel,unused-import
+        from printers import signals
@@ -0,0 +1,67 @@
+'''
+Async views querying printer devices
+
+These views do not go through rest framework (which is synchronous) and
+query devices using `AsyncOctoprintClient`. When served under ASGI
+(`karmen/asgi.py`) no thread is blocked while waiting for the devices.
+'''
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, Http404
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, AuthenticationFailed
+from printers.device_query import aquery_devices
+from printers.models import Printer
+from printers.octoprint_async import session_scope
+
+
+def _authenticate(request):
+    '''
+    returns user authenticated by JWT token (see `tokens`) or session or None
+    '''
+    try:
+        authenticated = JWTAuthentication().authenticate(request)
+    except (InvalidToken, AuthenticationFailed):
+        return None
+    if authenticated is not None:
+        return authenticated[0]
+    return request.user if request.user.is_authenticated else None
+
+
+def _get_printer(user, printer_id):
+    try:
+        printer = Printer.objects.get(pk=printer_id)
+    except Printer.DoesNotExist:
+        raise Http404()
+    return printer if printer.can_view(user) else None
+
+
+def _list_printers(user):
+    return list(Printer.for_user(user).values_list('id', 'api_key'))
+
+
+def _forbidden():
+    return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=403)
+
+
+async def printer_octoprint(request, printer_id):
+    '''current state of the printer device (same as `octoprint` field of printer detail)'''
+    user = await sync_to_async(_authenticate, thread_sensitive=True)(request)
+    if user is None:
+        return _forbidden()
+    printer = await sync_to_async(_get_printer, thread_sensitive=True)(user, printer_id)
+    if printer is None:
+        return JsonResponse({'detail': 'You do not have permission to perform this action.'}, status=403)
+    async with session_scope():
+        states = await aquery_devices([printer.api_key])
+    return JsonResponse(states[printer.api_key])
+
+
+async def my_printers_octoprint(request):
+    '''current state of all devices of logged in user, keyed by printer id'''
+    user = await sync_to_async(_authenticate, thread_sensitive=True)(request)
+    if user is None:
+        return _forbidden()
+    printers = await sync_to_async(_list_printers, thread_sensitive=True)(user)
+    async with session_scope():
+        states = await aquery_devices([api_key for _, api_key in printers])
+    return JsonResponse({printer_id: states[api_key] for printer_id, api_key in printers})
@@ -0,0 +1,240 @@
+'''
+Bulk operations on printers
+
+Every operation takes a batch of items (objects of the request body) and
+returns a result per item in the same order:
+
+    {'status': 200, 'id': 'ab-cde-fgh'}
+    {'status': 201, 'id': 'ab-cde-fgh', 'name': 'printer', ...}
+    {'status': 403, 'detail': 'You do not have permission to perform this action.'}
+
+Access to the whole batch is checked at once - objects referenced by the
+items are loaded by one query per model and roles of the user come from the
+`AccessResolver` of the request (a single query). Valid items are written by
+`bulk_create` / `bulk_update` in one transaction, invalid items are skipped
+and reported. `PrinterAccess` is refreshed once per batch (see
+`printers.signals.deferred_access_refresh`).
+'''
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import exceptions
+from karmen import ROLE_ADMIN, ROLES
+from karmen.access import get_access
+from karmen.models import join_id
+from karmen.versions import touch
+from users.models import User
+from printers.models import Printer, PrinterInGroup, UserOnPrinter
+from printers.serializers import PrinterSerializer
+from printers.signals import deferred_access_refresh, refresh_access, users_in_groups
+
+
+NOT_FOUND = 'Not found.'
+FORBIDDEN = 'You do not have permission to perform this action.'
+
+
+def validate_items(data):
+    '''returns items of request body `data` (list of objects), raises `ValidationError`'''
+    if not isinstance(data, list) or not all(isinstance(item, dict) for item in data):
+        raise exceptions.ValidationError({'code': 'invalid-items', 'detail': 'Expected a list of objects.'})
+    if len(data) > settings.BULK_MAX_ITEMS:
+        raise exceptions.ValidationError({
+            'code': 'too-many-items', 'detail': f'At most {settings.BULK_MAX_ITEMS} items can be sent at once.'})
+    return data
+
+
+def error(status, detail):
+    return {'status': status, 'detail': detail}
+
+
+def load_printers(ids):
+    '''{joined id: printer} of existing printers of `ids`'''
+    ids = set(join_id(str(printer_id)) for printer_id in ids if printer_id)
+    return {join_id(printer.pk): printer for printer in Printer.objects.filter(pk__in=ids)}
+
+
+def check_printer(printers, printer_id, access, modify=True):
+    '''returns (printer, None) or (None, error result) of `printer_id` loaded by `load_printers`'''
+    printer = printers.get(join_id(str(printer_id or '')))
+    if printer is None or not access.can_view(printer):
+        return None, error(404, NOT_FOUND)
+    if modify and not access.can_modify(printer):
+        return None, error(403, FORBIDDEN)
+    return printer, None
+
+
+def create_printers(items, request, context):
+    '''
+    creates printers of `items` (`PrinterSerializer` data), the user becomes
+    their admin, results of created printers carry their representation (as
+    returned by `POST /printers/`)
+    '''
+    results, printers = [], []
+    for item in items:
+        serializer = PrinterSerializer(data=item, context=context)
+        if serializer.is_valid():
+            printers.append(Printer(**serializer.validated_data))
+            results.append(None)
+        else:
+            results.append({'status': 400, 'errors': serializer.errors})
+    if not printers:
+        return results
+    with transaction.atomic():
+        Printer.objects.bulk_create(printers)
+        UserOnPrinter.objects.bulk_create(
+            UserOnPrinter(printer=printer, user=request.user, role=ROLE_ADMIN) for printer in printers
+        )
+        refresh_access([request.user.pk], [printer.pk for printer in printers])
+        touch('printers.printer', 'printers.useronprinter')
+    # (reloaded in one go with their users and groups, the same way as listed printers)
+    loaded = {
+        join_id(printer.pk): printer
+        for printer in Printer.objects.filter(pk__in=[printer.pk for printer in printers]).prefetch_related(
+            'useronprinter_set__user', 'printeringroup_set__group')
+    }
+    created = iter(PrinterSerializer(
+        [loaded[join_id(printer.pk)] for printer in printers], many=True, context=context).data)
+    return [{'status': 201, **next(created)} if result is None else result for result in results]
+
+
+def update_printers(items, request, context):
+    '''partially updates printers of `items` (`PrinterSerializer` data with `id`)'''
+    access = get_access(request)
+    printers = load_printers(item.get('id') for item in items)
+    results, updated, fields = [], {}, set()
+    for item in items:
+        printer, result = check_printer(printers, item.get('id'), access)
+        if printer is not None:
+            serializer = PrinterSerializer(printer, data=item, partial=True, context=context)
+            if serializer.is_valid():
+                for field, value in serializer.validated_data.items():
+                    setattr(printer, field, value)
+                    fields.add(field)
+                updated[join_id(printer.pk)] = printer
+                result = {'status': 200, 'id': printer.pk}
+            else:
+                result = {'status': 400, 'errors': serializer.errors}
+        results.append(result)
+    if fields:
+        now = timezone.now()
+        for printer in updated.values():
+            printer.last_updated_on = now  # (`auto_now` is not applied by `bulk_update`)
+        Printer.objects.bulk_update(updated.values(), fields | {'last_updated_on'})
+        touch('printers.printer')
+    return results
+
+
+def delete_printers(items, request):
+    '''deletes printers of `items` (`{'id': ...}`)'''
+    access = get_access(request)
+    printers = load_printers(item.get('id') for item in items)
+    results, deleted = [], set()
+    for item in items:
+        printer, result = check_printer(printers, item.get('id'), access)
+        if printer is not None:
+            deleted.add(join_id(printer.pk))
+            result = {'status': 204, 'id': printer.pk}
+        results.append(result)
+    if deleted:
+        with transaction.atomic(), deferred_access_refresh():
+            Printer.objects.filter(pk__in=deleted).delete()
+    return results
+
+
+def set_printer_users(items, request):
+    '''
+    Sets roles of users on printers by `items` (`{'printerId', 'username',
+    'role'}`), `role` `null` removes the user from the printer.
+    '''
+    access = get_access(request)
+    printers = load_printers(item.get('printerId') for item in items)
+    users = {
+        user.username: user
+        for user in User.objects.filter(username__in=set(str(item.get('username')) for item in items))
+    }
+    results, roles = [], {}
+    for item in items:
+        printer, result = check_printer(printers, item.get('printerId'), access)
+        user = users.get(str(item.get('username')))
+        if printer is None:
+            pass
+        elif user is None:
+            result = error(404, f"User '{item.get('username')}' does not exist.")
+        elif item.get('role') is not None and item['role'] not in [role for role, _ in ROLES]:
+            result = {'status': 400, 'errors': {'role': [f"\"{item['role']}\" is not a valid choice."]}}
+        else:
+            roles[join_id(printer.pk), join_id(user.pk)] = item.get('role')
+            result = {'status': 200, 'printerId': printer.pk, 'username': user.username, 'role': item.get('role')}
+        results.append(result)
+    if not roles:
+        return results
+    printer_ids = set(printer_id for printer_id, _ in roles)
+    user_ids = set(user_id for _, user_id in roles)
+    existing = {
+        (join_id(row.printer_id), join_id(row.user_id)): row
+        for row in UserOnPrinter.objects.filter(printer_id__in=printer_ids, user_id__in=user_ids)
+    }
+    created, changed, removed = [], [], []
+    for (printer_id, user_id), role in roles.items():
+        row = existing.get((printer_id, user_id))
+        if row is None:
+            if role is not None:
+                created.append(UserOnPrinter(printer_id=printer_id, user_id=user_id, role=role))
+        elif role is None:
+            removed.append(row.pk)
+        elif row.role != role:
+            row.role = role
+            changed.append(row)
+    with transaction.atomic(), deferred_access_refresh():
+        UserOnPrinter.objects.bulk_create(created)
+        UserOnPrinter.objects.bulk_update(changed, ['role'])
+        UserOnPrinter.objects.filter(pk__in=removed).delete()
+        refresh_access(user_ids, printer_ids)  # (created and changed rows send no signals)
+        touch('printers.useronprinter')
+    return results
+
+
+def add_group_printers(group, items, request):
+    '''adds printers of `items` (`{'printerId': ...}`) to `group`'''
+    access = get_access(request)
+    printers = load_printers(item.get('printerId') for item in items)
+    present = set(
+        join_id(printer_id) for printer_id
+        in PrinterInGroup.objects.filter(group=group, printer_id__in=printers).values_list('printer_id', flat=True)
+    )
+    results, added = [], {}
+    for item in items:
+        printer, result = check_printer(printers, item.get('printerId'), access)
+        if printer is not None:
+            printer_id = join_id(printer.pk)
+            result = {'status': 200 if printer_id in present else 201, 'printerId': printer.pk}
+            if printer_id not in present:
+                added[printer_id] = PrinterInGroup(group=group, printer=printer)
+        results.append(result)
+    if added:
+        with transaction.atomic():
+            PrinterInGroup.objects.bulk_create(added.values())
+            refresh_access(users_in_groups([group.pk]), added)
+            touch('printers.printeringroup')
+    return results
+
+
+def remove_group_printers(group, items):
+    '''removes printers of `items` (`{'printerId': ...}`) from `group`'''
+    memberships = {
+        join_id(membership.printer_id): membership
+        for membership in PrinterInGroup.objects.filter(group=group, printer_id__in=set(
+            join_id(str(item.get('printerId'))) for item in items if item.get('printerId')))
+    }
+    results, removed = [], set()
+    for item in items:
+        membership = memberships.get(join_id(str(item.get('printerId') or '')))
+        if membership is None:
+            results.append(error(404, NOT_FOUND))
+        else:
+            removed.add(membership.pk)
+            results.append({'status': 204, 'printerId': membership.printer_id})
+    if removed:
+        with transaction.atomic(), deferred_access_refresh():
+            PrinterInGroup.objects.filter(pk__in=removed).delete()
+    return results
@@ -0,0 +1,203 @@
+'''
+Batched queries to printer devices
+
+Serializing printers with the `octoprint` field requires several calls to each
+device. Instead of calling the devices one after another, `query_devices`
+submits the calls for all printers at once to a process-wide thread pool and
+waits for them at most `OCTOPRINT_QUERY_DEADLINE` seconds. Devices which do not
+respond in time (or at all) get an error block instead of holding up the whole
+response.
+
+`aquery_devices` does the same for async views, using
+`printers.octoprint_async.AsyncOctoprintClient` instead of threads.
+'''
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, wait
+from time import monotonic
+from threading import Lock
+from weakref import WeakKeyDictionary
+from urllib.parse import urlparse, parse_qsl
+from django.conf import settings
+from printers.octoprint import get_client, call_deadline, DeviceError, PrinterNotOperationalError
+from printers.octoprint_async import AsyncOctoprintClient
+
+
+MISSING_CONNECTION_ERROR = 'Missing connection information. Set api_key.'
+TIMEOUT_ERROR = 'The device did not respond in time.'
+
+_executor = None
+_executor_lock = Lock()
+
+
+def get_executor():
+    '''
+    Thread pool shared by all requests of the process.
+
+    Its size caps the number of device calls in flight at any time.
+    '''
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.OCTOPRINT_MAX_CONCURRENCY,
+                    thread_name_prefix='device-query',
+                )
+    return _executor
+
+
+def _get_api_key(connection_string):
+    # FIXME: this is development verison, the printer will be connected
+    # through websocket proxy server in real application
+    parts = urlparse(connection_string)
+    return dict(parse_qsl(parts.query)).get('apikey')
+
+
+def get_api(connection_string):
+    '''returns (pooled) octoprint client for `connection_string` (see `Printer.api_key`)'''
+    return get_client(api_uri=connection_string, api_key=_get_api_key(connection_string))
+
+
+def get_async_api(connection_string):
+    '''returns async octoprint client for `connection_string` (see `Printer.api_key`)'''
+    return AsyncOctoprintClient(api_uri=connection_string, api_key=_get_api_key(connection_string))
+
+
+def _get_printer(api):
+    '''printer state or None if the printer is not connected to the device'''
+    try:
+        return api.get_printer()
+    except PrinterNotOperationalError:
+        return None
+
+
+async def _aget_printer(api):
+    '''async twin of `_get_printer`'''
+    try:
+        return await api.get_printer()
+    except PrinterNotOperationalError:
+        return None
+
+
+QUERIES = (
+    ('version', lambda api: api.get_version()),
+    ('files', lambda api: api.list_files()),
+    ('printer', _get_printer),
+)
+'''calls made to every device, (key in the response, callable taking client)'''
+
+ASYNC_QUERIES = (
+    ('version', lambda api: api.get_version()),
+    ('files', lambda api: api.list_files()),
+    ('printer', _aget_printer),
+)
+'''same as QUERIES for `AsyncOctoprintClient`'''
+
+
+def _call(query, api, until):
+    '''`query(api)` giving up at monotonic time `until` (see `call_deadline`)'''
+    with call_deadline(until):
+        return query(api)
+
+
+def _collect(futures):
+    '''
+    Builds the representation of one device from its (possibly unfinished)
+    futures.
+    '''
+    response = {}
+    errors = []
+    for key, future in futures:
+        if not future.done():
+            future.cancel()
+            errors.append(TIMEOUT_ERROR)
+            response[key] = None
+            continue
+        try:
+            response[key] = future.result()
+        except DeviceError as e:
+            errors.append(str(e))
+            response[key] = None
+    if len(errors) == len(futures):
+        return {'error': errors[0]}
+    if errors:
+        response['error'] = errors[0]
+    return response
+
+
+def query_devices(connection_strings, deadline=None, queries=QUERIES):
+    '''
+    Queries all devices in `connection_strings` concurrently.
+
+    Returns dict mapping every connection string to its representation (see
+    `OctoprintSerializer`). Partial results are returned for devices which
+    failed to answer some of the calls within `deadline` seconds (defaults to
+    `settings.OCTOPRINT_QUERY_DEADLINE`). Calls made to the devices can be
+    changed by `queries` (see `QUERIES`). The calls themselves give up at the
+    deadline too so that unresponsive devices do not hold threads of the pool.
+    '''
+    if deadline is None:
+        deadline = settings.OCTOPRINT_QUERY_DEADLINE
+    until = monotonic() + deadline
+    executor = get_executor()
+    pending = {}
+    results = {}
+    for connection_string in set(connection_strings):
+        if not connection_string or not connection_string.startswith('http'):
+            results[connection_string] = {'error': MISSING_CONNECTION_ERROR}
+            continue
+        api = get_api(connection_string)
+        pending[connection_string] = [
+            (key, executor.submit(_call, query, api, until))
+            for key, query in queries
+        ]
+    if pending:
+        wait([future for futures in pending.values() for _, future in futures], timeout=deadline)
+    for connection_string, futures in pending.items():
+        results[connection_string] = _collect(futures)
+    return results
+
+
+_semaphores = WeakKeyDictionary()
+
+
+def _get_semaphore():
+    '''semaphore capping device calls running in the current event loop'''
+    loop = asyncio.get_event_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _semaphores[loop] = asyncio.Semaphore(settings.OCTOPRINT_MAX_CONCURRENCY)
+    return semaphore
+
+
+async def aquery_devices(connection_strings, deadline=None, queries=ASYNC_QUERIES):
+    '''
+    Async twin of `query_devices`.
+
+    The number of concurrent calls is capped by `OCTOPRINT_MAX_CONCURRENCY`
+    per event loop.
+    '''
+    if deadline is None:
+        deadline = settings.OCTOPRINT_QUERY_DEADLINE
+    semaphore = _get_semaphore()
+
+    async def limited(query, api):
+        async with semaphore:
+            return await query(api)
+
+    pending = {}
+    results = {}
+    for connection_string in set(connection_strings):
+        if not connection_string or not connection_string.startswith('http'):
+            results[connection_string] = {'error': MISSING_CONNECTION_ERROR}
+            continue
+        api = get_async_api(connection_string)
+        pending[connection_string] = [
+            (key, asyncio.ensure_future(limited(query, api)))
+            for key, query in queries
+        ]
+    if pending:
+        await asyncio.wait([future for futures in pending.values() for _, future in futures], timeout=deadline)
+    for connection_string, futures in pending.items():
+        results[connection_string] = _collect(futures)
+    return results
@@ -0,0 +1,200 @@
+'''
+Printer status pushed by server-sent events
+
+`printer_events` is a plain ASGI application (see `karmen/asgi.py`) mounted at
+`users/me/printers/events`. It streams `text/event-stream` describing states
+of printers of the user (`Printer.for_user`, optionally only printers of
+group `?group=<id>`) as a single document `{printer id: state}` where state
+is the status snapshot (see `printers.status`):
+
+    event: snapshot
+    data: {"ab-cde-fgh": {"printer": ..., "job": ..., "polledOn": ...}, ...}
+
+    event: patch
+    data: {"ab-cde-fgh": {"job": {"progress": {"completion": 42.1}}, "polledOn": ...}}
+
+`snapshot` is the whole document, `patch` is its JSON merge patch (RFC 7386)
+with printers whose state changed (a printer the user lost access to is
+`null`). Nothing is sent while nothing changes but `: keep-alive` comments.
+
+Snapshots are not read per client - the process-wide `hub` reads snapshots of
+all watched printers once per `PRINTER_EVENTS_INTERVAL` (a single cache round
+trip) and fans changes out to subscribed clients, so the cost does not depend
+on the number of viewers. A client which does not keep up gets a fresh
+snapshot instead of the patches it missed. Snapshots sent to clients are made
+of the hub's states (`StatusHub.get_states`), the same ones the patches are
+computed from.
+'''
+import asyncio
+import json
+from logging import getLogger
+from time import monotonic
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from karmen.asgi_utils import authenticate, query_params, respond, wait_for_disconnect, NOT_AUTHENTICATED
+from printers.models import Printer
+from printers.status import get_snapshots, merge_patch, same_state, NOT_POLLED_ERROR
+
+
+logger = getLogger()
+
+KEEPALIVE_INTERVAL = 15
+'''seconds between keep-alive comments (so that proxies do not close idle streams)'''
+
+
+def get_state(snapshots, printer_id):
+    return snapshots.get(printer_id) or {'error': NOT_POLLED_ERROR}
+
+
+class StatusHub(object):
+    '''watches snapshots of printers subscribed by clients of the event loop and publishes their changes'''
+
+    def __init__(self):
+        self.subscribers = {}
+        '''{queue: set of printer ids}'''
+        self.states = {}
+        '''{printer id: last known state}'''
+        self.task = None
+
+    def subscribe(self, printer_ids):
+        '''returns queue getting patches `{printer id: patch}` (`None` when the client should be reset)'''
+        queue = asyncio.Queue(maxsize=settings.PRINTER_EVENTS_QUEUE_SIZE)
+        self.subscribers[queue] = set(printer_ids)
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+        return queue
+
+    async def get_states(self, printer_ids):
+        '''
+        {printer id: state} of subscribed `printer_ids` as known to the hub (the
+        base of the patches published next), printers new to the hub are read
+        from the cache
+        '''
+        missing = [printer_id for printer_id in printer_ids if printer_id not in self.states]
+        if missing:
+            snapshots = await sync_to_async(get_snapshots)(missing)
+            for printer_id in missing:
+                # (unless the hub read it meanwhile)
+                self.states.setdefault(printer_id, get_state(snapshots, printer_id))
+        return {printer_id: self.states[printer_id] for printer_id in printer_ids}
+
+    def update(self, queue, printer_ids):
+        self.subscribers[queue] = set(printer_ids)
+
+    def unsubscribe(self, queue):
+        self.subscribers.pop(queue, None)
+        if not self.subscribers and self.task is not None:
+            self.task.cancel()
+            self.task = None
+            self.states = {}
+
+    def publish(self, changes):
+        for queue, printer_ids in self.subscribers.items():
+            patch = {printer_id: changes[printer_id] for printer_id in printer_ids if printer_id in changes}
+            if not patch:
+                continue
+            if queue.full():
+                # the client does not keep up, replace its pending patches by a reset
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+            else:
+                queue.put_nowait(patch)
+
+    def check(self, snapshots):
+        '''compares `snapshots` of watched printers with the last known states and publishes the changes'''
+        watched = set().union(*self.subscribers.values())
+        for printer_id in set(self.states) - watched:
+            del self.states[printer_id]
+        changes = {}
+        for printer_id in watched:
+            state = get_state(snapshots, printer_id)
+            previous = self.states.get(printer_id)
+            if previous is None:
+                # (read before the subscribers got their snapshot, which will be made of it)
+                changes[printer_id] = state
+            elif not same_state(previous, state):
+                changes[printer_id] = merge_patch(previous, state)
+            self.states[printer_id] = state
+        if changes:
+            self.publish(changes)
+
+    async def run(self):
+        while self.subscribers:
+            watched = set().union(*self.subscribers.values())
+            try:
+                self.check(await sync_to_async(get_snapshots)(watched))
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('Reading printer snapshots failed.')
+            await asyncio.sleep(settings.PRINTER_EVENTS_INTERVAL)
+
+
+hub = StatusHub()
+'''hub of the ASGI server's event loop'''
+
+
+def _list_printers(user, group_id=None):
+    printers = Printer.for_user(user)
+    if group_id:
+        printers = printers.filter(printeringroup__group_id=group_id)
+    return list(printers.values_list('id', flat=True))
+
+
+def _event(name, data):
+    return ('event: %s\ndata: %s\n\n' % (name, json.dumps(data))).encode()
+
+
+async def _snapshot(printer_ids):
+    return _event('snapshot', await hub.get_states(printer_ids))
+
+
+async def printer_events(scope, receive, send):
+    '''ASGI application streaming states of the user's printers'''
+    user = await sync_to_async(authenticate, thread_sensitive=True)(scope)
+    if user is None:
+        return await respond(send, 403, NOT_AUTHENTICATED)
+    group_id = (query_params(scope).get('group') or [None])[0]
+    list_printers = sync_to_async(_list_printers, thread_sensitive=True)
+    printer_ids = await list_printers(user, group_id)
+
+    queue = hub.subscribe(printer_ids)
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache, private'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': await _snapshot(printer_ids), 'more_body': True})
+        refreshed_on = monotonic()
+        while True:
+            next_patch = asyncio.ensure_future(queue.get())
+            await asyncio.wait((next_patch, disconnected), timeout=KEEPALIVE_INTERVAL, return_when=asyncio.FIRST_COMPLETED)
+            if disconnected.done():
+                next_patch.cancel()
+                return
+            if not next_patch.done():
+                next_patch.cancel()
+                body = b': keep-alive\n\n'
+            elif next_patch.result() is None:
+                body = await _snapshot(printer_ids)
+            else:
+                body = _event('patch', next_patch.result())
+            if monotonic() - refreshed_on > settings.PRINTER_EVENTS_REFRESH:
+                # access of the user might have changed
+                refreshed_on = monotonic()
+                current = await list_printers(user, group_id)
+                if set(current) != set(printer_ids):
+                    patch = {printer_id: None for printer_id in set(printer_ids) - set(current)}
+                    patch.update(await hub.get_states(set(current) - set(printer_ids)))
+                    body += _event('patch', patch)
+                    printer_ids = current
+                    hub.update(queue, printer_ids)
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    finally:
+        hub.unsubscribe(queue)
+        disconnected.cancel()
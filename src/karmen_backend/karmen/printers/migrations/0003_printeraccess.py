@@ -0,0 +1,29 @@
+# Generated by Django 3.1 on 2020-08-07 09:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('printers', '0002_auto_20200731_1156'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrinterAccess',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('admin', 'admin'), ('user', 'user')], max_length=20, verbose_name='User role')),
+                ('printer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='access', to='printers.printer')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='printer_access', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='printeraccess',
+            constraint=models.UniqueConstraint(fields=('user', 'printer'), name='Uniq_printer_access'),
+        ),
+    ]
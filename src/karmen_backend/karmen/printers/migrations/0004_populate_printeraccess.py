@@ -0,0 +1,38 @@
+# Generated by Django 3.1 on 2020-08-07 09:14
+
+from django.db import migrations
+
+
+def populate_printer_access(apps, schema_editor):
+    '''fills `PrinterAccess` from existing relationships (admin role wins)'''
+    UserOnPrinter = apps.get_model('printers', 'UserOnPrinter')
+    UserInGroup = apps.get_model('groups', 'UserInGroup')
+    PrinterInGroup = apps.get_model('printers', 'PrinterInGroup')
+    PrinterAccess = apps.get_model('printers', 'PrinterAccess')
+    groups = {}
+    for user_id, group_id, role in UserInGroup.objects.values_list('user_id', 'group_id', 'role'):
+        groups.setdefault(group_id, []).append((user_id, role))
+    roles = {}
+    relationships = list(UserOnPrinter.objects.values_list('user_id', 'printer_id', 'role'))
+    for printer_id, group_id in PrinterInGroup.objects.values_list('printer_id', 'group_id'):
+        for user_id, role in groups.get(group_id, ()):
+            relationships.append((user_id, printer_id, role))
+    for user_id, printer_id, role in relationships:
+        if roles.get((user_id, printer_id)) != 'admin':
+            roles[(user_id, printer_id)] = role
+    PrinterAccess.objects.bulk_create(
+        PrinterAccess(user_id=user_id, printer_id=printer_id, role=role)
+        for (user_id, printer_id), role in roles.items()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('groups', '0002_auto_20200731_1156'),
+        ('printers', '0003_printeraccess'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_printer_access, migrations.RunPython.noop),
+    ]
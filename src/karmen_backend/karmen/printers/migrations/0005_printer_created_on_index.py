@@ -0,0 +1,18 @@
+# Generated by Django 3.1 on 2020-08-07 14:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('printers', '0004_populate_printeraccess'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='printer',
+            name='created_on',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.1 on 2020-08-10 08:41
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import karmen.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0004_file_uploaded_on_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('printers', '0005_printer_created_on_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileTransfer',
+            fields=[
+                ('id', karmen.models.IdField(serialize=False)),
+                ('start_print', models.BooleanField(default=False, help_text='Print the file when uploaded.', verbose_name='Start print')),
+                ('state', models.CharField(choices=[('queued', 'queued'), ('sending', 'sending'), ('done', 'done'), ('failed', 'failed'), ('cancelled', 'cancelled')], default='queued', max_length=20, verbose_name='State')),
+                ('size', models.BigIntegerField(default=0, help_text='Bytes to send (including multipart headers).', verbose_name='Size')),
+                ('sent', models.BigIntegerField(default=0, help_text='Bytes sent so far.', verbose_name='Sent')),
+                ('cancelled', models.BooleanField(default=False, help_text='Cancellation was requested.', verbose_name='Cancelled')),
+                ('error', models.CharField(blank=True, max_length=255, verbose_name='Error')),
+                ('created_on', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('finished_on', models.DateTimeField(blank=True, null=True)),
+                ('file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transfers', to='files.file')),
+                ('printer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transfers', to='printers.printer')),
+                ('started_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
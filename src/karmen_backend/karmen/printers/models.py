@@ -1,6 +1,6 @@
 from django.db import models
 from karmen import ROLE_ADMIN, ROLE_USER, ROLES
-from karmen.models import IdField
+from karmen.models import IdField, join_id
 from users.models import User
 
 
@@ -25,7 +25,7 @@ class Printer(models.Model):
     users = models.ManyToManyField(User, through='UserOnPrinter', related_name='printers')
     groups = models.ManyToManyField('groups.Group', related_name='printers', through='PrinterInGroup')
 
-    created_on = models.DateTimeField(auto_now_add=True)
+    created_on = models.DateTimeField(auto_now_add=True, db_index=True)
     last_updated_on = models.DateTimeField(auto_now=True)
 
     def __str__(self):
@@ -34,10 +34,7 @@ class Printer(models.Model):
     @classmethod
     def for_user(cls, user):
         'queryset of printers accessible by user `user`'
-        return cls.objects.filter(
-            models.Q(useronprinter__user=user) | \
-            models.Q(groups__users=user)
-        ).distinct()
+        return cls.objects.filter(access__user=user)
 
     def list_own_users(self, role=None):
         '''
@@ -82,12 +79,16 @@ class Printer(models.Model):
         '''returns True if the user is admin (directly or through a group)'''
         return self.has_user(user, role=ROLE_ADMIN)
 
-    def can_view(self, user):
+    def can_view(self, user, access=None):
         '''returns True if the user can display this printer'''
+        if access is not None:
+            return access.printer_role(self.pk) is not None
         return self.has_user(user)
 
-    def can_modify(self, user):
+    def can_modify(self, user, access=None):
         '''returns True if the user can modify this printer'''
+        if access is not None:
+            return access.printer_role(self.pk) == ROLE_ADMIN
         return self.is_admin(user)
 
     def set_user(self, user, role=None):
@@ -122,17 +123,19 @@ class UserOnPrinter(models.Model):
             models.UniqueConstraint(fields=('printer', 'user'), name='Uniq_user_on_printer'),
         )
 
-    def can_view(self, user):
+    def can_view(self, user, access=None):
         '''user can always view his / her own relationship'''
-        return self.user == user or self.can_modify(user)
+        return self.user == user or self.can_modify(user, access)
 
-    def can_modify(self, user):
+    def can_modify(self, user, access=None):
         '''only printer admin can change user relationship'''
+        if access is not None:
+            return access.printer_role(self.printer_id) == ROLE_ADMIN
         return self.printer.can_modify(user)
 
-    def can_delete(self, user):
+    def can_delete(self, user, access=None):
         '''user can remove self from printer (leave it)'''
-        return self.user == user or self.can_modify(user)
+        return self.user == user or self.can_modify(user, access)
 
 
 class PrinterInGroup(models.Model):
@@ -147,14 +150,157 @@ class PrinterInGroup(models.Model):
             models.UniqueConstraint(fields=('printer', 'group'), name='Uniq_printer_in_group'),
         )
 
-    def can_view(self, user):
-        '''only printer admin can change user relationship'''
+    def can_view(self, user, access=None):
+        '''members of the group can see its printers'''
+        if access is not None:
+            return access.group_role(self.group_id) is not None
         return self.group.can_view(user)
 
-    def can_modify(self, user):
-        '''user can remove self from printer (leave it)'''
+    def can_modify(self, user, access=None):
+        '''only group admin can change printers in the group'''
+        if access is not None:
+            return access.group_role(self.group_id) == ROLE_ADMIN
         return self.group.can_modify(user)
 
-    def can_delete(self, user):
-        '''user can remove self from printer (leave it)'''
-        return self.user == user or self.can_modify(user)
+    def can_delete(self, user, access=None):
+        '''only group admin can remove printer from the group'''
+        return self.can_modify(user, access)
+
+
+class PrinterAccess(models.Model):
+    '''
+    Effective access of users to printers (materialized)
+
+    One row per user with access to a printer either directly (`UserOnPrinter`)
+    or through a group (`groups.UserInGroup` + `PrinterInGroup`) holding the
+    highest role of the user on the printer. The table is maintained by signals
+    (see `printers.signals`), never change it directly - use `refresh` instead.
+    '''
+    user = models.ForeignKey('users.User', on_delete=models.CASCADE, related_name='printer_access')
+    printer = models.ForeignKey(Printer, on_delete=models.CASCADE, related_name='access')
+    role = models.CharField('User role', blank=False, null=False, max_length=20, choices=ROLES)
+
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(fields=('user', 'printer'), name='Uniq_printer_access'),
+        )
+
+    @classmethod
+    def compute(cls, user_ids=None, printer_ids=None):
+        '''
+        returns dict {(user_id, printer_id): role} of effective roles computed
+        from the relationship tables (optionally limited to some users and printers)
+        '''
+        # pylint: disable=import-outside-toplevel
+        from karmen.access import ROLE_PRIORITY
+        direct = UserOnPrinter.objects.all()
+        inherited = PrinterInGroup.objects.filter(group__useringroup__isnull=False)
+        if user_ids is not None:
+            direct = direct.filter(user_id__in=user_ids)
+            inherited = inherited.filter(group__useringroup__user_id__in=user_ids)
+        if printer_ids is not None:
+            direct = direct.filter(printer_id__in=printer_ids)
+            inherited = inherited.filter(printer_id__in=printer_ids)
+        roles = {}
+        for user_id, printer_id, role in direct.values_list('user_id', 'printer_id', 'role').union(
+                inherited.values_list('group__useringroup__user_id', 'printer_id', 'group__useringroup__role'),
+                all=True):
+            key = (join_id(user_id), join_id(printer_id))
+            current = roles.get(key)
+            if current is None or ROLE_PRIORITY.get(role, 1) > ROLE_PRIORITY.get(current, 1):
+                roles[key] = role
+        return roles
+
+    @classmethod
+    def refresh(cls, user_ids=None, printer_ids=None):
+        '''
+        Brings rows of `user_ids` x `printer_ids` (all users / printers when
+        None) in sync with the relationship tables.
+        '''
+        if user_ids is not None:
+            user_ids = set(join_id(user_id) for user_id in user_ids)
+        if printer_ids is not None:
+            printer_ids = set(join_id(printer_id) for printer_id in printer_ids)
+        if user_ids == set() or printer_ids == set():
+            return
+        roles = cls.compute(user_ids, printer_ids)
+        rows = cls.objects.all()
+        if user_ids is not None:
+            rows = rows.filter(user_id__in=user_ids)
+        if printer_ids is not None:
+            rows = rows.filter(printer_id__in=printer_ids)
+        stale = []
+        changed = []
+        for row in rows:
+            key = (join_id(row.user_id), join_id(row.printer_id))
+            role = roles.pop(key, None)
+            if role is None:
+                stale.append(row.pk)
+            elif role != row.role:
+                row.role = role
+                changed.append(row)
+        if stale:
+            cls.objects.filter(pk__in=stale).delete()
+        if changed:
+            cls.objects.bulk_update(changed, ['role'])
+        if roles:
+            cls.objects.bulk_create(
+                cls(user_id=user_id, printer_id=printer_id, role=role)
+                for (user_id, printer_id), role in roles.items()
+            )
+
+
+TRANSFER_QUEUED = 'queued'
+TRANSFER_SENDING = 'sending'
+TRANSFER_DONE = 'done'
+TRANSFER_FAILED = 'failed'
+TRANSFER_CANCELLED = 'cancelled'
+TRANSFER_STATES = (
+    (TRANSFER_QUEUED, TRANSFER_QUEUED),
+    (TRANSFER_SENDING, TRANSFER_SENDING),
+    (TRANSFER_DONE, TRANSFER_DONE),
+    (TRANSFER_FAILED, TRANSFER_FAILED),
+    (TRANSFER_CANCELLED, TRANSFER_CANCELLED),
+)
+'''states of `FileTransfer`'''
+TRANSFER_FINISHED_STATES = (TRANSFER_DONE, TRANSFER_FAILED, TRANSFER_CANCELLED)
+
+
+class FileTransfer(models.Model):
+    '''
+    Upload of a stored `files.File` to a printer device
+
+    The upload runs in background (see `printers.transfers`), the row holds
+    its state and progress.
+    '''
+
+    id = IdField()
+    file = models.ForeignKey('files.File', on_delete=models.CASCADE, related_name='transfers')
+    printer = models.ForeignKey(Printer, on_delete=models.CASCADE, related_name='transfers')
+    started_by = models.ForeignKey('users.User', on_delete=models.CASCADE)
+    start_print = models.BooleanField('Start print', default=False, help_text='Print the file when uploaded.')
+    state = models.CharField('State', max_length=20, choices=TRANSFER_STATES, default=TRANSFER_QUEUED)
+    size = models.BigIntegerField('Size', default=0, help_text='Bytes to send (including multipart headers).')
+    sent = models.BigIntegerField('Sent', default=0, help_text='Bytes sent so far.')
+    cancelled = models.BooleanField('Cancelled', default=False, help_text='Cancellation was requested.')
+    error = models.CharField('Error', max_length=255, blank=True)
+    created_on = models.DateTimeField(auto_now_add=True, db_index=True)
+    finished_on = models.DateTimeField(null=True, blank=True)
+
+    @property
+    def is_finished(self):
+        return self.state in TRANSFER_FINISHED_STATES
+
+    def can_view(self, user, access=None):
+        '''users of the printer can see transfers to it'''
+        if access is not None:
+            return access.printer_role(self.printer_id) is not None
+        return self.printer.can_view(user)
+
+    def can_modify(self, user, access=None):
+        '''transfer can be cancelled by the user who started it or by printer admin'''
+        if user.is_authenticated and join_id(self.started_by_id) == join_id(user.pk):
+            return True
+        if access is not None:
+            return access.printer_role(self.printer_id) == ROLE_ADMIN
+        return self.printer.can_modify(user)
@@ -1,5 +1,17 @@
-from urllib.parse import urljoin
-from requests import request
+import json
+import os
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock, local
+from time import monotonic
+from urllib.parse import urljoin, urlparse
+from django.conf import settings
+from requests import Session, RequestException
+from requests.adapters import HTTPAdapter
+from requests_toolbelt import MultipartEncoder
+from urllib3.exceptions import HTTPError as TransportError
+from urllib3.util.retry import Retry
+from urllib3.util.timeout import Timeout
 from karmen.utils import lock_cached
 
 
@@ -18,6 +30,92 @@ class ConflictError(DeviceError):
 class PrinterNotOperationalError(DeviceError):
     '''The device indicates that the printer is not in operational state (not connected).'''
 
+class DeviceConnectionError(DeviceError):
+    '''The device could not be reached (offline, refused connection or timed out)'''
+
+
+def parse_response(status_code, reason, content):
+    '''
+    Returns parsed body of device response or raises DeviceError.
+
+    Shared by both synchronous and asynchronous (see `octoprint_async`) client.
+    '''
+    if status_code == 200:
+        try:
+            return json.loads(content)
+        except ValueError:
+            raise UnparsableResponseError('The client response does not contain a json content.')
+    elif status_code in (204, 201, ):
+        return None
+    elif status_code == 403:
+        raise PermissionDeniedError('The device indicates that we do not have access to the resource.')
+    elif status_code == 409:
+        raise ConflictError(content)
+    else:
+        raise DeviceError(f'Got an unexpected response {status_code} {reason} from the device.')
+
+
+class ChunkedBody(object):
+    '''
+    Streams `MultipartEncoder` to requests in chunks of `chunk_size` bytes.
+
+    `callback(sent, total)` is called after each chunk, an exception raised by
+    the callback aborts the request. `len()` lets requests send
+    `Content-Length` instead of chunked transfer encoding.
+    '''
+
+    def __init__(self, encoder, chunk_size, callback=None):
+        self.encoder = encoder
+        self.chunk_size = chunk_size
+        self.callback = callback
+        self.sent = 0
+
+    def __len__(self):
+        return self.encoder.len
+
+    def __iter__(self):
+        while True:
+            chunk = self.encoder.read(self.chunk_size)
+            if not chunk:
+                return
+            self.sent += len(chunk)
+            if self.callback:
+                self.callback(self.sent, self.encoder.len)
+            yield chunk
+
+
+_deadline = local()
+'''`until` - monotonic time by which device calls of the thread have to finish (see `call_deadline`)'''
+
+
+@contextmanager
+def call_deadline(until):
+    '''
+    Device calls made by the thread within the block give up at monotonic time
+    `until` - their timeouts are capped by the time left and they are not
+    retried. Used by queries which stop waiting for the devices at a deadline
+    (see `device_query`) so that abandoned calls do not hold their thread
+    longer than that.
+    '''
+    _deadline.until = until
+    try:
+        yield
+    finally:
+        _deadline.until = None
+
+
+def _time_left():
+    '''seconds left till the deadline of the thread (None if there is none)'''
+    until = getattr(_deadline, 'until', None)
+    return None if until is None else until - monotonic()
+
+
+class DeadlineRetry(Retry):
+    '''`Retry` which does not retry calls made under `call_deadline`'''
+
+    def is_exhausted(self):
+        return _time_left() is not None or super().is_exhausted()
+
 
 class OctoprintClient(object):
     '''
@@ -26,24 +124,65 @@ class OctoprintClient(object):
     This class is responsible to communicate with octoprint devices
 
     @see [Readme](../../../README.md) for instructions on how to setup testing octoprint server for development.
-    
+
+    Use `get_client` to obtain a client - the clients are kept in a registry
+    so their connection pools (keep-alive connections) are reused across
+    requests.
     '''
 
-    def __init__(self, api_uri, api_key=None):
+    def __init__(self, api_uri, api_key=None, timeout=None):
         self._base_api_uri = '%s/' % api_uri.rstrip('/')
         '''uri to the base endpoint of octoprint API'''
         self.api_key = api_key
         '''api key needed to access Octoprint server'''
+        if timeout is None:
+            timeout = (settings.OCTOPRINT_CONNECT_TIMEOUT, settings.OCTOPRINT_READ_TIMEOUT)
+        self.timeout = timeout
+        '''seconds to wait for the device, see `timeout` in requests'''
+        self.session = self._make_session()
+        '''http session holding a pool of keep-alive connections to the device'''
         self.status = None
         '''current printer status'''
 
+    def _make_session(self):
+        '''
+        Creates http session with connection pool of `OCTOPRINT_POOL_SIZE`
+        connections. Idempotent requests failing on connection errors or on
+        gateway errors are retried `OCTOPRINT_RETRIES` times with exponential
+        backoff.
+        '''
+        retry = DeadlineRetry(
+            total=settings.OCTOPRINT_RETRIES,
+            backoff_factor=settings.OCTOPRINT_RETRY_BACKOFF,
+            status_forcelist=(502, 503, 504),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=settings.OCTOPRINT_POOL_SIZE,
+            max_retries=retry,
+        )
+        session = Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    @property
+    def cache_id(self):
+        '''identifies the device in cache keys (see `karmen.utils.lock_cached`)'''
+        return '%s|%s' % (self._base_api_uri, self.api_key)
+
+    def close(self):
+        '''closes all pooled connections'''
+        self.session.close()
+
     def _make_request(self, method, path, **kwargs):
         '''
         Performs request to configured device api using 
 
         :param str method: http method, GET, POST, ...
         :param str path: relative path to api_uri (set in __init__)
-        :param **kwargs: other keyword arguments directly passed to requests.request method
+        :param **kwargs: other keyword arguments directly passed to requests.Session.request method
         :return
         Returns
         -------
@@ -63,21 +202,18 @@ class OctoprintClient(object):
         params = kwargs.pop('params', {})
         if self.api_key:
             params['apikey'] = self.api_key
-        response = request(method, url, params=params, **kwargs)
-        if response.status_code == 200:
-            if response.json:
-                data = response.json()
-            else:
-                raise UnparsableResponseError('The client response does not contain a json content.')
-        elif response.status_code in (204, 201, ):
-            data = None
-        elif response.status_code == 403:
-            raise PermissionDeniedError('The device indicates that we do not have access to the resource.')
-        elif response.status_code == 409:
-            raise ConflictError(response.content)
-        else:
-            raise DeviceError(f'Got an unexpected response {response.status_code} {response.reason} from the device.')
-        return data
+        time_left = _time_left()
+        if time_left is not None and 'timeout' not in kwargs:
+            if time_left <= 0:
+                raise DeviceConnectionError('Unable to reach the device: the deadline passed.')
+            connect, read = self.timeout
+            kwargs['timeout'] = Timeout(connect=min(connect, time_left), read=min(read, time_left), total=time_left)
+        kwargs.setdefault('timeout', self.timeout)
+        try:
+            response = self.session.request(method, url, params=params, **kwargs)
+        except RequestException as e:
+            raise DeviceConnectionError(f'Unable to reach the device: {e}')
+        return parse_response(response.status_code, response.reason, response.content)
 
     def _get(self, path, **kwargs):
         '''
@@ -100,6 +236,37 @@ class OctoprintClient(object):
     def get_connection(self):
         return self._get('connection')
 
+    @lock_cached(ttl=5)
+    def get_job(self):
+        return self._get('job')
+
+    @lock_cached(ttl=60)
+    def get_settings(self):
+        return self._get('settings')
+
+    def get_resource(self, url, max_size):
+        '''
+        GETs non-API resource `url` (e.g. webcam snapshot) and returns its
+        (content type, content). Raises DeviceError if the resource is not
+        available, is larger than `max_size` bytes or `url` is not on the
+        device's host (redirects are not followed either).
+        '''
+        url = urljoin(self._base_api_uri, url)
+        if urlparse(url).hostname != urlparse(self._base_api_uri).hostname:
+            raise DeviceError('The resource is not served by the device.')
+        try:
+            with self.session.get(url, timeout=self.timeout, stream=True, allow_redirects=False) as response:
+                if response.status_code != 200:
+                    raise DeviceError(
+                        f'Got an unexpected response {response.status_code} {response.reason} from the device.')
+                content = response.raw.read(max_size + 1, decode_content=True)
+                content_type = response.headers.get('Content-Type', 'application/octet-stream')
+        except (RequestException, TransportError) as e:
+            raise DeviceConnectionError(f'Unable to reach the device: {e}')
+        if len(content) > max_size:
+            raise DeviceError('The resource is too large.')
+        return content_type, content
+
     @lock_cached(ttl=15)
     def list_files(self, location='local'):
         return self._get(urljoin('files/', location))
@@ -107,35 +274,52 @@ class OctoprintClient(object):
     def upload_file(self, filename, location='local', foldername=None, start_print=False):
         '''
         Upload file to location.
+        Raises ConflictError if the file already exists.
+        '''
+        with open(filename, 'rb') as file:
+            return self.upload_stream(
+                file, os.path.basename(filename),
+                location=location, foldername=foldername, start_print=start_print,
+            )
+
+    def upload_stream(self, file, filename, location='local', foldername=None, start_print=False, callback=None):
+        '''
+        Uploads content of open binary `file` as `filename` to location.
+
+        The multipart body is streamed from `file` in chunks of
+        `OCTOPRINT_UPLOAD_CHUNK_SIZE` bytes, so memory use does not depend on
+        the size of the file. See `ChunkedBody` for `callback`.
+
         Raises ConflictError if the file already exists.
         '''
         path = urljoin('files/', location)
-        form_data = {}
+        fields = [('print', str(start_print).lower())]
         if foldername:
-            form_data['foldername'] = {None: foldername}
-        if print:
-            form_data['print'] = str(start_print).lower()
-        with open(filename, 'rb') as file:
-            form_data['file'] = file
-            response = self._post(path, files=form_data)
-        self.list_files.invalidate_cache(location=location)
-        return response
+            fields.append(('foldername', foldername))
+        fields.append(('file', (filename, file, 'application/octet-stream')))
+        encoder = MultipartEncoder(fields=fields)
+        body = ChunkedBody(encoder, settings.OCTOPRINT_UPLOAD_CHUNK_SIZE, callback)
+        try:
+            return self._post(path, data=body, headers={'Content-Type': encoder.content_type})
+        finally:
+            self.list_files.invalidate_cache(location=location)
 
     def delete_file(self, filepath, location='local'):
         '''
         Deletes file on `filepath` from the device.
         Raises ConflictError if the file is being printed currently.
         '''
-        response = delete(urljoin('files/', location, filepath))
+        response = self._make_request('delete', 'files/%s/%s' % (location, filepath.lstrip('/')))
         self.list_files.invalidate_cache(location=location)
         return response
 
-    def print_file(self, filename):
+    def print_file(self, filepath, location='local'):
         '''
-        Prints previously uploaded file
+        Prints previously uploaded file on `filepath`.
+        Raises ConflictError if the printer is not ready (e.g. already printing).
         '''
-        path = urljoin('files/', filepath)
-        data={'command': 'select', 'print': True}
+        path = 'files/%s/%s' % (location, filepath.lstrip('/'))
+        data = {'command': 'select', 'print': True}
         return self._post(path, json=data)
 
     @lock_cached(ttl=5)
@@ -145,3 +329,28 @@ class OctoprintClient(object):
             return self._get('printer', history=history)
         except ConflictError as e:
             raise PrinterNotOperationalError(e)
+
+
+_clients = OrderedDict()
+_clients_lock = Lock()
+
+
+def get_client(api_uri, api_key=None):
+    '''
+    Returns `OctoprintClient` for `api_uri` and `api_key` from per-process registry.
+
+    The registry keeps at most `OCTOPRINT_CLIENTS_LIMIT` clients, the least
+    recently used ones are dropped. They are not closed - another thread might
+    still be using them, their pooled connections are closed once the client is
+    garbage collected.
+    '''
+    key = (api_uri, api_key)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = OctoprintClient(api_uri=api_uri, api_key=api_key)
+            while len(_clients) > settings.OCTOPRINT_CLIENTS_LIMIT:
+                _clients.popitem(last=False)
+        else:
+            _clients.move_to_end(key)
+    return client
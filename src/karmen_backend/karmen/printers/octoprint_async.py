@@ -0,0 +1,180 @@
+'''
+Asynchronous (asyncio) twin of `printers.octoprint.OctoprintClient`
+
+The client has the same methods and raises the same `DeviceError` exceptions as
+the synchronous client, but it does not block the thread while waiting for the
+device. It is meant to be used from async views served under ASGI (see
+`printers.async_views`) where a single process can keep many device requests
+in flight.
+
+All clients running in the same event loop share one `aiohttp.ClientSession`
+and thus one pool of keep-alive connections. Device calls have to be made
+within `session_scope` - the session is closed at the end of the last open
+scope, unless the loop is long-lived and keeps the session (`keep_session`)
+until it shuts down (`close_session`). Under WSGI every async view runs in its
+own short-lived event loop, so the connections are reused only when served by
+an ASGI server (see `karmen.asgi`) or by the poller.
+'''
+import asyncio
+from contextlib import asynccontextmanager
+from urllib.parse import urljoin
+from weakref import WeakKeyDictionary, WeakSet
+import aiohttp
+from django.conf import settings
+from printers.octoprint import (
+    parse_response, DeviceConnectionError, ConflictError, PrinterNotOperationalError,
+)
+
+
+RETRY_STATUSES = (502, 503, 504)
+'''http statuses worth retrying (same as the synchronous client)'''
+IDEMPOTENT_METHODS = ('get', 'head', 'put', 'delete', 'options')
+
+_sessions = WeakKeyDictionary()
+'''{event loop: aiohttp.ClientSession}'''
+_scopes = WeakKeyDictionary()
+'''{event loop: number of open `session_scope` blocks}'''
+_kept = WeakSet()
+'''long-lived event loops keeping their session between scopes'''
+
+
+def get_session():
+    '''
+    returns `aiohttp.ClientSession` shared by all clients in the running event loop
+    (to be used within `session_scope`)
+    '''
+    loop = asyncio.get_event_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=settings.OCTOPRINT_MAX_CONCURRENCY,
+            limit_per_host=settings.OCTOPRINT_POOL_SIZE,
+        )
+        timeout = aiohttp.ClientTimeout(
+            sock_connect=settings.OCTOPRINT_CONNECT_TIMEOUT,
+            sock_read=settings.OCTOPRINT_READ_TIMEOUT,
+        )
+        session = _sessions[loop] = aiohttp.ClientSession(connector=connector, timeout=timeout)
+    return session
+
+
+def keep_session():
+    '''keeps the session of the running (long-lived) event loop open until `close_session`'''
+    _kept.add(asyncio.get_event_loop())
+
+
+async def close_session():
+    '''closes the session of the running event loop (if any)'''
+    loop = asyncio.get_event_loop()
+    _kept.discard(loop)
+    session = _sessions.pop(loop, None)
+    if session is not None:
+        await session.close()
+
+
+@asynccontextmanager
+async def session_scope():
+    '''
+    block of device calls (e.g. of a single request), the session is closed at
+    the end of the last open block unless the event loop keeps it
+    '''
+    loop = asyncio.get_event_loop()
+    _scopes[loop] = _scopes.get(loop, 0) + 1
+    try:
+        yield
+    finally:
+        _scopes[loop] -= 1
+        if not _scopes[loop] and loop not in _kept:
+            await close_session()
+
+
+class AsyncOctoprintClient(object):
+    '''
+    Octoprint client for asyncio
+
+    Usage:
+
+        api = AsyncOctoprintClient(api_uri, api_key)
+        async with session_scope():
+            version = await api.get_version()
+    '''
+
+    def __init__(self, api_uri, api_key=None):
+        self._base_api_uri = '%s/' % api_uri.rstrip('/')
+        '''uri to the base endpoint of octoprint API'''
+        self.api_key = api_key
+        '''api key needed to access Octoprint server'''
+
+    async def _make_request(self, method, path, **kwargs):
+        '''
+        Performs request to configured device api, see
+        `OctoprintClient._make_request`.
+
+        Idempotent requests are retried `OCTOPRINT_RETRIES` times on
+        connection errors and gateway errors with exponential backoff.
+        '''
+        path = path.lstrip('/')
+        url = urljoin(self._base_api_uri, path)
+        params = kwargs.pop('params', {})
+        if self.api_key:
+            params['apikey'] = self.api_key
+        retries = settings.OCTOPRINT_RETRIES if method in IDEMPOTENT_METHODS else 0
+        attempt = 0
+        while True:
+            try:
+                async with get_session().request(method, url, params=params, **kwargs) as response:
+                    if response.status not in RETRY_STATUSES or attempt >= retries:
+                        content = await response.read()
+                        return parse_response(response.status, response.reason, content)
+            except asyncio.TimeoutError:
+                if attempt >= retries:
+                    raise DeviceConnectionError('Unable to reach the device: the connection timed out.')
+            except aiohttp.ClientError as e:
+                if attempt >= retries:
+                    raise DeviceConnectionError(f'Unable to reach the device: {e}')
+            await asyncio.sleep(settings.OCTOPRINT_RETRY_BACKOFF * (2 ** attempt) if attempt else 0)
+            attempt += 1
+
+    async def _get(self, path, **kwargs):
+        '''Shortcut to GET HTTP method (protected), kwargs are used as query params'''
+        return await self._make_request('get', path, params=kwargs)
+
+    async def _post(self, path, **kwargs):
+        '''Shortcut to POST HTTP method (protected)'''
+        return await self._make_request('post', path, **kwargs)
+
+    async def get_version(self):
+        return await self._get('version')
+
+    async def get_connection(self):
+        return await self._get('connection')
+
+    async def get_job(self):
+        return await self._get('job')
+
+    async def get_settings(self):
+        return await self._get('settings')
+
+    async def list_files(self, location='local'):
+        return await self._get(urljoin('files/', location))
+
+    async def upload_file(self, filename, location='local', foldername=None, start_print=False):
+        '''
+        Upload file to location.
+        Raises ConflictError if the file already exists.
+        '''
+        path = urljoin('files/', location)
+        with open(filename, 'rb') as file:
+            form_data = aiohttp.FormData()
+            if foldername:
+                form_data.add_field('foldername', foldername)
+            form_data.add_field('print', str(start_print).lower())
+            form_data.add_field('file', file)
+            return await self._post(path, data=form_data)
+
+    async def get_printer(self, history=False):
+        history = str(history).lower()
+        try:
+            return await self._get('printer', history=history)
+        except ConflictError as e:
+            raise PrinterNotOperationalError(e)
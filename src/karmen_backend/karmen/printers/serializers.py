@@ -1,13 +1,14 @@
-from urllib.parse import urlparse, parse_qsl
+from django.db.models import Manager
 from django.urls import reverse
 from rest_framework import serializers, exceptions
 from django.shortcuts import get_object_or_404
 from django.utils.functional import cached_property
 from karmen import ROLE_ADMIN
+from karmen.access import get_access
 from karmen.serializers import RelatedModelField, IdField, KarmenHyperlinkedModelSerializer, KarmenModelSerializer
 from printers import models
 from users.models import User
-from printers.octoprint import OctoprintClient, DeviceError, PrinterNotOperationalError
+from printers.status import get_device_states
 
 
 class UserOnPrinterSerializer(KarmenHyperlinkedModelSerializer):
@@ -22,7 +23,7 @@ class UserOnPrinterSerializer(KarmenHyperlinkedModelSerializer):
     def get_url(self, user_on_printer):
         url = reverse('printer-user-detail', kwargs={
             'username': user_on_printer.user.username,
-            'printer_id': user_on_printer.printer.pk
+            'printer_id': user_on_printer.printer_id,
         })
         return self.context['request'].build_absolute_uri(url)
 
@@ -50,8 +51,8 @@ class GroupsOnPrinterSerializer(KarmenModelSerializer):
 
     def get_url(self, value):
         url = reverse('group-printer-detail', kwargs={
-            'group_id': value.group.id,
-            'printer_id': value.printer.id,
+            'group_id': value.group_id,
+            'printer_id': value.printer_id,
         })
         return self.context['request'].build_absolute_uri(url)
 
@@ -86,10 +87,9 @@ class PrinterInGroupSerializer(KarmenModelSerializer):
         }
 
     def get_url(self, value):
-        printer_id = value.printer_id
         url = reverse('group-printer-detail', kwargs={
-            'group_id': value.group.id,
-            'printer_id': value.printer.id,
+            'group_id': value.group_id,
+            'printer_id': value.printer_id,
         })
         return self.context['request'].build_absolute_uri(url)
 
@@ -98,7 +98,7 @@ class PrinterInGroupSerializer(KarmenModelSerializer):
             printer = models.Printer.objects.get(pk=value)
         except models.Printer.DoesNotExist:
             raise exceptions.ValidationError(f"Printer '{value}' does not exist.")
-        if not printer.can_modify(self.context['request'].user):
+        if not get_access(self.context['request']).can_modify(printer):
             raise exceptions.ValidationError(f"Printer '{value}' is not accessible.")
         return printer
 
@@ -111,45 +111,44 @@ class PrinterInGroupSerializer(KarmenModelSerializer):
 
 
 class OctoprintSerializer(serializers.BaseSerializer):
+    '''
+    Current state of the printer device (see `printers.status`).
+
+    When used in a list of printers (see `PrinterListSerializer`), the states
+    of all printers are read at once and stored to `prefetched`.
+    '''
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.prefetched = {}
+        '''device states by printer id (filled by list serializer)'''
+
+    def to_representation(self, printer):
+        if printer.pk not in self.prefetched:
+            self.prefetched.update(get_device_states([printer]))
+        return self.prefetched[printer.pk]
+
 
-    def get_api(self, connection_string):
-        # FIXME: this is development verison, the printer will be connected
-        # through websocket proxy server in real application
-        parts = urlparse(connection_string)
-        api_key = dict(parse_qsl(parts.query)).get('apikey')
-        return OctoprintClient(api_uri=connection_string, api_key=api_key)
-
-    def to_representation(self, value):
-        if value.startswith('http'):
-            try:
-                api = self.get_api(value)
-                response = {
-                    'version': api.get_version(),
-                    'files': api.list_files(),
-                }
-                try:
-                    response['printer'] = api.get_printer()
-                except PrinterNotOperationalError as e:
-                    response['printer'] = None
-            except DeviceError as e:
-                return {
-                    'error': str(e),
-                }
-        else:
-            response = {
-                'error': 'Missing connection information. Set api_key.'
-            }
-        return response
+class PrinterListSerializer(serializers.ListSerializer):
+    '''
+    Reads device states of all printers in the list at once before they are
+    serialized one by one.
+    '''
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, Manager) else data
+        octoprint = self.child.fields.get('octoprint')
+        if octoprint is not None:
+            iterable = list(iterable)
+            octoprint.prefetched = get_device_states(iterable)
+        return super().to_representation(iterable)
 
 
 class PrinterSerializer(KarmenHyperlinkedModelSerializer):
 
     users = UserOnPrinterSerializer(many=True, source='useronprinter_set', read_only=True)
     groups = GroupsOnPrinterSerializer(many=True, read_only=True, source='printeringroup_set')
-    octoprint =  OctoprintSerializer(read_only=True, source='api_key')
+    octoprint =  OctoprintSerializer(read_only=True, source='*')
 
     class Meta:
         model = models.Printer
@@ -157,8 +156,28 @@ class PrinterSerializer(KarmenHyperlinkedModelSerializer):
         optional_fields = ['api_key', 'octoprint', 'users', 'groups', ]
         optional_fields_retrieve = ['octoprint', ]
         read_only_fields = ['id']
+        list_serializer_class = PrinterListSerializer
 
     def create(self, validated_data):
         printer = models.Printer.objects.create(**validated_data)
         printer.set_user(self.context['request'].user, ROLE_ADMIN)
         return printer
+
+
+class FileTransferSerializer(KarmenModelSerializer):
+    '''Read only representation of `models.FileTransfer` (see `printers.transfers`)'''
+
+    url = serializers.HyperlinkedIdentityField(view_name='transfer-detail')
+    fileId = serializers.CharField(source='file_id', read_only=True)
+    printerId = serializers.CharField(source='printer_id', read_only=True)
+    startPrint = serializers.BooleanField(source='start_print', read_only=True)
+    createdOn = serializers.DateTimeField(source='created_on', read_only=True)
+    finishedOn = serializers.DateTimeField(source='finished_on', read_only=True)
+
+    class Meta:
+        model = models.FileTransfer
+        fields = [
+            'id', 'url', 'fileId', 'printerId', 'startPrint', 'state', 'size', 'sent',
+            'cancelled', 'error', 'createdOn', 'finishedOn',
+        ]
+        read_only_fields = fields
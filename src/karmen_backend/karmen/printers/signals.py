@@ -0,0 +1,117 @@
+'''
+Keeps `PrinterAccess` in sync with the relationship tables
+
+Every change of `UserOnPrinter`, `groups.UserInGroup` or `PrinterInGroup`
+(including bulk `add` of many-to-many managers which does not send `post_save`)
+refreshes access rows of the affected users and printers only.
+
+Bulk operations (see `printers.bulk`) wrap their writes in
+`deferred_access_refresh` so that the rows are refreshed once per batch
+instead of once per deleted relationship.
+
+Versions of access of the affected users (see `karmen.versions`) are touched
+along with every refresh.
+'''
+from contextlib import contextmanager
+from threading import local
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from groups.models import UserInGroup
+from karmen.models import join_id
+from karmen.versions import touch_access
+from printers.models import PrinterAccess, PrinterInGroup, UserOnPrinter
+
+
+_deferred = local()
+'''`pending` - [user ids, printer ids, {group id: member ids}] of the deferred refresh of the thread'''
+
+
+def users_in_groups(group_ids):
+    pending = getattr(_deferred, 'pending', None)
+    if pending is None:
+        return UserInGroup.objects.filter(group_id__in=group_ids).values_list('user_id', flat=True)
+    # many relationships of the same groups are deleted in a batch, query their members just once
+    members = pending[2]
+    missing = [join_id(group_id) for group_id in group_ids if join_id(group_id) not in members]
+    if missing:
+        for group_id in missing:
+            members[group_id] = []
+        for group_id, user_id in UserInGroup.objects.filter(group_id__in=missing).values_list('group_id', 'user_id'):
+            members[join_id(group_id)].append(user_id)
+    return [user_id for group_id in group_ids for user_id in members[join_id(group_id)]]
+
+
+def printers_in_groups(group_ids):
+    return PrinterInGroup.objects.filter(group_id__in=group_ids).values_list('printer_id', flat=True)
+
+
+def refresh_access(user_ids, printer_ids):
+    '''refreshes `PrinterAccess` of `user_ids` x `printer_ids` (at the end of `deferred_access_refresh`)'''
+    pending = getattr(_deferred, 'pending', None)
+    if pending is None:
+        user_ids = list(user_ids)
+        PrinterAccess.refresh(user_ids, printer_ids)
+        touch_access(user_ids)
+    else:
+        pending[0].update(join_id(user_id) for user_id in user_ids)
+        pending[1].update(join_id(printer_id) for printer_id in printer_ids)
+
+
+@contextmanager
+def deferred_access_refresh():
+    '''
+    Collects refreshes requested by the signals within the block and runs a
+    single refresh of all the collected users x printers when it exits
+    (nested blocks are merged into the outer one).
+    '''
+    if getattr(_deferred, 'pending', None) is not None:
+        yield
+        return
+    _deferred.pending = pending = [set(), set(), {}]
+    try:
+        yield
+    finally:
+        _deferred.pending = None
+    PrinterAccess.refresh(pending[0], pending[1])
+    touch_access(pending[0])
+
+
+@receiver(post_save, sender=UserOnPrinter)
+@receiver(post_delete, sender=UserOnPrinter)
+def user_on_printer_changed(sender, instance, **kwargs):
+    refresh_access([instance.user_id], [instance.printer_id])
+
+
+@receiver(post_save, sender=UserInGroup)
+@receiver(post_delete, sender=UserInGroup)
+def user_in_group_changed(sender, instance, **kwargs):
+    refresh_access([instance.user_id], printers_in_groups([instance.group_id]))
+
+
+@receiver(post_save, sender=PrinterInGroup)
+@receiver(post_delete, sender=PrinterInGroup)
+def printer_in_group_changed(sender, instance, **kwargs):
+    refresh_access(users_in_groups([instance.group_id]), [instance.printer_id])
+
+
+@receiver(m2m_changed, sender=UserOnPrinter)
+@receiver(m2m_changed, sender=UserInGroup)
+@receiver(m2m_changed, sender=PrinterInGroup)
+def relationships_added(sender, instance, action, reverse, model, pk_set, **kwargs):
+    '''
+    `add` creates the relationships by `bulk_create` - refresh them here.
+    (`remove` and `clear` delete them one by one and thus send `post_delete`.)
+    '''
+    if action != 'post_add' or not pk_set:
+        return
+    # `reverse` is False for managers of the model declaring the field (e.g. `printer.groups`)
+    source_ids, target_ids = [instance.pk], list(pk_set)
+    if sender is UserOnPrinter:
+        printer_ids, user_ids = (target_ids, source_ids) if reverse else (source_ids, target_ids)
+    elif sender is UserInGroup:
+        group_ids, user_ids = (target_ids, source_ids) if reverse else (source_ids, target_ids)
+        printer_ids = printers_in_groups(group_ids)
+    else:
+        printer_ids, group_ids = (target_ids, source_ids) if reverse else (source_ids, target_ids)
+        user_ids = users_in_groups(group_ids)
+    refresh_access(user_ids, printer_ids)
@@ -0,0 +1,220 @@
+'''
+Printer status snapshots
+
+The state of printer devices is refreshed in background by the `poll_printers`
+management command which stores a compact snapshot of each printer to the
+cache configured by `PRINTER_STATUS_CACHE`. Reading the state of printers is
+then a single cache round trip regardless of how many printers are read or how
+slow the devices are.
+
+Snapshot is the same dict as the device representation (see
+`device_query`) extended by:
+
+- `job` - current print job
+- `connection` - connection of the device to the printer
+- `lastSeen` - ISO timestamp of the last successful contact with the device
+  (None if the device was never reached)
+- `polledOn` - ISO timestamp of the snapshot
+- `statusVersion` - version of the status document (see below)
+
+Status documents are versioned - the version is a digest of the snapshot
+without `VOLATILE_KEYS`, it changes only when the state of the printer does.
+The last `PRINTER_STATUS_HISTORY_LENGTH` versions of a printer's document are
+kept in a single history entry of the printer so that clients knowing an older
+version can be sent just a JSON merge patch of what changed since
+(`diff_state`). A document of several printers `{printer id: state}` of a user
+is versioned the same way - its version is the digest of the versions of the
+printers and the last versions are kept in a history entry of the user
+(`get_versioned`).
+'''
+import hashlib
+import json
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from karmen.models import join_id
+from printers.device_query import query_devices
+
+
+STATUS_KEY_PREFIX = 'printer-status-'
+HISTORY_KEY_PREFIX = 'printer-status-history-'
+USER_HISTORY_KEY_PREFIX = 'printer-status-user-history-'
+NOT_POLLED_ERROR = 'The printer was not polled yet.'
+VOLATILE_KEYS = ('polledOn', 'lastSeen')
+'''keys of snapshot changed by every poll'''
+VERSION_KEY = 'statusVersion'
+'''key of the version of the status document (`version` holds the version of Octoprint)'''
+
+
+def get_cache():
+    return caches[settings.PRINTER_STATUS_CACHE]
+
+
+def status_key(printer_id):
+    # ids loaded from db are formatted (see `karmen.models.IdField`)
+    return '%s%s' % (STATUS_KEY_PREFIX, join_id(printer_id))
+
+
+def history_key(printer_id):
+    return '%s%s' % (HISTORY_KEY_PREFIX, join_id(printer_id))
+
+
+def user_history_key(user_id):
+    return '%s%s' % (USER_HISTORY_KEY_PREFIX, join_id(str(user_id)))
+
+
+def _add_version(cache, key, version, document):
+    '''adds `version` of `document` to history `key` {version: document} keeping the last versions'''
+    history = cache.get(key) or {}
+    history.pop(version, None)
+    history[version] = document
+    for old in list(history)[:-settings.PRINTER_STATUS_HISTORY_LENGTH]:
+        del history[old]
+    cache.set(key, history, timeout=settings.PRINTER_STATUS_HISTORY_TTL)
+
+
+def save_snapshot(printer_id, state, previous=None):
+    '''
+    Stores device `state` (see `device_query`) of printer `printer_id` as its
+    snapshot and returns it.
+
+    `lastSeen` is taken over from `previous` snapshot if the device was not
+    reached this time.
+    '''
+    now = timezone.now().isoformat()
+    snapshot = dict(state)
+    snapshot['polledOn'] = now
+    if state.keys() == {'error'}:
+        snapshot['lastSeen'] = previous.get('lastSeen') if previous else None
+    else:
+        snapshot['lastSeen'] = now
+    snapshot[VERSION_KEY] = document_version(snapshot)
+    cache = get_cache()
+    if not previous or previous.get(VERSION_KEY) != snapshot[VERSION_KEY]:
+        # (the base of patches for clients which got this version)
+        _add_version(cache, history_key(printer_id), snapshot[VERSION_KEY], snapshot)
+    cache.set(status_key(printer_id), snapshot, timeout=settings.PRINTER_STATUS_TTL)
+    return snapshot
+
+
+def document_version(document):
+    '''digest of `document` (dict, `VOLATILE_KEYS` and `VERSION_KEY` aside)'''
+    stable = {key: value for key, value in document.items() if key not in VOLATILE_KEYS and key != VERSION_KEY}
+    encoded = json.dumps(stable, sort_keys=True, separators=(',', ':'), default=str).encode()
+    return hashlib.sha1(encoded).hexdigest()[:20]
+
+
+def get_version(state):
+    '''version of status document `state` (computed for states which are not snapshots, e.g. live ones)'''
+    return state.get(VERSION_KEY) or document_version(state)
+
+
+def get_snapshot(printer_id):
+    '''returns snapshot of printer `printer_id` or None when not available'''
+    return get_cache().get(status_key(printer_id))
+
+
+def get_snapshots(printer_ids):
+    '''returns dict {printer_id: snapshot} of all available snapshots (single cache round trip)'''
+    keys = {status_key(printer_id): printer_id for printer_id in printer_ids}
+    return {
+        keys[key]: snapshot
+        for key, snapshot in get_cache().get_many(keys.keys()).items()
+    }
+
+
+def get_device_states(printers):
+    '''
+    Returns dict {printer.pk: state} for `printers`.
+
+    Snapshots are used when available. Printers which were not polled yet are
+    queried directly when `PRINTER_STATUS_LIVE_FALLBACK` is set.
+    '''
+    states = get_snapshots([printer.pk for printer in printers])
+    missing = [printer for printer in printers if printer.pk not in states]
+    if missing and settings.PRINTER_STATUS_LIVE_FALLBACK:
+        live = query_devices([printer.api_key for printer in missing])
+        for printer in missing:
+            states[printer.pk] = live[printer.api_key]
+    else:
+        for printer in missing:
+            states[printer.pk] = {'error': NOT_POLLED_ERROR}
+    return states
+
+
+def same_state(snapshot, other):
+    '''whether the snapshots describe the same state of the printer (`VOLATILE_KEYS` aside)'''
+    if snapshot is None or other is None:
+        return snapshot is other
+    return all(snapshot.get(key) == other.get(key) for key in snapshot.keys() | other.keys() if key not in VOLATILE_KEYS)
+
+
+def merge_patch(old, new):
+    '''
+    JSON merge patch (RFC 7386) turning dict `old` into dict `new` - changed
+    keys only, removed keys are `None` (keys with `None` value in `new` are
+    thus removed by the patch, which is equivalent for the snapshots).
+    '''
+    patch = {}
+    for key in old.keys() - new.keys():
+        patch[key] = None
+    for key, value in new.items():
+        if key not in old:
+            patch[key] = value
+        elif old[key] != value:
+            if isinstance(value, dict) and isinstance(old[key], dict):
+                patch[key] = merge_patch(old[key], value)
+            else:
+                patch[key] = value
+    return patch
+
+
+def get_versioned(user_id, states):
+    '''
+    Returns version of document `states` {printer_id: state} (see
+    `get_device_states`) of user `user_id` and adds the versions of its
+    printers to the history of the user.
+    '''
+    versions = {str(printer_id): get_version(state) for printer_id, state in states.items()}
+    version = hashlib.sha1(json.dumps(versions, sort_keys=True).encode()).hexdigest()[:20]
+    cache = get_cache()
+    history = cache.get(user_history_key(user_id)) or {}
+    if version not in history:
+        _add_version(cache, user_history_key(user_id), version, versions)
+    return version
+
+
+def diff_state(printer_id, since, state):
+    '''
+    Returns JSON merge patch turning version `since` of status document of
+    printer `printer_id` into `state`, None if that version is not known
+    (anymore).
+    '''
+    previous = (get_cache().get(history_key(printer_id)) or {}).get(since)
+    if previous is None:
+        return None
+    return merge_patch(previous, state)
+
+
+def diff_states(user_id, since, states):
+    '''
+    Returns JSON merge patch turning version `since` of document `states`
+    {printer_id: state} of user `user_id` (see `get_versioned`) into
+    `states`, None if that version is not known (anymore).
+    '''
+    cache = get_cache()
+    previous = (cache.get(user_history_key(user_id)) or {}).get(since)
+    if previous is None:
+        return None
+    current = {str(printer_id): state for printer_id, state in states.items()}
+    patch = {printer_id: None for printer_id in previous.keys() - current.keys()}
+    changed = {
+        printer_id: state for printer_id, state in current.items()
+        if previous.get(printer_id) != get_version(state)
+    }
+    keys = {history_key(printer_id): printer_id for printer_id in changed if printer_id in previous}
+    histories = {keys[key]: history for key, history in cache.get_many(keys).items()}
+    for printer_id, state in changed.items():
+        base = histories.get(printer_id, {}).get(previous.get(printer_id))
+        patch[printer_id] = merge_patch(base, state) if base is not None else state
+    return patch
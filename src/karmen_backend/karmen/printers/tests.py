@@ -1,3 +1,884 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+from unittest.mock import patch
+from http.server import HTTPServer, ThreadingHTTPServer, BaseHTTPRequestHandler
+from tempfile import TemporaryDirectory
+from threading import Thread
+from time import sleep, monotonic
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from PIL import Image
+from karmen import ROLE_ADMIN, ROLE_USER
+from karmen.tests import ConstantQueriesMixin
+from karmen.models import join_id
+from users.models import User
+from groups.models import Group
+from files.models import File
+from printers.models import (
+    Printer, PrinterAccess, FileTransfer, TRANSFER_DONE, TRANSFER_CANCELLED, TRANSFER_FAILED, TRANSFER_SENDING,
+)
+from printers.status import save_snapshot, merge_patch, history_key, get_device_states, NOT_POLLED_ERROR
+from printers.status import get_snapshot as get_status_snapshot
+from printers.events import StatusHub
+from karmen.management.commands.poll_printers import Poller, next_interval
+from printers.transfers import run_transfer, INTERRUPTED_ERROR
+from printers.device_query import query_devices, get_api, MISSING_CONNECTION_ERROR
+from printers.octoprint import get_client, call_deadline, OctoprintClient, DeviceError, DeviceConnectionError
+from printers.webcam import get_snapshot, device_url, Snapshot, FOREIGN_WEBCAM_ERROR
+from printers import octoprint_async
+from printers.octoprint_async import close_session
+from karmen.asgi import application
 
-# Create your tests here.
+
+class PrinterAccessTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user@example.com')
+        self.other = User.objects.create_user(username='other@example.com')
+        self.printer = Printer.objects.create(name='printer')
+        self.group = Group.objects.create(name='group')
+
+    def access(self):
+        '''{(user_id, printer_id): role} stored in the table'''
+        return {
+            (join_id(user_id), join_id(printer_id)): role
+            for user_id, printer_id, role
+            in PrinterAccess.objects.values_list('user_id', 'printer_id', 'role')
+        }
+
+    def assertInSync(self):
+        self.assertEqual(self.access(), PrinterAccess.compute())
+
+    def role(self, user, printer):
+        return self.access().get((join_id(user.pk), join_id(printer.pk)))
+
+    def test_direct_access(self):
+        self.printer.set_user(self.user, ROLE_USER)
+        self.assertEqual(self.role(self.user, self.printer), ROLE_USER)
+        self.printer.set_user(self.user, ROLE_ADMIN)
+        self.assertEqual(self.role(self.user, self.printer), ROLE_ADMIN)
+        self.printer.set_user(self.user, None)
+        self.assertIsNone(self.role(self.user, self.printer))
+        self.assertInSync()
+
+    def test_access_through_group(self):
+        self.group.set_user(self.user, ROLE_USER)
+        self.group.printers.add(self.printer)
+        self.assertEqual(self.role(self.user, self.printer), ROLE_USER)
+        self.group.set_user(self.other, ROLE_ADMIN)
+        self.assertEqual(self.role(self.other, self.printer), ROLE_ADMIN)
+        self.printer.set_user(self.user, ROLE_ADMIN)
+        self.printer.set_user(self.other, ROLE_USER)
+        self.assertEqual(self.role(self.user, self.printer), ROLE_ADMIN)
+        self.assertEqual(self.role(self.other, self.printer), ROLE_ADMIN)
+        self.assertInSync()
+        self.group.set_user(self.other, None)
+        self.assertEqual(self.role(self.other, self.printer), ROLE_USER)
+        self.printer.groups.remove(self.group)
+        self.assertEqual(self.access(), {(join_id(self.user.pk), join_id(self.printer.pk)): ROLE_ADMIN,
+                                         (join_id(self.other.pk), join_id(self.printer.pk)): ROLE_USER})
+        self.assertInSync()
+
+    def test_deleted_group(self):
+        self.group.set_user(self.user, ROLE_ADMIN)
+        self.printer.groups.add(self.group)
+        self.assertEqual(self.role(self.user, self.printer), ROLE_ADMIN)
+        self.group.delete()
+        self.assertEqual(self.access(), {})
+
+    def test_for_user(self):
+        other_printer = Printer.objects.create(name='other')
+        self.printer.set_user(self.user, ROLE_USER)
+        self.group.set_user(self.user, ROLE_USER)
+        self.group.printers.add(self.printer, other_printer)
+        self.assertEqual(
+            set(Printer.for_user(self.user).values_list('name', flat=True)),
+            {'printer', 'other'},
+        )
+        self.assertFalse(Printer.for_user(self.other).exists())
+
+
+class PrinterQueriesTest(ConstantQueriesMixin, TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user@example.com')
+        self.printer = Printer.objects.create(name='printer')
+        self.printer.set_user(self.user, ROLE_ADMIN)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.count = 0
+
+    def add_rows(self, count):
+        for _ in range(count):
+            self.count += 1
+            user = User.objects.create_user(username='user-%s@example.com' % self.count)
+            group = Group.objects.create(name='group %s' % self.count)
+            group.set_user(self.user, ROLE_USER)
+            printer = Printer.objects.create(name='printer %s' % self.count)
+            printer.set_user(self.user, ROLE_USER)
+            printer.set_user(user, ROLE_USER)
+            printer.groups.add(group)
+            self.printer.set_user(user, ROLE_USER)
+            self.printer.groups.add(group)
+
+    def test_my_printers(self):
+        self.assertConstantQueries('/api/2/users/me/printers/?fields=users,groups')
+
+    def test_printer(self):
+        self.assertConstantQueries('/api/2/printers/%s/' % self.printer.pk)
+
+    def test_printer_users_and_groups(self):
+        self.assertConstantQueries('/api/2/printers/%s/?fields=users,groups' % self.printer.pk)
+
+    def test_printer_users(self):
+        self.assertConstantQueries('/api/2/printers/%s/users/' % self.printer.pk)
+
+    def test_printer_groups(self):
+        self.assertConstantQueries('/api/2/printers/%s/groups/' % self.printer.pk)
+
+
+@override_settings(PRINTER_STATUS_CACHE='default', PRINTER_STATUS_LIVE_FALLBACK=False)
+class PrinterBulkTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user@example.com')
+        self.other = User.objects.create_user(username='other@example.com')
+        self.group = Group.objects.create(name='group')
+        self.group.set_user(self.user, ROLE_ADMIN)
+        self.group.set_user(self.other, ROLE_USER)
+        self.foreign = Printer.objects.create(name='foreign')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def bulk(self, method, url, items):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, items, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        return [result['status'] for result in response.data['results']], len(queries)
+
+    def assertInSync(self):
+        stored = {
+            (join_id(user_id), join_id(printer_id)): role
+            for user_id, printer_id, role in PrinterAccess.objects.values_list('user_id', 'printer_id', 'role')
+        }
+        self.assertEqual(stored, PrinterAccess.compute())
+
+    def test_printers(self):
+        items = [{'name': 'printer %s' % index, 'api_key': 'http://10.0.0.%s/api' % index} for index in range(20)]
+        statuses, queries = self.bulk('post', '/api/2/printers/bulk/', items + [{'api_key': 'no name'}])
+        self.assertEqual(statuses, [201] * 20 + [400])
+        self.assertLess(queries, 15)
+        ids = list(Printer.for_user(self.user).values_list('id', flat=True))
+        self.assertEqual(len(ids), 20)
+        # created printers are represented the same way as by `POST /printers/`
+        created = self.client.post('/api/2/printers/bulk/', items[:1], format='json').data['results'][0]
+        single = self.client.post('/api/2/printers/', items[0], format='json').data
+        self.assertEqual(created.pop('status'), 201)
+        self.assertEqual(created.keys(), single.keys())
+        self.assertEqual(
+            [(user['username'], user['role']) for user in created['users']],
+            [(user['username'], user['role']) for user in single['users']])
+        Printer.objects.filter(pk__in=[created['id'], single['id']]).delete()
+        statuses, queries = self.bulk('patch', '/api/2/printers/bulk/', [
+            {'id': printer_id, 'name': 'renamed'} for printer_id in ids
+        ] + [{'id': self.foreign.pk, 'name': 'renamed'}, {'id': 'missing', 'name': 'renamed'}])
+        self.assertEqual(statuses, [200] * 20 + [404, 404])
+        self.assertLess(queries, 15)
+        self.assertEqual(Printer.objects.filter(name='renamed').count(), 20)
+
+        statuses, queries = self.bulk('post', '/api/2/printers/bulk/users/', [
+            {'printerId': printer_id, 'username': 'other@example.com', 'role': ROLE_USER} for printer_id in ids
+        ] + [{'printerId': ids[0], 'username': 'nobody@example.com', 'role': ROLE_USER}])
+        self.assertEqual(statuses, [200] * 20 + [404])
+        self.assertLess(queries, 15)
+        self.assertEqual(Printer.for_user(self.other).count(), 20)
+        statuses, _ = self.bulk('post', '/api/2/printers/bulk/users/', [
+            {'printerId': printer_id, 'username': 'other@example.com', 'role': None} for printer_id in ids[:10]
+        ])
+        self.assertEqual(Printer.for_user(self.other).count(), 10)
+        self.assertInSync()
+
+        statuses, queries = self.bulk('delete', '/api/2/printers/bulk/', [{'id': printer_id} for printer_id in ids])
+        self.assertEqual(statuses, [204] * 20)
+        self.assertFalse(Printer.objects.filter(pk__in=ids).exists())
+        self.assertInSync()
+
+    def test_group_printers(self):
+        printers = [Printer.objects.create(name='printer %s' % index) for index in range(10)]
+        for printer in printers:
+            printer.set_user(self.user, ROLE_ADMIN)
+        url = '/api/2/groups/%s/printers/bulk/' % self.group.pk
+        items = [{'printerId': printer.pk} for printer in printers]
+        statuses, queries = self.bulk('post', url, items + [{'printerId': self.foreign.pk}])
+        self.assertEqual(statuses, [201] * 10 + [404])
+        self.assertLess(queries, 15)
+        self.assertEqual(Printer.for_user(self.other).count(), 10)
+        self.assertEqual(self.bulk('post', url, items[:1])[0], [200])
+        self.assertInSync()
+        statuses, queries = self.bulk('delete', url, items)
+        self.assertEqual(statuses, [204] * 10)
+        self.assertLess(queries, 15)
+        self.assertEqual(Printer.for_user(self.other).count(), 0)
+        self.assertInSync()
+        # group members can not change its printers
+        self.client.force_authenticate(self.other)
+        self.assertEqual(self.client.post(url, items, format='json').status_code, 403)
+
+
+@override_settings(PRINTER_STATUS_CACHE='default', PRINTER_STATUS_LIVE_FALLBACK=False)
+class PrinterStatusTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user@example.com')
+        self.printers = [Printer.objects.create(name='printer %s' % index) for index in range(2)]
+        for printer in self.printers:
+            printer.set_user(self.user, ROLE_USER)
+            printer.refresh_from_db()  # (ids in responses are formatted)
+        self.files = {'files': [{'name': 'file-%s.gcode' % index} for index in range(100)]}
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def poll(self, printer, temperature):
+        return save_snapshot(printer.pk, dict(
+            self.files, version={'server': '1.4.2'}, temperature={'tool0': {'actual': temperature}}))
+
+    def test_printer_status(self):
+        url = '/api/2/printers/%s/status/' % self.printers[0].pk
+        first = self.poll(self.printers[0], 20)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['version'], {'server': '1.4.2'})
+        self.assertEqual(response['ETag'], 'W/"%s"' % first['statusVersion'])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        # polls without a change keep the version
+        self.assertEqual(self.poll(self.printers[0], 20)['statusVersion'], first['statusVersion'])
+        self.assertEqual(self.client.get(url, {'since': first['statusVersion']}).status_code, 304)
+
+        second = self.poll(self.printers[0], 21)
+        response = self.client.get(url, {'since': first['statusVersion']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/merge-patch+json')
+        self.assertEqual(response.data['temperature'], {'tool0': {'actual': 21}})
+        self.assertNotIn('files', response.data)
+        self.assertEqual(response['ETag'], 'W/"%s"' % second['statusVersion'])
+        # unknown versions get the whole document
+        response = self.client.get(url, {'since': 'unknown'})
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIn('files', response.data)
+
+    @override_settings(PRINTER_STATUS_HISTORY_LENGTH=3)
+    def test_history_is_bounded(self):
+        url = '/api/2/printers/%s/status/' % self.printers[0].pk
+        versions = [self.poll(self.printers[0], temperature)['statusVersion'] for temperature in range(5)]
+        history = caches['default'].get(history_key(self.printers[0].pk))
+        self.assertEqual(list(history), versions[-3:])
+        self.assertEqual(self.client.get(url, {'since': versions[2]})['Content-Type'], 'application/merge-patch+json')
+        # dropped versions get the whole document
+        self.assertEqual(self.client.get(url, {'since': versions[1]})['Content-Type'], 'application/json')
+
+    @override_settings(PRINTER_STATUS_LIVE_FALLBACK=True)
+    def test_live_state(self):
+        printer = self.printers[0]
+        printer.api_key = 'http://10.0.0.1/api'
+        printer.save()
+        live = {'version': {'server': '1.4.2'}, 'printer': {'state': {'text': 'Operational'}}}
+        with patch('printers.status.query_devices', side_effect=lambda api_keys: {key: live for key in api_keys}):
+            response = self.client.get('/api/2/printers/%s/status/' % printer.pk)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data['version'], {'server': '1.4.2'})
+            self.assertEqual(self.client.get(
+                '/api/2/printers/%s/status/' % printer.pk, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+            self.assertEqual(self.client.get('/api/2/users/me/printers/status/').status_code, 200)
+
+    def test_my_printers_status(self):
+        url = '/api/2/users/me/printers/status/'
+        self.poll(self.printers[0], 20)
+        response = self.client.get(url)
+        self.assertEqual(set(response.data), set(printer.pk for printer in self.printers))
+        version = response['ETag'][3:-1]
+        self.assertEqual(self.client.get(url, {'since': version}).status_code, 304)
+
+        self.poll(self.printers[0], 21)
+        self.poll(self.printers[1], 30)
+        patch = self.client.get(url, {'since': version}).data
+        self.assertEqual(patch[self.printers[0].pk]['temperature'], {'tool0': {'actual': 21}})
+        self.assertNotIn('files', patch[self.printers[0].pk])
+        # the printer was not polled before, its whole state is sent
+        self.assertEqual(len(patch[self.printers[1].pk]['files']), 100)
+
+
+class OctoprintHandler(BaseHTTPRequestHandler):
+    '''
+    answers like octoprint - `server.responses` {path: (status, json body)},
+    after `server.delay` seconds, requests are recorded in `server.requests`
+    '''
+
+    def respond(self):
+        path = self.path.split('?')[0]
+        self.server.requests.append((self.command, path))
+        sleep(self.server.delay)
+        status, body = self.server.responses.get(path, (404, None))
+        body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = respond
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+def start_device(test, responses=None, delay=0):
+    '''starts `OctoprintHandler` server for `test`, returns it'''
+    server = ThreadingHTTPServer(('127.0.0.1', 0), OctoprintHandler)
+    server.daemon_threads = True
+    server.responses = {
+        '/api/version': (200, {'server': '1.4.2'}),
+        '/api/files/local': (200, {'files': []}),
+        '/api/printer': (200, {'state': {'text': 'Operational'}}),
+    }
+    server.responses.update(responses or {})
+    server.delay = delay
+    server.requests = []
+    Thread(target=server.serve_forever, daemon=True).start()
+    test.addCleanup(server.server_close)
+    test.addCleanup(server.shutdown)
+    server.api_key = 'http://127.0.0.1:%s/api' % server.server_port
+    return server
+
+
+class DeviceQueryTest(SimpleTestCase):
+
+    def test_fan_out(self):
+        ready = start_device(self)
+        disconnected = start_device(self, {
+            '/api/printer': (409, 'Printer is not operational'),
+            '/api/files/local': (500, None),
+        })
+        slow = start_device(self, delay=2)
+        dead = start_device(self)
+        dead.shutdown()
+        dead.server_close()
+        started = monotonic()
+        states = query_devices([ready.api_key, disconnected.api_key, slow.api_key, dead.api_key, ''], deadline=0.5)
+        self.assertLess(monotonic() - started, 1.5)
+        self.assertEqual(states[ready.api_key], {
+            'version': {'server': '1.4.2'}, 'files': {'files': []}, 'printer': {'state': {'text': 'Operational'}},
+        })
+        # partial results
+        self.assertEqual(states[disconnected.api_key]['version'], {'server': '1.4.2'})
+        self.assertIsNone(states[disconnected.api_key]['printer'])
+        self.assertIsNone(states[disconnected.api_key]['files'])
+        self.assertIn('500', states[disconnected.api_key]['error'])
+        # error blocks
+        # (the calls of the slow device time out by themselves at about the same time)
+        self.assertEqual(list(states[slow.api_key]), ['error'])
+        self.assertTrue(states[dead.api_key]['error'].startswith('Unable to reach the device'))
+        self.assertEqual(states[''], {'error': MISSING_CONNECTION_ERROR})
+
+    def test_calls_give_up_at_deadline(self):
+        slow = start_device(self, delay=2)
+        api = get_api(slow.api_key)
+        started = monotonic()
+        with call_deadline(monotonic() + 0.3):
+            with self.assertRaises(DeviceConnectionError):
+                api.get_printer()
+            with self.assertRaises(DeviceConnectionError):
+                api.get_printer()  # (the deadline passed)
+        self.assertLess(monotonic() - started, 1)
+        self.assertEqual(len(slow.requests), 1)  # not retried
+
+
+class OctoprintClientTest(SimpleTestCase):
+
+    @override_settings(OCTOPRINT_CLIENTS_LIMIT=2)
+    def test_registry(self):
+        first = get_client('http://10.0.1.1/api', 'key')
+        self.assertIs(get_client('http://10.0.1.1/api', 'key'), first)
+        other = get_client('http://10.0.1.1/api', 'other')
+        self.assertIsNot(other, first)
+        get_client('http://10.0.1.1/api', 'key')  # (the least recently used is `other` now)
+        with patch.object(OctoprintClient, 'close') as close:
+            get_client('http://10.0.1.2/api')
+        self.assertIs(get_client('http://10.0.1.1/api', 'key'), first)
+        self.assertIsNot(get_client('http://10.0.1.1/api', 'other'), other)
+        # evicted clients might still be used by other threads
+        close.assert_not_called()
+
+    @override_settings(OCTOPRINT_RETRY_BACKOFF=0, OCTOPRINT_POOL_SIZE=3)
+    def test_retries(self):
+        for status in (502, 503, 504):
+            device = start_device(self, {'/api/version': (status, None), '/api/files/local': (status, None)})
+            api = OctoprintClient(device.api_key)
+            self.assertEqual(api.session.get_adapter(device.api_key)._pool_maxsize, 3)
+            with self.assertRaises(DeviceError):
+                api._get('version')
+            self.assertEqual(len(device.requests), 1 + settings.OCTOPRINT_RETRIES)
+            device.requests.clear()
+            with self.assertRaises(DeviceError):
+                api._post('files/local')
+            self.assertEqual(device.requests, [('POST', '/api/files/local')])
+        device = start_device(self, {'/api/version': (500, None)})
+        with self.assertRaises(DeviceError):
+            OctoprintClient(device.api_key)._get('version')
+        self.assertEqual(len(device.requests), 1)
+
+
+@override_settings(PRINTER_STATUS_CACHE='default')
+class PollerTest(TransactionTestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.device = start_device(self, {
+            '/api/printer': (200, {'state': {'text': 'Printing', 'flags': {'printing': True}}}),
+            '/api/job': (200, {'progress': {'completion': 10}}),
+            '/api/connection': (200, {'current': {'state': 'Printing'}}),
+        })
+        self.printing = Printer.objects.create(name='printing', api_key=self.device.api_key)
+        dead = start_device(self)
+        dead.shutdown()
+        dead.server_close()
+        self.unreachable = Printer.objects.create(name='unreachable', api_key=dead.api_key)
+        Printer.objects.create(name='no device')
+        for printer in (self.printing, self.unreachable):
+            printer.refresh_from_db()  # (ids loaded by the poller are formatted)
+
+    def run_poller(self, poller):
+        async def run():
+            try:
+                await poller.run(once=True)
+            finally:
+                await close_session()
+        async_to_sync(run)()
+
+    def test_next_interval(self):
+        printing = {'printer': {'state': {'flags': {'printing': True}}}}
+        self.assertEqual(next_interval(printing, 0), settings.PRINTER_POLL_INTERVAL_ACTIVE)
+        self.assertEqual(next_interval({'printer': None}, 0), settings.PRINTER_POLL_INTERVAL_IDLE)
+        self.assertEqual(next_interval(None, 1), settings.PRINTER_POLL_INTERVAL_IDLE)
+        self.assertEqual(next_interval(None, 2), settings.PRINTER_POLL_INTERVAL_IDLE * 2)
+        self.assertEqual(next_interval(None, 10), settings.PRINTER_POLL_INTERVAL_MAX)
+
+    def test_poll(self):
+        seen = save_snapshot(self.unreachable.pk, {'version': {'server': '1.4.2'}})['lastSeen']
+        poller = Poller()
+        self.run_poller(poller)
+        self.assertEqual(set(poller.printers), {self.printing.pk, self.unreachable.pk})
+
+        snapshot = get_status_snapshot(self.printing.pk)
+        self.assertEqual(snapshot['job'], {'progress': {'completion': 10}})
+        self.assertEqual(snapshot['lastSeen'], snapshot['polledOn'])
+        self.assertNotIn(self.printing.pk, poller.failures)
+        # printing printers are polled often
+        self.assertAlmostEqual(
+            poller.due[self.printing.pk] - monotonic(), settings.PRINTER_POLL_INTERVAL_ACTIVE, delta=1)
+
+        snapshot = get_status_snapshot(self.unreachable.pk)
+        self.assertIn('error', snapshot)
+        # the last contact is kept
+        self.assertEqual(snapshot['lastSeen'], seen)
+        self.assertEqual(poller.failures[self.unreachable.pk], 1)
+        self.assertAlmostEqual(
+            poller.due[self.unreachable.pk] - monotonic(), settings.PRINTER_POLL_INTERVAL_IDLE, delta=1)
+        poller.due[self.unreachable.pk] = monotonic()
+        self.run_poller(poller)
+        self.assertEqual(poller.failures[self.unreachable.pk], 2)
+        # unreachable printers back off
+        self.assertAlmostEqual(
+            poller.due[self.unreachable.pk] - monotonic(), settings.PRINTER_POLL_INTERVAL_IDLE * 2, delta=1)
+        self.assertEqual(get_status_snapshot(self.unreachable.pk)['lastSeen'], seen)
+
+    def test_live_fallback(self):
+        with override_settings(PRINTER_STATUS_LIVE_FALLBACK=False):
+            states = get_device_states([self.printing])
+        self.assertEqual(states[self.printing.pk], {'error': NOT_POLLED_ERROR})
+        self.assertEqual(self.device.requests, [])
+
+        with override_settings(PRINTER_STATUS_LIVE_FALLBACK=True):
+            states = get_device_states([self.printing])
+        self.assertEqual(states[self.printing.pk]['printer']['state']['text'], 'Printing')
+        self.assertTrue(self.device.requests)
+
+        # snapshots are preferred
+        self.device.requests.clear()
+        save_snapshot(self.printing.pk, {'version': {'server': '1.4.2'}})
+        with override_settings(PRINTER_STATUS_LIVE_FALLBACK=True):
+            states = get_device_states([self.printing])
+        self.assertEqual(states[self.printing.pk]['version'], {'server': '1.4.2'})
+        self.assertEqual(self.device.requests, [])
+
+
+class UploadHandler(BaseHTTPRequestHandler):
+    '''accepts uploads like octoprint, the last request body is stored in `server.body`'''
+
+    def do_POST(self):
+        self.server.body = self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+@override_settings(OCTOPRINT_UPLOAD_CHUNK_SIZE=1024, TRANSFER_PROGRESS_INTERVAL=0)
+class FileTransferTest(TestCase):
+
+    def setUp(self):
+        self.media = TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        self.server = HTTPServer(('127.0.0.1', 0), UploadHandler)
+        self.server.body = None
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        self.user = User.objects.create_user(username='user@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        group = Group.objects.create(name='group')
+        group.set_user(self.user, ROLE_USER)
+        self.printers = []
+        for name in ('a', 'b'):
+            printer = Printer.objects.create(name=name, api_key='http://127.0.0.1:%s/api' % self.server.server_port)
+            printer.set_user(self.user, ROLE_USER)
+            self.printers.append(printer)
+        self.content = b'G1 X10 Y10\n' * 1000
+        with self.settings(MEDIA_ROOT=self.media.name):
+            self.file = File.objects.create(
+                name='cube.gcode', file=ContentFile(self.content, name='cube.gcode'), group=group, uploaded_by=self.user,
+            )
+
+    def send(self):
+        response = self.client.post('/api/2/files/%s/send/' % self.file.pk, {
+            'printerIds': [printer.pk for printer in self.printers],
+        }, format='json')
+        self.assertEqual(response.status_code, 202)
+        return [transfer['id'] for transfer in response.json()]
+
+    def test_send(self):
+        transfer_ids = self.send()
+        self.assertEqual(len(transfer_ids), 2)
+        with self.settings(MEDIA_ROOT=self.media.name):
+            run_transfer(transfer_ids[0])
+        transfer = FileTransfer.objects.get(pk=transfer_ids[0])
+        self.assertEqual(transfer.state, TRANSFER_DONE)
+        self.assertEqual(transfer.sent, transfer.size)
+        self.assertEqual(transfer.size, len(self.server.body))
+        self.assertIn(b'filename="cube.gcode"', self.server.body)
+        self.assertIn(self.content, self.server.body)
+
+    def test_cancel(self):
+        transfer_id = self.send()[0]
+        response = self.client.post('/api/2/transfers/%s/cancel/' % transfer_id)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['cancelled'])
+        run_transfer(transfer_id)
+        self.assertEqual(FileTransfer.objects.get(pk=transfer_id).state, TRANSFER_CANCELLED)
+        self.assertIsNone(self.server.body)
+
+    def test_interrupted(self):
+        done, sending = self.send()
+        with self.settings(MEDIA_ROOT=self.media.name):
+            run_transfer(done)
+        FileTransfer.objects.filter(pk=sending).update(state=TRANSFER_SENDING)
+        queued = self.send()
+        call_command('fail_interrupted_transfers')
+        self.assertEqual(FileTransfer.objects.get(pk=done).state, TRANSFER_DONE)
+        interrupted = FileTransfer.objects.filter(pk__in=[sending] + queued)
+        self.assertEqual(len(interrupted), 3)
+        for transfer in interrupted:
+            self.assertEqual((transfer.state, transfer.error), (TRANSFER_FAILED, INTERRUPTED_ERROR))
+            self.assertIsNotNone(transfer.finished_on)
+
+
+class WebcamHandler(BaseHTTPRequestHandler):
+    '''
+    serves octoprint settings, (slow) webcam snapshots and mjpeg stream of 5
+    frames, counts snapshots and streams in `server.snapshots` and `server.streams`
+    '''
+
+    def do_GET(self):
+        if self.path.startswith('/api/settings'):
+            body = json.dumps({
+                'webcam': {'webcamEnabled': True, 'snapshotUrl': '/snapshot', 'streamUrl': self.server.stream_url},
+            }).encode()
+            content_type = 'application/json'
+        elif self.path == '/stream':
+            self.server.streams += 1
+            self.send_response(200)
+            self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=frame')
+            self.end_headers()
+            for index in range(5):
+                sleep(0.1)
+                frame = b'JPEG %d' % index
+                self.wfile.write(b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n%s\r\n' % (
+                    len(frame), frame))
+                self.wfile.flush()
+            self.wfile.write(b'--frame--\r\n')
+            return
+        elif self.path == '/snapshot':
+            self.server.snapshots += 1
+            sleep(0.2)
+            body, content_type = b'JPEG %d' % self.server.snapshots, 'image/jpeg'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+class WebcamSnapshotTest(TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), WebcamHandler)
+        self.server.snapshots = self.server.streams = 0
+        self.server.stream_url = '/stream'
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.user = User.objects.create_user(username='user@example.com')
+        self.printer = Printer.objects.create(name='a', api_key='http://127.0.0.1:%s/api' % self.server.server_port)
+        self.printer.set_user(self.user, ROLE_USER)
+
+    def test_single_fetch(self):
+        snapshots = []
+        threads = [Thread(target=lambda: snapshots.append(get_snapshot(self.printer))) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.server.snapshots, 1)
+        self.assertEqual({snapshot.content for snapshot in snapshots}, {b'JPEG 1'})
+
+    def test_view(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get('/api/2/printers/%s/webcam-snapshot/' % self.printer.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response.content, b'JPEG 1')
+        self.assertEqual(client.get('/api/2/printers/%s/webcam-snapshot/' % self.printer.pk).content, b'JPEG 1')
+        self.assertEqual(self.server.snapshots, 1)
+        offline = Printer.objects.create(name='b', api_key='http://127.0.0.1:1/api')
+        offline.set_user(self.user, ROLE_USER)
+        self.assertEqual(client.get('/api/2/printers/%s/webcam-snapshot/' % offline.pk).status_code, 502)
+
+    def test_device_url(self):
+        self.assertEqual(
+            device_url('http://10.0.0.5/api?apikey=x', 'http://127.0.0.1:8080/?action=snapshot'),
+            'http://10.0.0.5:8080/?action=snapshot',
+        )
+        self.assertEqual(device_url('http://10.0.0.5/api', '/webcam/?action=snapshot'), 'http://10.0.0.5/webcam/?action=snapshot')
+        self.assertEqual(device_url('http://10.0.0.5/api', 'http://10.0.0.5:8080/'), 'http://10.0.0.5:8080/')
+        for url in ('http://169.254.169.254/latest/meta-data/', '//example.com/snapshot', 'file:///etc/passwd'):
+            with self.assertRaises(DeviceError):
+                device_url('http://10.0.0.5/api', url)
+        with self.assertRaises(DeviceError):
+            get_client('http://10.0.0.5/api').get_resource('http://example.com/snapshot', max_size=1)
+
+    def test_thumbnail(self):
+        content = io.BytesIO()
+        Image.new('RGB', (1280, 720), (200, 100, 0)).save(content, 'JPEG')
+        snapshot = Snapshot(content=content.getvalue(), content_type='image/jpeg')
+        for content_type, image_format in (('image/jpeg', 'JPEG'), ('image/webp', 'WEBP')):
+            thumbnail = snapshot.thumbnail((160, 120), content_type)
+            self.assertIs(snapshot.thumbnail((160, 120), content_type), thumbnail)
+            with Image.open(io.BytesIO(thumbnail.content)) as image:
+                self.assertEqual((image.format, image.size), (image_format, (160, 90)))
+        # not an image
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = '/api/2/printers/%s/webcam-snapshot/' % self.printer.pk
+        self.assertEqual(client.get(url, {'size': 'small'}).status_code, 502)
+        self.assertEqual(client.get(url, {'size': 'huge'}).status_code, 400)
+
+
+class WebcamStreamTest(TransactionTestCase):
+    '''(the relay reads the database from another thread)'''
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), WebcamHandler)
+        self.server.snapshots = self.server.streams = 0
+        self.server.stream_url = '/stream'
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.user = User.objects.create_user(username='user@example.com')
+        self.printer = Printer.objects.create(name='a', api_key='http://127.0.0.1:%s/api' % self.server.server_port)
+        self.printer.set_user(self.user, ROLE_USER)
+
+    def scope(self, query_string=b''):
+        return {
+            'type': 'http', 'method': 'GET', 'path': '/api/2/printers/%s/webcam-stream/' % self.printer.pk,
+            'headers': [], 'query_string': query_string,
+        }
+
+    async def watch(self, communicator):
+        '''returns (status, body) of the whole stream'''
+        await communicator.send_input({'type': 'http.request'})
+        start = await communicator.receive_output(5)
+        body = b''
+        while True:
+            message = await communicator.receive_output(5)
+            body += message['body']
+            if not message.get('more_body'):
+                return start['status'], body
+
+    async def watch_twice(self):
+        try:
+            return await asyncio.gather(*(
+                self.watch(ApplicationCommunicator(application, self.scope())) for _ in range(2)
+            ))
+        finally:
+            await close_session()
+
+    def test_relay(self):
+        with patch('printers.webcam_relay.authenticate', return_value=self.user):
+            watched = async_to_sync(self.watch_twice)()
+        for status, body in watched:
+            self.assertEqual(status, 200)
+            self.assertIn(b'JPEG 4', body)
+            self.assertTrue(body.endswith(b'--karmen-frame--\r\n'))
+        self.assertEqual(self.server.streams, 1)
+
+    def test_foreign_stream(self):
+        self.server.stream_url = 'http://169.254.169.254/stream'
+        async def watch():
+            return await self.watch(ApplicationCommunicator(application, self.scope()))
+        with patch('printers.webcam_relay.authenticate', return_value=self.user):
+            status, body = async_to_sync(watch)()
+        self.assertEqual(status, 502)
+        self.assertIn(FOREIGN_WEBCAM_ERROR.encode(), body)
+
+    def test_authentication(self):
+        async def watch():
+            return await self.watch(ApplicationCommunicator(application, self.scope(b'token=invalid')))
+        status, _ = async_to_sync(watch)()
+        self.assertEqual(status, 403)
+
+    def test_session_closed(self):
+        async def watch():
+            status, _ = await self.watch(ApplicationCommunicator(application, self.scope()))
+            return status, asyncio.get_event_loop() in octoprint_async._sessions
+        with patch('printers.webcam_relay.authenticate', return_value=self.user):
+            status, session_open = async_to_sync(watch)()
+        self.assertEqual(status, 200)
+        self.assertFalse(session_open)
+
+    def test_lifespan(self):
+        async def serve():
+            communicator = ApplicationCommunicator(application, {'type': 'lifespan'})
+            await communicator.send_input({'type': 'lifespan.startup'})
+            await communicator.receive_output(5)
+            async with octoprint_async.session_scope():
+                octoprint_async.get_session()
+            kept = asyncio.get_event_loop() in octoprint_async._sessions
+            await communicator.send_input({'type': 'lifespan.shutdown'})
+            self.assertEqual((await communicator.receive_output(5))['type'], 'lifespan.shutdown.complete')
+            return kept, asyncio.get_event_loop() in octoprint_async._sessions
+        self.assertEqual(async_to_sync(serve)(), (True, False))
+
+
+@override_settings(PRINTER_STATUS_CACHE='default', PRINTER_EVENTS_INTERVAL=0.05)
+class PrinterEventsTest(TransactionTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user@example.com')
+        self.printer = Printer.objects.create(name='a', api_key='http://10.0.0.1/api')
+        self.printer.set_user(self.user, ROLE_USER)
+        self.printer.refresh_from_db()  # (ids in events are formatted)
+        Printer.objects.create(name='b', api_key='http://10.0.0.2/api')
+
+    @staticmethod
+    def state(completion):
+        return {'printer': {'state': {'text': 'Printing'}}, 'job': {'progress': {'completion': completion}}}
+
+    @staticmethod
+    def parse(message):
+        name, data = message['body'].decode().strip().split('\n')
+        return name[len('event: '):], json.loads(data[len('data: '):])
+
+    async def stream(self):
+        printer_id = self.printer.pk
+        communicator = ApplicationCommunicator(application, {
+            'type': 'http', 'method': 'GET', 'path': '/api/2/users/me/printers/events/',
+            'headers': [], 'query_string': b'',
+        })
+        await communicator.send_input({'type': 'http.request'})
+        self.assertEqual((await communicator.receive_output(5))['status'], 200)
+        name, data = self.parse(await communicator.receive_output(5))
+        self.assertEqual(name, 'snapshot')
+        self.assertEqual(list(data), [printer_id])
+        self.assertEqual(data[printer_id]['job'], {'progress': {'completion': 10}})
+
+        await sync_to_async(save_snapshot)(printer_id, self.state(20))
+        while True:
+            name, data = self.parse(await communicator.receive_output(5))
+            self.assertEqual(name, 'patch')
+            if 'printer' not in data[printer_id]:
+                break
+        # only the changed keys are sent
+        self.assertEqual(data[printer_id]['job'], {'progress': {'completion': 20}})
+        await communicator.send_input({'type': 'http.disconnect'})
+        await communicator.wait(5)
+
+    def test_events(self):
+        save_snapshot(self.printer.pk, self.state(10))
+        with patch('printers.events.authenticate', return_value=self.user):
+            async_to_sync(self.stream)()
+
+    def test_baseline(self):
+        printer_id = self.printer.pk
+        a = self.state(10)
+        b = dict(self.state(20), temperature={'bed': 60})
+
+        def apply_patch(document, patch):
+            document = dict(document)
+            for key, value in patch.items():
+                if value is None:
+                    document.pop(key, None)
+                elif isinstance(value, dict) and isinstance(document.get(key), dict):
+                    document[key] = apply_patch(document[key], value)
+                else:
+                    document[key] = value
+            return document
+
+        async def watch():
+            hub = StatusHub()
+            hub.subscribers[asyncio.Queue()] = {printer_id}
+            hub.check({printer_id: a})
+            # the cache already has B but the hub did not read it yet
+            save_snapshot(printer_id, b)
+            queue = asyncio.Queue()
+            hub.subscribers[queue] = {printer_id}
+            document = await hub.get_states([printer_id])
+            for state in (b, a):
+                hub.check({printer_id: state})
+                document = apply_patch(document, await queue.get())
+                self.assertEqual(document, {printer_id: state})
+
+        async_to_sync(watch)()
+
+    def test_merge_patch(self):
+        old = {'a': 1, 'b': {'c': 2, 'd': 3}, 'e': 4}
+        new = {'a': 1, 'b': {'c': 5, 'd': 3}, 'f': 6}
+        self.assertEqual(merge_patch(old, new), {'b': {'c': 5}, 'e': None, 'f': 6})
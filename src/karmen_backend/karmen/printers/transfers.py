@@ -0,0 +1,158 @@
+'''
+Sending stored files to printers
+
+`start_transfers` creates a `FileTransfer` for every printer and submits its
+upload to a process-wide thread pool (at most `TRANSFERS_MAX_CONCURRENCY`
+uploads run at the same time). Each upload opens its own handle of the stored
+file and streams it to the device in chunks (see
+`OctoprintClient.upload_stream`) so any number of printers can receive the
+same file at once and memory use does not depend on the file size. Compressed
+files are decompressed on the fly (devices get the plain content).
+
+Progress is written to the transfer row at most every
+`TRANSFER_PROGRESS_INTERVAL` seconds. A transfer is cancelled by setting its
+`cancelled` flag (see `cancel_transfer`) - the upload notices it on the next
+progress update and aborts.
+
+Uploads do not survive a restart of the server - `manage.py
+fail_interrupted_transfers` (run at startup) marks the transfers left
+unfinished as failed.
+'''
+import os
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from threading import Lock
+from time import monotonic
+from django.conf import settings
+from django.db import transaction, close_old_connections
+from django.utils import timezone
+from printers.device_query import get_api, MISSING_CONNECTION_ERROR
+from printers.models import (
+    FileTransfer, TRANSFER_QUEUED, TRANSFER_SENDING, TRANSFER_DONE, TRANSFER_FAILED, TRANSFER_CANCELLED, TRANSFER_FINISHED_STATES,
+)
+from printers.octoprint import DeviceError
+from files.storage import open_blob
+
+
+logger = getLogger()
+
+INTERRUPTED_ERROR = 'The transfer was interrupted by a restart of the server.'
+
+_executor = None
+_executor_lock = Lock()
+
+
+class TransferCancelled(Exception):
+    '''raised from the upload progress callback to abort the upload'''
+
+
+def get_executor():
+    '''thread pool running the uploads of the process'''
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.TRANSFERS_MAX_CONCURRENCY,
+                    thread_name_prefix='file-transfer',
+                )
+    return _executor
+
+
+def start_transfers(file, printers, user, start_print=False):
+    '''
+    Creates transfers of `file` to `printers` and starts them once the
+    current transaction is committed. Returns list of the transfers.
+    '''
+    transfers = []
+    for printer in printers:
+        transfer = FileTransfer.objects.create(file=file, printer=printer, started_by=user, start_print=start_print)
+        transaction.on_commit(lambda transfer_id=transfer.pk: get_executor().submit(run_transfer, transfer_id))
+        transfers.append(transfer)
+    return transfers
+
+
+def cancel_transfer(transfer):
+    '''requests cancellation of `transfer` (queued transfers will not start at all)'''
+    FileTransfer.objects \
+        .filter(pk=transfer.pk) \
+        .exclude(state__in=TRANSFER_FINISHED_STATES) \
+        .update(cancelled=True)
+    transfer.refresh_from_db()
+
+
+class Progress(object):
+    '''
+    Upload callback which stores progress of the transfer and checks its
+    cancellation (both at most once per `TRANSFER_PROGRESS_INTERVAL`).
+    '''
+
+    def __init__(self, transfer):
+        self.transfer = transfer
+        self.updated_on = monotonic()
+
+    def __call__(self, sent, total):
+        now = monotonic()
+        if sent < total and now - self.updated_on < settings.TRANSFER_PROGRESS_INTERVAL:
+            return
+        self.updated_on = now
+        self.transfer.sent = sent
+        self.transfer.size = total
+        FileTransfer.objects.filter(pk=self.transfer.pk).update(sent=sent, size=total)
+        if FileTransfer.objects.filter(pk=self.transfer.pk, cancelled=True).exists():
+            raise TransferCancelled()
+
+
+def _finish(transfer, state, error=''):
+    transfer.state = state
+    transfer.error = error[:255]
+    transfer.finished_on = timezone.now()
+    FileTransfer.objects.filter(pk=transfer.pk).update(
+        state=transfer.state, error=transfer.error, finished_on=transfer.finished_on, sent=transfer.sent,
+    )
+
+
+def run_transfer(transfer_id):
+    '''uploads the file of transfer `transfer_id` to its printer (runs in the thread pool)'''
+    close_old_connections()
+    try:
+        try:
+            transfer = FileTransfer.objects.select_related('file__blob', 'printer').get(pk=transfer_id)
+        except FileTransfer.DoesNotExist:
+            return  # the file or the printer was deleted meanwhile
+        if transfer.cancelled:
+            _finish(transfer, TRANSFER_CANCELLED)
+            return
+        if not transfer.printer.api_key:
+            _finish(transfer, TRANSFER_FAILED, MISSING_CONNECTION_ERROR)
+            return
+        transfer.state = TRANSFER_SENDING
+        FileTransfer.objects.filter(pk=transfer.pk).update(state=TRANSFER_SENDING)
+        try:
+            with open_blob(transfer.file.blob) as file:  # (decompressed)
+                get_api(transfer.printer.api_key).upload_stream(
+                    file, os.path.basename(transfer.file.name),
+                    start_print=transfer.start_print,
+                    callback=Progress(transfer),
+                )
+        except TransferCancelled:
+            _finish(transfer, TRANSFER_CANCELLED)
+        except DeviceError as e:
+            _finish(transfer, TRANSFER_FAILED, str(e))
+        except Exception as e:  # pylint: disable=broad-except
+            logger.exception('Transfer %s failed.', transfer_id)
+            _finish(transfer, TRANSFER_FAILED, str(e))
+        else:
+            _finish(transfer, TRANSFER_DONE)
+    finally:
+        close_old_connections()
+
+
+def fail_interrupted_transfers():
+    '''
+    marks transfers left queued or sending (by a stopped server) as failed,
+    returns their number (not to be called while uploads run)
+    '''
+    return FileTransfer.objects \
+        .filter(state__in=(TRANSFER_QUEUED, TRANSFER_SENDING)) \
+        .update(state=TRANSFER_FAILED, error=INTERRUPTED_ERROR, finished_on=timezone.now())
@@ -1,13 +1,53 @@
+from django.conf import settings
+from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
 from django.utils.functional import cached_property
 from rest_framework import viewsets, exceptions, status, permissions, decorators
-from karmen.viewsets import ObjectLevelAccessRestrictionViewSetMixin, NestedViewMixin
+from rest_framework.response import Response
+from karmen.viewsets import (
+    ObjectLevelAccessRestrictionViewSetMixin, NestedViewMixin, RelatedFieldsViewSetMixin, ConditionalGetViewSetMixin,
+    CachedListViewSetMixin,
+)
 from users.models import User
-from printers import models, serializers
+from printers import models, serializers, bulk
+from printers.status import get_device_states, get_version, get_versioned, diff_state, diff_states
+from printers.transfers import cancel_transfer
+from printers.webcam import get_snapshot, get_thumbnail
 from karmen.permissions import IsManagerOfObject, IsUserOfObject, IsUserOfParentObject, IsManagerOfParentObject
 
 
-class PrintersViewSet(ObjectLevelAccessRestrictionViewSetMixin, viewsets.ModelViewSet):
+def versioned_response(request, version, document, diff):
+    '''
+    Response with status `document` of `version` (see `printers.status`) for
+    polling clients.
+
+    The version is a weak ETag - `If-None-Match` with the current version gets
+    304. `?since=<version>` gets 304 too if nothing changed, otherwise just a
+    JSON merge patch of the changes since that version (`diff(since)`,
+    `application/merge-patch+json`) or the whole document (`application/json`)
+    if the version is not known anymore.
+    '''
+    etag = 'W/%s' % quote_etag(version)
+    since = request.query_params.get('since')
+    tags = [tag.replace('W/', '', 1) for tag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))]
+    if since == version or quote_etag(version) in tags or '*' in tags:
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        patch = diff(since) if since else None
+        if patch is not None:
+            response = Response(patch, content_type='application/merge-patch+json')
+        else:
+            response = Response(document)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+class PrintersViewSet(
+        ConditionalGetViewSetMixin, RelatedFieldsViewSetMixin, ObjectLevelAccessRestrictionViewSetMixin,
+        viewsets.ModelViewSet):
     '''General model view set for printers.
 
     Only Admin can list all printers.
@@ -18,25 +58,121 @@ class PrintersViewSet(ObjectLevelAccessRestrictionViewSetMixin, viewsets.ModelVi
     queryset = models.Printer.objects
 
     create_permissions = [permissions.IsAuthenticated]
+    ordering = ('-created_on', 'id')
+    prefetch_related_fields = {
+        'users': ['useronprinter_set__user'],
+        'groups': ['printeringroup_set__group'],
+    }
+    version_tables = (
+        'printers.useronprinter', 'printers.printeringroup', 'groups.useringroup', 'groups.group', 'users.user',
+    )
+    volatile_fields = ('octoprint', )
+    action_permissions = {
+        'webcam_snapshot': [IsUserOfObject],
+        'printer_status': [IsUserOfObject],
+        'bulk': [permissions.IsAuthenticated],
+        'bulk_users': [permissions.IsAuthenticated],
+    }
+
+    @decorators.action(detail=False, methods=['post', 'patch', 'delete'])
+    def bulk(self, request):
+        '''
+        Creates (POST), updates (PATCH, items with `id`) or deletes (DELETE,
+        `[{"id": ...}]`) many printers at once, see `printers.bulk`.
+
+        Returns `{"results": [...]}` with a result of each item.
+        '''
+        items = bulk.validate_items(request.data)
+        if request.method == 'POST':
+            results = bulk.create_printers(items, request, self.get_serializer_context())
+        elif request.method == 'PATCH':
+            results = bulk.update_printers(items, request, self.get_serializer_context())
+        else:
+            results = bulk.delete_printers(items, request)
+        return Response({'results': results})
+
+    @decorators.action(detail=False, methods=['post'], url_path='bulk/users')
+    def bulk_users(self, request):
+        '''
+        Sets roles of users on many printers at once
+        (`[{"printerId": ..., "username": ..., "role": "user" | "admin" | null}]`).
+        '''
+        return Response({'results': bulk.set_printer_users(bulk.validate_items(request.data), request)})
+
+    @decorators.action(detail=True, methods=['get'], url_path='webcam-snapshot')
+    def webcam_snapshot(self, request, pk=None):
+        '''
+        The latest snapshot of printer's webcam (see `printers.webcam`).
+
+        Snapshots are refreshed at most once per `WEBCAM_SNAPSHOT_INTERVAL`
+        seconds however many clients ask for them.
 
+        `?size=` (a key of `WEBCAM_THUMBNAIL_SIZES`) returns a downscaled
+        thumbnail instead, WebP if the client accepts it, JPEG otherwise.
+        '''
+        size = request.query_params.get('size')
+        if size is not None and size not in settings.WEBCAM_THUMBNAIL_SIZES:
+            raise exceptions.ValidationError({'size': 'Must be one of %s.' % ', '.join(settings.WEBCAM_THUMBNAIL_SIZES)})
+        printer = self.get_object()
+        if size is None:
+            snapshot, max_age = get_snapshot(printer), settings.WEBCAM_SNAPSHOT_INTERVAL
+        else:
+            accepts_webp = 'image/webp' in request.META.get('HTTP_ACCEPT', '')
+            content_type = 'image/webp' if accepts_webp else 'image/jpeg'
+            snapshot = get_thumbnail(printer, settings.WEBCAM_THUMBNAIL_SIZES[size], content_type)
+            max_age = settings.WEBCAM_THUMBNAIL_TTL
+        if snapshot.error:
+            return Response({'detail': snapshot.error}, status=snapshot.status)
+        response = HttpResponse(snapshot.content, content_type=snapshot.content_type)
+        response['Cache-Control'] = 'private, max-age=%d' % max_age
+        if size is not None:
+            patch_vary_headers(response, ('Accept',))
+        return response
 
+    @decorators.action(detail=True, methods=['get'], url_path='status')
+    def printer_status(self, request, pk=None):
+        '''
+        Versioned status document of the printer (the same as its `octoprint`
+        field), see `versioned_response`.
+        '''
+        printer = self.get_object()
+        state = get_device_states([printer])[printer.pk]
+        return versioned_response(request, get_version(state), state, lambda since: diff_state(printer.pk, since, state))
 
-class MyPrintersViewSet(PrintersViewSet):
+
+class MyPrintersViewSet(CachedListViewSetMixin, PrintersViewSet):
     '''
     Printers on currently logged in user.
 
     Same as General priters viewset but limited to printers of logged in user.
-    Any authenticated user can list (his/her printers).
+    Any authenticated user can list (his/her printers), the rendered list is
+    cached (see `CachedListViewSetMixin`).
     '''
 
     listing_permissions = [IsUserOfObject]
+    cached_tables = ('printers.printer', )
+    cached_field_tables = {
+        'users': ('printers.useronprinter', 'users.user'),
+        'groups': ('printers.printeringroup', 'groups.group'),
+    }
+    action_permissions = dict(PrintersViewSet.action_permissions, statuses=[permissions.IsAuthenticated])
 
     def get_queryset(self):
         return models.Printer.for_user(self.request.user)
 
+    @decorators.action(detail=False, methods=['get'], url_path='status')
+    def statuses(self, request):
+        '''
+        Versioned document `{printer id: status}` of all printers of the user,
+        see `versioned_response`.
+        '''
+        states = get_device_states(list(self.get_queryset().only('id', 'api_key')))
+        version = get_versioned(request.user.pk, states)
+        return versioned_response(request, version, states, lambda since: diff_states(request.user.pk, since, states))
+
 
 
-class UsersOnPrinterViewSet(NestedViewMixin, ObjectLevelAccessRestrictionViewSetMixin, viewsets.ModelViewSet):
+class UsersOnPrinterViewSet(NestedViewMixin, RelatedFieldsViewSetMixin, ObjectLevelAccessRestrictionViewSetMixin, viewsets.ModelViewSet):
     '''
     List / delete / update users assigned to printer.
 
@@ -50,13 +186,14 @@ class UsersOnPrinterViewSet(NestedViewMixin, ObjectLevelAccessRestrictionViewSet
     parent_model = models.Printer  # this list is limited to a Printer
     listing_permissions = [IsUserOfParentObject]
     create_permissions = [IsManagerOfParentObject]
+    select_related_fields = {'username': ['user'], 'url': ['user']}
 
     def get_queryset(self):
         return models.UserOnPrinter.objects.filter(printer=self.request.parent_instance)
 
 
 
-class PrinterGroupsViewSet(NestedViewMixin, ObjectLevelAccessRestrictionViewSetMixin, viewsets.ModelViewSet):
+class PrinterGroupsViewSet(NestedViewMixin, RelatedFieldsViewSetMixin, ObjectLevelAccessRestrictionViewSetMixin, viewsets.ModelViewSet):
     '''
     Lives under printer endpoint.
     List / delete / update groups the printer belongs to.
@@ -67,12 +204,13 @@ class PrinterGroupsViewSet(NestedViewMixin, ObjectLevelAccessRestrictionViewSetM
     lookup_url_kwarg = 'group_id'
     parent_model = models.Printer
     listing_permissions = create_permissions = [IsUserOfParentObject]
+    select_related_fields = {'groupId': ['group'], 'groupName': ['group']}
 
     def get_queryset(self):
         return models.PrinterInGroup.objects.filter(printer=self.request.parent_instance)
 
 
-class PrintersInGroupViewSet(NestedViewMixin, ObjectLevelAccessRestrictionViewSetMixin, viewsets.ModelViewSet):
+class PrintersInGroupViewSet(NestedViewMixin, RelatedFieldsViewSetMixin, ObjectLevelAccessRestrictionViewSetMixin, viewsets.ModelViewSet):
     '''
     Lives under group endpoint.
 
@@ -84,8 +222,41 @@ class PrintersInGroupViewSet(NestedViewMixin, ObjectLevelAccessRestrictionViewSe
     parent_model = 'groups.Group'
     listing_permissions = [IsUserOfParentObject]
     create_permissions = [IsManagerOfParentObject&IsManagerOfObject]
+    action_permissions = {'bulk': [IsManagerOfParentObject]}
+    select_related_fields = {'printerId': ['printer'], 'printerName': ['printer'], 'printerUrl': ['printer']}
 
     def get_queryset(self):
         return models.PrinterInGroup.objects.filter(group=self.request.parent_instance)
 
+    @decorators.action(detail=False, methods=['post', 'delete'])
+    def bulk(self, request, group_id=None):
+        '''adds (POST) or removes (DELETE) many printers (`[{"printerId": ...}]`) at once'''
+        items = bulk.validate_items(request.data)
+        if request.method == 'POST':
+            results = bulk.add_group_printers(request.parent_instance, items, request)
+        else:
+            results = bulk.remove_group_printers(request.parent_instance, items)
+        return Response({'results': results})
+
+
+class TransfersViewSet(ObjectLevelAccessRestrictionViewSetMixin, viewsets.ReadOnlyModelViewSet):
+    '''
+    Files being sent to printers (see `printers.transfers`).
+
+    Lists transfers to printers of the current user. Transfers are started by
+    `files/<id>/send` endpoint and cancelled by `transfers/<id>/cancel`.
+    '''
+
+    serializer_class = serializers.FileTransferSerializer
+    listing_permissions = [permissions.IsAuthenticated]
+    action_permissions = {'cancel': [IsManagerOfObject]}
+    ordering = ('-created_on', 'id')
+
+    def get_queryset(self):
+        return models.FileTransfer.objects.filter(printer__access__user=self.request.user)
 
+    @decorators.action(detail=True, methods=['post'])
+    def cancel(self, request, pk=None):
+        transfer = self.get_object()
+        cancel_transfer(transfer)
+        return Response(self.get_serializer(transfer).data)
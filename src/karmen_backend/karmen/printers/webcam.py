@@ -0,0 +1,183 @@
+'''
+Webcam snapshot proxy
+
+Snapshots of printer webcams are fetched from the devices (`snapshotUrl` of
+Octoprint settings) and served from process memory. A snapshot of a printer is
+fetched at most once per `WEBCAM_SNAPSHOT_INTERVAL` seconds, no matter how many
+clients watch it: requests which find the snapshot outdated wait for a single
+fetch (the first of them makes it) and all of them get its result. Failures are
+cached the same way so an offline camera is not asked again by every viewer.
+
+Thumbnails (`WEBCAM_THUMBNAIL_SIZES`, JPEG or WebP) are made from the cached
+snapshot, each of them once per fetched frame, and kept with it. As previews
+do not need to be live, a thumbnail is made from a snapshot up to
+`WEBCAM_THUMBNAIL_TTL` seconds old.
+
+The cache is per process - snapshots are served by a dedicated multi-threaded
+uwsgi process (see `scripts/uwsgi-webcam-snapshots.ini`), so all viewers share
+it.
+'''
+import io
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from urllib.parse import urljoin, urlparse, urlunparse
+from django.conf import settings
+from PIL import Image
+from karmen.models import join_id
+from printers.device_query import get_api, MISSING_CONNECTION_ERROR
+from printers.octoprint import DeviceError
+
+
+NO_WEBCAM_ERROR = 'The printer has no webcam.'
+NOT_AN_IMAGE_ERROR = 'The webcam snapshot is not an image.'
+FOREIGN_WEBCAM_ERROR = 'The webcam is not served by the printer device.'
+LOOPBACK_HOSTS = ('127.0.0.1', 'localhost', '::1')
+
+THUMBNAIL_FORMATS = {'image/webp': 'WEBP', 'image/jpeg': 'JPEG'}
+'''{content type: Pillow format} of thumbnails'''
+
+
+class Snapshot(object):
+    '''fetched webcam snapshot or the error which prevented it'''
+
+    def __init__(self, content=None, content_type=None, error=None, status=None, fetched_on=None):
+        self.content = content
+        self.content_type = content_type
+        self.error = error
+        self.status = status
+        '''suggested http status of the error'''
+        self.fetched_on = monotonic() if fetched_on is None else fetched_on
+        self.thumbnails = {}
+        '''{(size, content type): Snapshot} - thumbnails made of this snapshot'''
+        self._thumbnails_lock = Lock()
+
+    def thumbnail(self, size, content_type):
+        '''
+        Thumbnail of this snapshot fitting `size` (width, height) encoded as
+        `content_type` (see `THUMBNAIL_FORMATS`), made just once.
+        '''
+        if self.error:
+            return self
+        key = (size, content_type)
+        thumbnail = self.thumbnails.get(key)
+        if thumbnail is None:
+            with self._thumbnails_lock:
+                thumbnail = self.thumbnails.get(key)
+                if thumbnail is None:
+                    try:
+                        content = make_thumbnail(self.content, size, THUMBNAIL_FORMATS[content_type])
+                        thumbnail = Snapshot(content=content, content_type=content_type, fetched_on=self.fetched_on)
+                    except (OSError, ValueError, Image.DecompressionBombError):
+                        thumbnail = Snapshot(error=NOT_AN_IMAGE_ERROR, status=502, fetched_on=self.fetched_on)
+                    self.thumbnails[key] = thumbnail
+        return thumbnail
+
+
+class SnapshotCache(object):
+    '''
+    Latest snapshots by key (at most `max_entries` of them, the least recently
+    fetched are dropped).
+    '''
+
+    def __init__(self, interval, max_entries):
+        self.interval = interval
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        '''{key: [snapshot, lock of its fetch]}'''
+        self._lock = Lock()
+
+    def _entry(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = [None, Lock()]
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            return entry
+
+    def _fresh(self, snapshot, max_age):
+        return snapshot is not None and monotonic() - snapshot.fetched_on < max_age
+
+    def get(self, key, fetch, max_age=None):
+        '''
+        returns snapshot of `key`, calls `fetch()` (single flight) if it is
+        older than `max_age` (`interval` by default)
+        '''
+        max_age = max(self.interval, max_age or 0)
+        entry = self._entry(key)
+        if self._fresh(entry[0], max_age):
+            return entry[0]
+        with entry[1]:
+            if not self._fresh(entry[0], max_age):  # (unless fetched while waiting for the lock)
+                entry[0] = fetch()
+                with self._lock:
+                    if key in self._entries:
+                        self._entries.move_to_end(key)
+            return entry[0]
+
+
+snapshot_cache = SnapshotCache(
+    interval=settings.WEBCAM_SNAPSHOT_INTERVAL,
+    max_entries=settings.WEBCAM_SNAPSHOT_CACHE_SIZE,
+)
+
+
+def device_url(api_uri, path):
+    '''
+    URL of webcam resource advertised by the device as `path`.
+
+    Relative paths are resolved against the device, loopback hosts
+    (Octoprint's default is `http://127.0.0.1:8080/?action=snapshot`) refer to
+    the device too. Raises DeviceError if `path` points to another host (the
+    backend must not be made to fetch arbitrary URLs).
+    '''
+    parts = urlparse(urljoin(api_uri, path))
+    device = urlparse(api_uri).hostname
+    if parts.hostname in LOOPBACK_HOSTS:
+        port = ':%s' % parts.port if parts.port else ''
+        parts = parts._replace(netloc=(device if ':' not in device else '[%s]' % device) + port)
+    elif parts.hostname != device or parts.scheme not in ('http', 'https'):
+        raise DeviceError(FOREIGN_WEBCAM_ERROR)
+    return urlunparse(parts)
+
+
+def fetch_snapshot(printer):
+    '''fetches the current snapshot of `printer` from its device'''
+    if not printer.api_key:
+        return Snapshot(error=MISSING_CONNECTION_ERROR, status=503)
+    api = get_api(printer.api_key)
+    try:
+        webcam = (api.get_settings() or {}).get('webcam') or {}
+        if not webcam.get('snapshotUrl') or webcam.get('webcamEnabled') is False:
+            return Snapshot(error=NO_WEBCAM_ERROR, status=404)
+        content_type, content = api.get_resource(
+            device_url(printer.api_key, webcam['snapshotUrl']), max_size=settings.WEBCAM_SNAPSHOT_MAX_SIZE)
+    except DeviceError as e:
+        return Snapshot(error=str(e), status=502)
+    return Snapshot(content=content, content_type=content_type)
+
+
+def get_snapshot(printer, max_age=None):
+    '''the latest snapshot of `printer` webcam (see `snapshot_cache`)'''
+    return snapshot_cache.get((join_id(printer.pk), printer.api_key), lambda: fetch_snapshot(printer), max_age)
+
+
+def make_thumbnail(content, size, image_format):
+    '''encoded image `content` downscaled to fit `size` and encoded in Pillow `image_format`'''
+    with Image.open(io.BytesIO(content)) as image:
+        # (JPEG is decoded right in the reduced scale)
+        image.thumbnail(size, Image.LANCZOS)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        output = io.BytesIO()
+        image.save(output, image_format, quality=settings.WEBCAM_THUMBNAIL_QUALITY)
+    return output.getvalue()
+
+
+def get_thumbnail(printer, size, content_type):
+    '''
+    thumbnail of a snapshot of `printer` webcam (at most `WEBCAM_THUMBNAIL_TTL`
+    seconds old), see `Snapshot.thumbnail`
+    '''
+    return get_snapshot(printer, settings.WEBCAM_THUMBNAIL_TTL).thumbnail(size, content_type)
@@ -0,0 +1,182 @@
+'''
+Webcam stream relay
+
+`webcam_stream` is a plain ASGI application (django 3.1 can not stream
+responses from async views) mounted by `karmen/asgi.py` at
+`printers/<id>/webcam-stream`. It relays the MJPEG stream of printer's webcam
+(`streamUrl` of Octoprint settings) as `multipart/x-mixed-replace` response.
+
+Each camera has a single upstream connection (`Relay`) no matter how many
+clients watch it. Every frame is offered to all subscribed clients through
+queues holding just one frame - a slow client skips frames instead of
+buffering them. The upstream connection is closed when the last client
+leaves.
+
+Clients authenticate by JWT access token in `Authorization` header or in
+`token` query parameter (see `karmen.asgi_utils.authenticate`).
+'''
+import asyncio
+from logging import getLogger
+import aiohttp
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from karmen.asgi_utils import authenticate, respond, wait_for_disconnect, FORBIDDEN, NOT_AUTHENTICATED
+from karmen.models import join_id
+from printers.device_query import get_async_api, MISSING_CONNECTION_ERROR
+from printers.models import Printer
+from printers.octoprint import DeviceError
+from printers.octoprint_async import get_session, session_scope
+from printers.webcam import device_url, NO_WEBCAM_ERROR
+
+
+logger = getLogger()
+
+BOUNDARY = b'karmen-frame'
+
+_relays = {}
+'''{(printer id, api_key): Relay} - relays of the event loop of the ASGI server'''
+
+
+class Relay(object):
+    '''the upstream connection of a single camera fanning its frames out to subscribers'''
+
+    def __init__(self, key, url):
+        self.key = key
+        self.url = url
+        self.subscribers = set()
+        '''queues of subscribed clients'''
+        self.task = None
+
+    def subscribe(self):
+        '''returns queue which will get frames of the stream (`None` when it ends)'''
+        queue = asyncio.Queue(maxsize=1)
+        self.subscribers.add(queue)
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+        if not self.subscribers:
+            self._unregister()
+            if self.task is not None and not self.task.done():
+                self.task.cancel()
+
+    def _unregister(self):
+        if _relays.get(self.key) is self:
+            del _relays[self.key]
+
+    def publish(self, frame):
+        for queue in self.subscribers:
+            if queue.full():
+                queue.get_nowait()  # the client did not take the previous frame yet - drop it
+            queue.put_nowait(frame)
+
+    async def run(self):
+        '''reads frames from the camera until the stream ends or the last subscriber leaves'''
+        try:
+            async with session_scope(), get_session().get(self.url, allow_redirects=False) as response:
+                if response.status != 200:
+                    logger.info('Webcam stream %s responded %s.', self.url, response.status)
+                    return
+                reader = aiohttp.MultipartReader(response.headers, response.content)
+                while True:
+                    part = await reader.next()
+                    if part is None:
+                        return
+                    frame = await read_frame(part)
+                    if frame:
+                        self.publish((part.headers.get('Content-Type', 'image/jpeg'), frame))
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, AssertionError) as e:
+            logger.info('Webcam stream %s failed: %s', self.url, e)
+        finally:
+            self._unregister()
+            self.publish(None)
+
+
+async def read_frame(part):
+    '''content of multipart `part` (at most `WEBCAM_SNAPSHOT_MAX_SIZE` bytes)'''
+    frame = bytearray()
+    while True:
+        chunk = await part.read_chunk()
+        if not chunk:
+            return bytes(frame)
+        frame += chunk
+        if len(frame) > settings.WEBCAM_SNAPSHOT_MAX_SIZE:
+            raise ValueError('The frame is too large.')
+
+
+async def get_relay(printer):
+    '''running relay of `printer`'s webcam or a new one, raises `LookupError` if it has no webcam'''
+    key = (join_id(printer.pk), printer.api_key)
+    relay = _relays.get(key)
+    if relay is None:
+        async with session_scope():
+            webcam = ((await get_async_api(printer.api_key).get_settings()) or {}).get('webcam') or {}
+        if not webcam.get('streamUrl') or webcam.get('webcamEnabled') is False:
+            raise LookupError(NO_WEBCAM_ERROR)
+        # (another client might have started the relay meanwhile)
+        relay = _relays.setdefault(key, Relay(key, device_url(printer.api_key, webcam['streamUrl'])))
+    return relay
+
+
+def _get_printer(user, printer_id):
+    '''(printer, error status)'''
+    try:
+        printer = Printer.objects.get(pk=printer_id)
+    except Printer.DoesNotExist:
+        return None, 404
+    if not printer.can_view(user):
+        return None, 403
+    return printer, None
+
+
+async def webcam_stream(scope, receive, send, printer_id):
+    '''ASGI application relaying webcam stream of printer `printer_id`'''
+    user = await sync_to_async(authenticate, thread_sensitive=True)(scope)
+    if user is None:
+        return await respond(send, 403, NOT_AUTHENTICATED)
+    printer, status = await sync_to_async(_get_printer, thread_sensitive=True)(user, printer_id)
+    if printer is None:
+        return await respond(send, status, 'Not found.' if status == 404 else FORBIDDEN)
+    if not printer.api_key:
+        return await respond(send, 503, MISSING_CONNECTION_ERROR)
+    try:
+        relay = await get_relay(printer)
+    except LookupError as e:
+        return await respond(send, 404, str(e))
+    except DeviceError as e:
+        return await respond(send, 502, str(e))
+
+    queue = relay.subscribe()
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'multipart/x-mixed-replace; boundary=' + BOUNDARY),
+                (b'cache-control', b'no-cache, private'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        while True:
+            next_frame = asyncio.ensure_future(queue.get())
+            await asyncio.wait((next_frame, disconnected), return_when=asyncio.FIRST_COMPLETED)
+            if not next_frame.done():
+                next_frame.cancel()
+                return
+            frame = next_frame.result()
+            if frame is None:
+                break
+            content_type, content = frame
+            await send({
+                'type': 'http.response.body',
+                'body': b'--%s\r\nContent-Type: %s\r\nContent-Length: %d\r\n\r\n%s\r\n' % (
+                    BOUNDARY, content_type.encode('latin-1'), len(content), content),
+                'more_body': True,
+            })
+        await send({'type': 'http.response.body', 'body': b'--%s--\r\n' % BOUNDARY})
+    finally:
+        relay.unsubscribe(queue)
+        disconnected.cancel()
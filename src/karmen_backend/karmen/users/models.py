@@ -10,7 +10,7 @@ class User(AbstractUser):
 
     id = IdField()
 
-    def can_view(self, user):
+    def can_view(self, user, access=None):
         return user == self
 
     def can_modify(self):
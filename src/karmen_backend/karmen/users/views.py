@@ -29,6 +29,7 @@ class UsersViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAdminUser]
     serializer_class = UserSerializer
     queryset = User.objects.all()
+    ordering = ('-date_joined', 'id')
 
     def get_permissions(self):
         """
@@ -13,6 +13,7 @@ echo "Starting backend service $SERVICE in mode '$ENV'"
 
 
 python3 ./karmen/manage.py migrate
+python3 ./karmen/manage.py fail_interrupted_transfers
 python3 ./karmen/manage.py generate_test_data
 python3 ./karmen/manage.py runserver 0.0.0.0:8000
 